@@ -66,6 +66,10 @@ install_requires = [
 ]
 
 extras_require = {
+    'codecs': [  # faster codecs for the VIP frames, negotiated with the router
+        'msgpack',
+        'orjson'
+    ],
     'crate': [  # crate databases
         'crate'
     ],
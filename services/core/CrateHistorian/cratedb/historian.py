@@ -45,7 +45,7 @@ import pytz
 
 from volttron.platform import jsonapi
 from volttron.platform.agent import utils
-from volttron.platform.agent.base_historian import BaseHistorian
+from volttron.platform.agent.base_historian import BaseHistorian, expand_device_frame
 from volttron.platform.agent.utils import get_utc_seconds_from_epoch
 from volttron.platform.dbutils.crateutils import (create_schema,
                                                   select_all_topics_query,
@@ -108,6 +108,8 @@ class CrateHistorian(BaseHistorian):
 
     """
 
+    supports_device_frames = True
+
     def __init__(self, config_connection, tables_def=None, **kwargs):
         """
         Initialize the historian.
@@ -229,8 +231,13 @@ class CrateHistorian(BaseHistorian):
         # Attempt to create the schema
         create_schema(self._client, self._schema, table_names)
 
-        # Cache topic and metadata
-        self.load_topic_meta()
+    def historian_setup(self):
+        # Cache topic and metadata so that publish_to_historian only has to
+        # insert the topics that are new.
+        try:
+            self.load_topic_meta()
+        except Exception as ex:
+            _log.error("Unable to load topics: {}".format(repr(ex)))
 
     @staticmethod
     def get_client(host, error_trace=False):
@@ -269,8 +276,15 @@ class CrateHistorian(BaseHistorian):
             cursor = self._client.cursor()
 
             batch_data = []
-
-            for row in to_publish_list:
+            # Record each row of batch_data comes from, frames add one row
+            # per point.
+            batch_records = []
+            # Topics seen for the first time and topics whose metadata
+            # changed in this batch, the last metadata of a topic wins.
+            new_topics = {}
+            updated_meta = {}
+
+            for record, row in self._iter_points(to_publish_list):
                 ts = utils.format_timestamp(row['timestamp'])
                 source = row['source']
                 topic = row['topic']
@@ -284,41 +298,31 @@ class CrateHistorian(BaseHistorian):
                     value = dumps(value)
 
                 if topic_lower not in self._topic_meta:
-                    try:
-                        cursor.execute(insert_topic_query(self._schema, self._topic_table),
-                                       (topic, meta))
-                    except ProgrammingError as ex:
-                        if ex.args[0].startswith(
-                                'SQLActionException[DuplicateKeyException'):
-                            self._topic_meta[topic_lower] = meta
-                        else:
-                            _log.error(repr(ex))
-                            _log.error(
-                                "Unknown error during topic insert {} {}".format(
-                                    type(ex), ex.args
-                                ))
-                    else:
-                        self._topic_meta[topic_lower] = meta
-                else:
-                    # check if metadata matches
-                    old_meta = self._topic_meta.get(topic_lower)
-                    if not old_meta:
-                        old_meta = {}
-                    if set(old_meta.items()) != set(meta.items()):
-                        _log.debug(
-                            'Updating meta for topic: {} {}'.format(topic,
-                                                                    meta))
-                        self._topic_meta[topic_lower] = meta
-                        cursor.execute(update_topic_query(self._schema, self._topic_table),
-                                       (meta, topic))
+                    new_topics[topic_lower] = (topic, meta)
+                elif (self._topic_meta.get(topic_lower) or {}) != meta:
+                    updated_meta[topic_lower] = (meta, topic)
 
                 batch_data.append(
                     (ts, topic, source, value, meta)
                 )
+                batch_records.append(record)
+
+            if new_topics:
+                self._insert_topics(cursor, list(new_topics.values()))
+            if updated_meta:
+                _log.debug('Updating meta for {} topics'.format(
+                    len(updated_meta)))
+                cursor.executemany(
+                    update_topic_query(self._schema, self._topic_table),
+                    list(updated_meta.values()))
+                for topic_lower, (meta, topic) in updated_meta.items():
+                    self._topic_meta[topic_lower] = meta
 
             try:
                 query = insert_data_query(self._schema, self._data_table)
                 # _log.debug("Inserting batch data: {}".format(batch_data))
+                # executemany sends all the rows as the bulk_args of a single
+                # request.
                 results = cursor.executemany(query, batch_data)
 
                 index = 0
@@ -332,7 +336,7 @@ class CrateHistorian(BaseHistorian):
                     for findex in failures:
                         data = batch_data[findex]
                         _log.error("Failed to insert data {}".format(data))
-                        self.report_handled(to_publish_list[findex])
+                        self.report_handled(batch_records[findex])
 
             except ProgrammingError as ex:
                 _log.error(
@@ -340,18 +344,21 @@ class CrateHistorian(BaseHistorian):
                         ex.args))
                 _log.debug("Attempting singleton insert.")
                 insert = insert_data_query(self._schema, self._data_table)
-                for id in range(len(batch_data)):
+                # A frame is only handled if all of its points were saved.
+                failed = set()
+                for index, batch in enumerate(batch_data):
                     try:
-                        batch = batch_data[id]
                         cursor.execute(insert, batch)
                     except ProgrammingError:
                         _log.debug('Invalid data not saved {}'.format(
                             batch
                         ))
+                        failed.add(id(batch_records[index]))
                     except Exception as ex:
                         _log.error(repr(ex))
-                    else:
-                        self.report_handled(to_publish_list[id])
+                        failed.add(id(batch_records[index]))
+                self.report_handled([r for r in to_publish_list
+                                     if id(r) not in failed])
 
             except Exception as ex:
                 _log.error(
@@ -378,6 +385,41 @@ class CrateHistorian(BaseHistorian):
         # full_time = end_time - start_time
         # _log.debug("Took {} seconds to publish.".format(full_time))
 
+    def _insert_topics(self, cursor, topics):
+        """
+        Insert new topics and their metadata with one bulk request. Topics
+        that already exist in the topics table, for example inserted by
+        another historian, are only cached.
+
+        :param cursor: cursor of the client connection
+        :param topics: list of (topic, meta) tuples
+        """
+        query = insert_topic_query(self._schema, self._topic_table)
+        bulk_failed = False
+        try:
+            cursor.executemany(query, topics)
+        except ProgrammingError as ex:
+            _log.error("Bulk topic insert failed: {}. Inserting topics one "
+                       "at a time".format(ex.args))
+            bulk_failed = True
+
+        for topic, meta in topics:
+            if bulk_failed:
+                try:
+                    cursor.execute(query, (topic, meta))
+                except ProgrammingError as ex:
+                    if not ex.args[0].startswith(
+                            'SQLActionException[DuplicateKeyException'):
+                        _log.error(repr(ex))
+                        _log.error(
+                            "Unknown error during topic insert {} {}".format(
+                                type(ex), ex.args
+                            ))
+                        continue
+            # Rows of the bulk insert that failed are topics that already
+            # exist.
+            self._topic_meta[topic.lower()] = meta
+
     @staticmethod
     def _build_single_topic_select_query(start, end, agg_type, agg_period, skip,
                                          count, order, table_name, topic):
@@ -535,6 +577,19 @@ class CrateHistorian(BaseHistorian):
             results['metadata'] = self._topic_meta[topics[0].lower()]
         return results
 
+    @staticmethod
+    def _iter_points(to_publish_list):
+        """
+        Yield (record, point record) for every point to publish, expanding
+        device frames into their points.
+        """
+        for record in to_publish_list:
+            if record.get('frame'):
+                for point in expand_device_frame(record):
+                    yield record, point
+            else:
+                yield record, record
+
     @doc_inherit
     def query_topic_list(self):
         _log.debug("Querying topic list")
@@ -165,9 +165,10 @@ class DataMover(BaseHistorian):
 
         payload = {'headers': headers, 'message': data}
 
-        self._event_queue.put({'source': "forwarded",
-                               'topic': topic,
-                               'readings': [(timestamp_string, payload)]})
+        self._queue_records([{'source': "forwarded",
+                              'topic': topic,
+                              'readings': [(timestamp_string, payload)],
+                              'queued': time.monotonic()}])
 
     def publish_to_historian(self, to_publish_list):
         _log.debug("publish_to_historian number of items: {}".format(len(to_publish_list)))
@@ -311,9 +311,10 @@ class ForwardHistorian(BaseHistorian):
 
         payload = {'headers': headers, 'message': data}
 
-        self._event_queue.put({'source': "forwarded",
-                               'topic': topic,
-                               'readings': [(timestamp_string, payload)]})
+        self._queue_records([{'source': "forwarded",
+                              'topic': topic,
+                              'readings': [(timestamp_string, payload)],
+                              'queued': time.monotonic()}])
 
     @doc_inherit
     def publish_to_historian(self, to_publish_list):
@@ -117,6 +117,8 @@ class InfluxdbHistorian(BaseHistorian):
         self._host = self._connection_params.get('host', None)
         self._user = self._connection_params.get('user', None)
         self._database = self._connection_params.get('database', None)
+        self._max_write_size = self._connection_params.get('max_write_size',
+                                                           influxdbutils.MAX_WRITE_SIZE)
         self._client = None
 
         # Config for aggregation queries, can be changed in config file.
@@ -147,12 +149,17 @@ class InfluxdbHistorian(BaseHistorian):
                   "port": 8086,
                   "database": "historian",
                   "user": "historian",
-                  "passwd": "historian"
+                  "passwd": "historian",
+                  "gzip": false,
+                  "max_write_size": 5000000
                 }
               }
             }
 
-        If user and passwd are optional if authentication is disabled
+        If user and passwd are optional if authentication is disabled.
+        gzip and max_write_size are optional: gzip compresses the write
+        requests and max_write_size (in bytes) splits a batch into several
+        write requests.
         """
         try:
             params = configuration['connection']['params']
@@ -160,6 +167,7 @@ class InfluxdbHistorian(BaseHistorian):
             db = params['database']
             user = params.get('user', None)
             passwd = params.get('passwd', None)
+            max_write_size = params.get('max_write_size', influxdbutils.MAX_WRITE_SIZE)
             if configuration['aggregations']:
                 use_calendar_time_periods = configuration['aggregations']['use_calendar_time_periods']
         except (KeyError, TypeError) as err:
@@ -188,6 +196,10 @@ class InfluxdbHistorian(BaseHistorian):
             _log.info("Changing user to {}".format(user))
             self._user = user
 
+        if max_write_size != self._max_write_size:
+            _log.info("Changing max_write_size to {}".format(max_write_size))
+            self._max_write_size = max_write_size
+
         client = influxdbutils.get_client(params)
 
         if not client:
@@ -220,56 +232,77 @@ class InfluxdbHistorian(BaseHistorian):
         _log.debug("publish_to_historian number of items: {}".format(
             len(to_publish_list)))
 
-        try:
-            for stored_index, row in enumerate(to_publish_list):
-                ts = utils.format_timestamp(row['timestamp'])
-                source = row['source']
-                topic = row['topic']
+        # Build the points of the whole batch, coalescing metadata updates
+        # so that each topic gets at most one meta point per batch.
+        points = []
+        meta_updates = {}
+        for index, row in enumerate(to_publish_list):
+            source = row['source']
+            topic = row['topic']
 
-                # record/* has got wrong format for InfluxDB, only timeseries data
-                if topic.startswith('record/'):
-                    continue
+            # record/* has got wrong format for InfluxDB, only timeseries data
+            if topic.startswith('record/'):
+                continue
 
-                meta = row['meta']
-                value = row['value']
-                value_string = str(value)
+            meta = row['meta']
+            value = row['value']
+            value_string = str(value)
 
-                # Check type of value from metadata if it exists,
-                # then cast value to that type
-                try:
-                    value_type = meta["type"]
-                    value = influxdbutils.value_type_matching(value_type, value)
-                except KeyError:
-                    _log.info("Metadata doesn't include \'type\' keyword")
-                except ValueError:
-                    _log.warning("Metadata specifies \'type\' of value is {} while "
-                                 "value={} is type {}".format(value_type, value, type(value)))
+            # Check type of value from metadata if it exists,
+            # then cast value to that type
+            try:
+                value_type = meta["type"]
+                value = influxdbutils.value_type_matching(value_type, value)
+            except KeyError:
+                _log.info("Metadata doesn't include \'type\' keyword")
+            except ValueError:
+                _log.warning("Metadata specifies \'type\' of value is {} while "
+                             "value={} is type {}".format(value_type, value, type(value)))
+
+            topic_id = topic.lower()
+            if topic_id in meta_updates:
+                current_topic, current_meta, _ = meta_updates[topic_id]
+            else:
+                current_topic = self._topic_id_map.get(topic_id, topic)
+                current_meta = self._meta_dicts.get(topic_id, {})
 
-                topic_id = topic.lower()
+            # If topic's metadata or topic name in database changes, update
+            # its metadata once the batch is built.
+            if meta != current_meta or topic != current_topic:
+                meta_updates[topic_id] = (topic, meta, utils.format_timestamp(row['timestamp']))
 
-                # If the topic is not in the list
-                if topic_id not in self._topic_id_map:
-                    self._topic_id_map[topic_id] = topic
-                    self._meta_dicts[topic_id] = {}
+            points.append((index, row['timestamp'], topic_id, source, value, value_string))
 
-                # If topic's metadata changes, update its metadata.
-                if topic_id in self._topic_id_map and meta != self._meta_dicts[topic_id]:
+        precision, unit = influxdbutils.get_precision([point[1] for point in points])
+        lines = [influxdbutils.data_point_line(ts, topic_id, source, value, value_string, unit)
+                 for _, ts, topic_id, source, value, value_string in points]
 
-                    _log.info("Updating meta for topic {} at {}".format(topic_id, ts))
-                    self._meta_dicts[topic_id] = meta
-
-                    # Insert the meta into the database
-                    influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
-                # Else if topic name in database changes, update.
-                elif topic_id in self._topic_id_map and self._topic_id_map[topic_id] != topic:
-                    _log.info("Updating actual topic name {} in database for topic id {}".format(topic, topic_id))
+        written = 0
+        try:
+            if meta_updates:
+                _log.info("Updating meta for topics {}".format(list(meta_updates)))
+                influxdbutils.write_lines(self._client, self._database,
+                                          [influxdbutils.meta_line(topic_id, topic, meta, ts)
+                                           for topic_id, (topic, meta, ts) in meta_updates.items()],
+                                          's')
+                for topic_id, (topic, meta, _) in meta_updates.items():
                     self._topic_id_map[topic_id] = topic
+                    self._meta_dicts[topic_id] = meta
 
-                    # Update topic name in the database
-                    influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
-
-                # Insert data point
-                influxdbutils.insert_data_point(self._client, ts, topic_id, source, value, value_string)
+            for start, end in influxdbutils.chunk_lines(lines, self._max_write_size):
+                try:
+                    influxdbutils.write_lines(self._client, self._database, lines[start:end], precision)
+                except InfluxDBClientError as err:
+                    if err.code != 400:
+                        raise
+                    # The whole chunk is rejected when a value conflicts with
+                    # the field type already in the database. Insert its
+                    # points one by one so that conflicting values are cast.
+                    _log.warning("Batch write rejected, inserting points one by one: {}".format(err))
+                    for _, ts, topic_id, source, value, value_string in points[start:end]:
+                        influxdbutils.insert_data_point(self._client, utils.format_timestamp(ts),
+                                                        topic_id, source, value, value_string)
+                written = end
 
             # After all data points are published
             self.report_all_handled()
@@ -278,8 +311,9 @@ class InfluxdbHistorian(BaseHistorian):
         except ConnectionError as err:
             raise err
         except InfluxDBClientError as err:
-            _log.error("Stored [:{}] data in to_publish_list to InfluxDB client".format(stored_index-1))
-            self.report_handled(to_publish_list[:stored_index-1])
+            stored_index = points[written][0] if written < len(points) else len(to_publish_list)
+            _log.error("Stored [:{}] data in to_publish_list to InfluxDB client".format(stored_index))
+            self.report_handled(to_publish_list[:stored_index])
             raise err
 
     @doc_inherit
@@ -287,6 +287,31 @@ def publish_data_with_updated_topic_case(publish_agent, data_count):
     gevent.sleep(2)
 
 
+@pytest.mark.historian
+@pytest.mark.skipif(not HAS_INFLUXDB, reason='No influxdb library. Please run \'pip install influxdb\'')
+def test_line_protocol_batch():
+    """
+    Test that a batch is encoded in line protocol at the coarsest precision
+    of its timestamps and split under the write size limit.
+    """
+    ts = datetime(2020, 1, 1, 0, 0, 1, tzinfo=pytz.utc)
+    assert influxdbutils.get_precision([ts]) == ('s', 1000000)
+    assert influxdbutils.get_precision([ts, ts.replace(microsecond=500000)]) == ('ms', 1000)
+    assert influxdbutils.get_precision([ts.replace(microsecond=1)]) == ('u', 1)
+
+    line = influxdbutils.data_point_line(ts.replace(microsecond=500000), 'campus/building 1/device/p,t',
+                                         'scrape', 3, '3', 1000)
+    assert line == 'p\\,t,building=building\\ 1,campus=campus,device=device,source=scrape ' \
+                   'value=3i,value_string="3" 1577836801500'
+
+    line = influxdbutils.data_point_line(ts, 'device/point', 'scrape', None, 'a "b"', 1000000)
+    assert line == 'point,device=device,source=scrape value_string="a \\"b\\"" 1577836801'
+
+    lines = ['a' * 10] * 5
+    assert list(influxdbutils.chunk_lines(lines, 25)) == [(0, 2), (2, 4), (4, 5)]
+    assert list(influxdbutils.chunk_lines(lines, 5)) == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+
+
 @pytest.mark.historian
 @pytest.mark.skipif(not HAS_INFLUXDB, reason='No influxdb library. Please run \'pip install influxdb\'')
 def test_installation_and_connection(volttron_instance, influxdb_client):
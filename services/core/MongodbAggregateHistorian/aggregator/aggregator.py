@@ -120,6 +120,10 @@ class MongodbAggregateHistorian(AggregateHistorian):
     def get_topic_map(self):
         return mongoutils.get_topic_map(self.dbclient, self._topic_collection)
 
+    def get_topic_count(self):
+        return mongoutils.get_topic_count(self.dbclient,
+                                          self._topic_collection)
+
     def get_agg_topic_map(self):
         return mongoutils.get_agg_topic_map(self.dbclient,
                                             self._agg_topic_collection)
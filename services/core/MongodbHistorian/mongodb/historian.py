@@ -41,7 +41,7 @@ import logging
 import numbers
 import re
 import sys
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 from datetime import timedelta
 from multiprocessing.pool import ThreadPool
@@ -57,7 +57,8 @@ from pymongo.errors import BulkWriteError
 import gevent
 
 from volttron.platform.agent import utils
-from volttron.platform.agent.base_historian import BaseHistorian
+from volttron.platform.agent.base_historian import BaseHistorian, \
+    expand_device_frame, QUERY_STREAM_PAGE_SIZE
 from volttron.platform.agent.utils import get_aware_utc_now
 from volttron.platform.dbutils import mongoutils
 from volttron.platform.vip.agent import Core
@@ -80,6 +81,10 @@ _log = logging.getLogger(__name__)
 __version__ = '2.1.1'
 _VOLTTRON_TYPE = '__volttron_type__'
 
+# Length of the documents of the hourly and daily rollup collections
+HOURLY_BUCKET = timedelta(hours=1)
+DAILY_BUCKET = timedelta(days=1)
+
 
 def historian(config_path, **kwargs):
     """
@@ -116,6 +121,8 @@ class MongodbHistorian(BaseHistorian):
 
     """
 
+    supports_device_frames = True
+
     def __init__(self, connection, tables_def=None,
                  initial_rollup_start_time=None, rollup_query_start=None,
                  rollup_topic_pattern=None, rollup_query_end=1,
@@ -285,72 +292,51 @@ class MongodbHistorian(BaseHistorian):
 
         _log.debug("query condition is {} ".format(find_condition))
 
-        # Iterate and append to a bulk_array. Insert in batches of 1000
-        bulk_publish_hour = []
-        bulk_publish_day = []
-        hour_ids = []
-        day_ids = []
-        h = 0
-        d = 0
-        last_topic_id = ''
-        last_date = ''
+        # Collect the rows to roll up and write them in batches of 5000 rows
+        hourly_rows = []
+        daily_rows = []
         cursor = db[self._data_collection].find(
             find_condition).sort("_id", pymongo.ASCENDING)
         _log.debug("rollup query returned. Looping through to update db")
         for row in cursor:
             if not stat or row['_id'] > stat["last_data_into_hourly"]:
-                self.initialize_hourly(topic_id=row['topic_id'], ts=row['ts'])
-                bulk_publish_hour.append(
-                    MongodbHistorian.insert_to_hourly(db,
-                                                      row['_id'],
-                                                      topic_id=row['topic_id'],
-                                                      ts=row['ts'],
-                                                      value=row['value']))
-                hour_ids.append(row['_id'])
-                h += 1
-
+                hourly_rows.append(row)
             if not stat or row['_id'] > stat["last_data_into_daily"]:
-                self.initialize_daily(topic_id=row['topic_id'],
-                                      ts=row['ts'])
-                bulk_publish_day.append(
-                    MongodbHistorian.insert_to_daily(db,
-                                                     row['_id'],
-                                                     topic_id=row['topic_id'],
-                                                     ts=row['ts'], value=row['value']))
-                day_ids.append(row['_id'])
-                d += 1
-            # Perform insert if we have 5000 rows
-            d_errors = h_errors = False
-            if h == 5000:
-                bulk_publish_hour, hour_ids, h_errors = \
-                    MongodbHistorian.bulk_write_rolled_up_data(
-                        self.HOURLY_COLLECTION, bulk_publish_hour,
-                        hour_ids, db)
-                h = 0
-            if d == 5000:
-                bulk_publish_day, day_ids, d_errors = \
-                    MongodbHistorian.bulk_write_rolled_up_data(
-                        self.DAILY_COLLECTION, bulk_publish_day, day_ids, db)
-                d = 0
-            if d_errors or h_errors:
-                # something failed in bulk write. try from last err
-                # row during the next periodic call
-                _log.warn("bulk publish errors. last_processed_data would "
-                          "have got recorded in collection. returning from "
-                          "periodic call to try again during next scheduled "
-                          "call")
-                return
-            gevent.sleep(0.2)
+                daily_rows.append(row)
+
+            if len(hourly_rows) == 5000 or len(daily_rows) == 5000:
+                if not self._rollup_rows(db, hourly_rows, daily_rows):
+                    return
+                hourly_rows = []
+                daily_rows = []
+                # Let other greenlets run between batches
+                gevent.sleep(0)
 
         # Perform insert for any pending records
-        if bulk_publish_hour:
+        if hourly_rows or daily_rows:
             _log.debug("bulk_publish outside loop")
-            MongodbHistorian.bulk_write_rolled_up_data(
-                self.HOURLY_COLLECTION, bulk_publish_hour, hour_ids, db)
-        if bulk_publish_day:
-            _log.debug("bulk_publish outside loop")
-            MongodbHistorian.bulk_write_rolled_up_data(
-                self.DAILY_COLLECTION, bulk_publish_day, day_ids, db)
+            self._rollup_rows(db, hourly_rows, daily_rows)
+
+    def _rollup_rows(self, db, hourly_rows, daily_rows):
+        """
+        Roll up a batch of rows of the data collection into the hourly and
+        daily collections.
+
+        :return: True if the batch was written without errors
+        """
+        h_errors = MongodbHistorian.bulk_write_rolled_up_data(
+            self.HOURLY_COLLECTION, hourly_rows, HOURLY_BUCKET, db)
+        d_errors = MongodbHistorian.bulk_write_rolled_up_data(
+            self.DAILY_COLLECTION, daily_rows, DAILY_BUCKET, db)
+        if d_errors or h_errors:
+            # something failed in bulk write. try from last err
+            # row during the next periodic call
+            _log.warn("bulk publish errors. last_processed_data would "
+                      "have got recorded in collection. returning from "
+                      "periodic call to try again during next scheduled "
+                      "call")
+            return False
+        return True
 
     def get_last_updated_data(self, db, collection):
         id = ""
@@ -361,86 +347,111 @@ class MongodbHistorian(BaseHistorian):
         return id
 
     @staticmethod
-    def bulk_write_rolled_up_data(collection_name, requests, ids, db):
+    def bulk_write_rolled_up_data(collection_name, rows, bucket, db):
         '''
         Handle bulk inserts into daily or hourly roll up table.
+        Rows are pre-aggregated per topic and bucket so that every bucket is
+        initialized and updated with a single request whatever the number of
+        rows that fall in it.
+        The buckets are updated in order of their first row and each one
+        records as last_updated_data the last row before the first row of the
+        next bucket, so the rollup resumes before any row that was not written
+        if the bulk write stops part way. Each bucket also records the last row
+        rolled up into it in last_rolled_up_data so that its rows read again
+        on resume are not counted twice.
         :param collection_name: name of the collection on which the bulk
         operation should happen
-        :param requests: array of bulk write requests
-        :param ids: array of data collection _ids that are part of the bulk
-        write requests
+        :param rows: rows of the data collection to roll up, sorted by _id
+        :param bucket: length of one document of the collection
         :param db: handle to database
-        :return: emptied request array, ids array, and True if there were
-        errors during write operation or False if there was none
+        :return: True if there were errors during write operation or False
+        if there was none
         '''
-        errors = False
-        try:
-            db[collection_name].bulk_write(requests, ordered=True)
-        except BulkWriteError as ex:
-            _log.error(str(ex.details))
-            errors = True
+        if not rows:
+            return False
 
-        else:
-            ids = []
-            requests = []
-        return requests, ids, errors
-
-    def version(self):
-        return __version__
-
-    def initialize_hourly(self, topic_id, ts):
-        ts_hour = ts.replace(minute=0, second=0, microsecond=0)
+        buckets = OrderedDict()
+        for row in rows:
+            start = MongodbHistorian.bucket_start(row['ts'], bucket)
+            buckets.setdefault((row['topic_id'], start), []).append(row)
 
-        db = self._client.get_default_database()
+        slots = int(bucket.total_seconds() // 60)
         # use update+upsert instead of insert cmd as the external script
-        # to back fill data could have initialized this same row
-        db[self.HOURLY_COLLECTION].update_one(
-            {'ts': ts_hour, 'topic_id': topic_id},
-            {"$setOnInsert": {'ts': ts_hour,
-                              'topic_id': topic_id,
-                              'count': 0,
-                              'sum': 0,
-                              'data': [[]] * 60,
-                              'last_updated_data': ''}
-             },
-            upsert=True)
-
-    def initialize_daily(self, topic_id, ts):
-        ts_day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        # to back fill data could have initialized the same documents
+        initialize = [
+            UpdateOne({'ts': ts, 'topic_id': topic_id},
+                      {"$setOnInsert": {'ts': ts,
+                                        'topic_id': topic_id,
+                                        'count': 0,
+                                        'sum': 0,
+                                        'data': [[]] * slots,
+                                        'last_updated_data': ''}},
+                      upsert=True)
+            for topic_id, ts in buckets]
+        try:
+            db[collection_name].bulk_write(initialize, ordered=False)
+        except BulkWriteError as ex:
+            _log.error(str(ex.details))
+            return True
+
+        rolled_up = {}
+        cursor = db[collection_name].find(
+            {'topic_id': {'$in': list({topic_id for topic_id, _ in buckets})},
+             'ts': {'$in': list({ts for _, ts in buckets})}},
+            {'topic_id': 1, 'ts': 1, 'last_rolled_up_data': 1})
+        for doc in cursor:
+            if doc.get('last_rolled_up_data'):
+                rolled_up[(doc['topic_id'], doc['ts'])] = \
+                    doc['last_rolled_up_data']
+
+        positions = {row['_id']: i for i, row in enumerate(rows)}
+        keys = list(buckets)
+        update = []
+        for i, key in enumerate(keys):
+            if i + 1 < len(keys):
+                next_row = positions[buckets[keys[i + 1]][0]['_id']]
+                resume_id = rows[next_row - 1]['_id']
+            else:
+                resume_id = rows[-1]['_id']
+            last_rolled_up = rolled_up.get(key)
+            bucket_rows = [row for row in buckets[key]
+                           if last_rolled_up is None or
+                           row['_id'] > last_rolled_up]
+            operation = {'$set': {'last_updated_data': resume_id}}
+            if bucket_rows:
+                count = 0
+                total = 0
+                data = defaultdict(list)
+                for row in bucket_rows:
+                    count += 1
+                    total += MongodbHistorian.value_to_sumable(row['value'])
+                    position = int((row['ts'] - key[1]).total_seconds() // 60)
+                    data["data." + str(position)].append(
+                        [row['ts'], row['value']])
+                operation['$push'] = {position: {'$each': values} for
+                                      position, values in data.items()}
+                operation['$inc'] = {'count': count, 'sum': total}
+                operation['$set']['last_rolled_up_data'] = \
+                    bucket_rows[-1]['_id']
+            update.append(UpdateOne({'ts': key[1], 'topic_id': key[0]},
+                                    operation))
 
-        db = self._client.get_default_database()
-        db[self.DAILY_COLLECTION].update_one(
-            {'ts': ts_day, 'topic_id': topic_id},
-            {"$setOnInsert": {'ts': ts_day,
-                              'topic_id': topic_id,
-                              'count': 0,
-                              'sum': 0,
-                              'data': [[]] * 24 * 60,
-                              'last_updated_data': ''}},
-            upsert=True)
+        try:
+            # Ordered, so that the buckets after a failed one are not written
+            db[collection_name].bulk_write(update, ordered=True)
+        except BulkWriteError as ex:
+            _log.error(str(ex.details))
+            return True
+        return False
 
     @staticmethod
-    def insert_to_hourly(db, data_id, topic_id, ts, value):
-        sum_value = MongodbHistorian.value_to_sumable(value)
-        rollup_hour = ts.replace(minute=0, second=0, microsecond=0)
-
-        return UpdateOne({'ts': rollup_hour, 'topic_id': topic_id},
-                         {'$push': {"data." + str(ts.minute): [ts, value]},
-                          '$inc': {'count': 1, 'sum': sum_value},
-                          '$set': {'last_updated_data': data_id}})
+    def bucket_start(ts, bucket):
+        if bucket == DAILY_BUCKET:
+            return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        return ts.replace(minute=0, second=0, microsecond=0)
 
-    @staticmethod
-    def insert_to_daily(db, data_id, topic_id, ts, value):
-        rollup_day = ts.replace(hour=0, minute=0, second=0,
-                                microsecond=0)
-        position = ts.hour * 60 + ts.minute
-        sum_value = MongodbHistorian.value_to_sumable(value)
-
-        one = UpdateOne({'ts': rollup_day, 'topic_id': topic_id},
-                        {'$push': {"data." + str(position): [ts, value]},
-                         '$inc': {'count': 1, 'sum': sum_value},
-                         '$set': {'last_updated_data': data_id}})
-        return one
+    def version(self):
+        return __version__
 
     @doc_inherit
     def publish_to_historian(self, to_publish_list):
@@ -451,9 +462,12 @@ class MongodbHistorian(BaseHistorian):
         # and data collections
         db = self._client.get_default_database()
 
-        bulk_publish = db[self._data_collection].initialize_ordered_bulk_op()
+        bulk_publish = []
+        # Record each bulk operation comes from, frames add one operation
+        # per point.
+        op_records = []
 
-        for x in to_publish_list:
+        for record, x in self._iter_points(to_publish_list):
             ts = x['timestamp']
             topic = x['topic']
             value = x['value']
@@ -501,26 +515,50 @@ class MongodbHistorian(BaseHistorian):
                 value = {_VOLTTRON_TYPE: 'json',
                          'string_value': value_str}
 
-            bulk_publish.find(
-                {'ts': ts, 'topic_id': topic_id}).upsert().replace_one(
+            bulk_publish.append(ReplaceOne(
+                {'ts': ts, 'topic_id': topic_id},
                 {'ts': ts, 'topic_id': topic_id, 'source': source,
-                 'value': value})
+                 'value': value},
+                upsert=True))
+            op_records.append(record)
+
+        if not bulk_publish:
+            self.report_all_handled()
+            return
 
         try:
-            result = bulk_publish.execute()
+            # Unordered so that one failed point does not keep the server
+            # from writing the rest of the batch
+            db[self._data_collection].bulk_write(bulk_publish, ordered=False)
         except BulkWriteError as bwe:
             _log.error("Error during bulk write to data: {}".format(
                 bwe.details))
             if bwe.details['writeErrors']:
-                index = bwe.details['writeErrors'][0]['index']
-                if index > 0:
-                    _log.debug(
-                        "bulk operation processed {} records before "
-                        "failing".format(bwe.details['writeErrors'][0]['index']))
-                    self.report_handled(to_publish_list[0:index])
+                _log.debug(
+                    "bulk operation failed for {} of {} points".format(
+                        len(bwe.details['writeErrors']), len(op_records)))
+                # A frame is only handled if all of its points were
+                # written.
+                failed = set(id(op_records[error['index']])
+                             for error in bwe.details['writeErrors'])
+                self.report_handled([r for r in to_publish_list
+                                     if id(r) not in failed])
         else:  # No write errros here when
             self.report_all_handled()
 
+    @staticmethod
+    def _iter_points(to_publish_list):
+        """
+        Yield (record, point record) for every point to publish, expanding
+        device frames into their points.
+        """
+        for record in to_publish_list:
+            if record.get('frame'):
+                for point in expand_device_frame(record):
+                    yield record, point
+            else:
+                yield record, record
+
     @staticmethod
     def value_to_sumable(value):
         # Handle the case where value is not a number so we don't
@@ -565,29 +603,11 @@ class MongodbHistorian(BaseHistorian):
                 use_rolled_up_data = True
         _log.debug("Using collection {} for query:".format(collection_name))
         multi_topic_query = len(topics_list) > 1
-        topic_ids = []
-        id_name_map = {}
-        for topic in topics_list:
-            # find topic if based on topic table entry
-            topic_id = self._topic_id_map.get(topic.lower(), None)
-
-            if agg_type:
-                agg_type = agg_type.lower()
-                # replace id from aggregate_topics table
-                topic_id = self._agg_topic_id_map.get(
-                    (topic.lower(), agg_type, agg_period), None)
-                if topic_id is None:
-                    # load agg topic id again as it might be a newly
-                    # configured aggregation
-                    self._agg_topic_id_map = mongoutils.get_agg_topic_map(
-                        self._client, self._agg_topic_collection)
-                    topic_id = self._agg_topic_id_map.get(
-                        (topic.lower(), agg_type, agg_period), None)
-            if topic_id:
-                topic_ids.append(topic_id)
-                id_name_map[ObjectId(topic_id)] = topic
-            else:
-                _log.warn('No such topic {}'.format(topic))
+        topic_ids, id_name_map = self._get_query_topic_ids(
+            topics_list, agg_type, agg_period)
+        if agg_type:
+            agg_type = agg_type.lower()
+        topic = topics_list[-1] if topics_list else topic
 
         if not topic_ids:
             return {}
@@ -636,6 +656,89 @@ class MongodbHistorian(BaseHistorian):
         finally:
             pool.close()
 
+    @doc_inherit
+    def query_historian_stream(self, topic, start=None, end=None,
+                               agg_type=None, agg_period=None,
+                               order="FIRST_TO_LAST",
+                               page_size=QUERY_STREAM_PAGE_SIZE):
+        # Rows are read from the raw data (or aggregate) collection through
+        # a cursor fetching page_size documents at a time. The hourly and
+        # daily rollups are not used as they only pay off for reading whole
+        # results at once.
+        topics_list = [topic] if isinstance(topic, str) else topic
+        collection_name = self._data_collection
+        if agg_type and agg_period:
+            collection_name = agg_type + "_" + agg_period
+        topic_ids, id_name_map = self._get_query_topic_ids(
+            topics_list, agg_type, agg_period)
+
+        metadata = {}
+        if len(topics_list) == 1 and topic_ids:
+            meta_tid = topic_ids[0]
+            if agg_type:
+                meta_tid = self._topic_id_map.get(topics_list[0].lower(),
+                                                  None)
+            metadata = self._topic_meta.get(meta_tid, {})
+
+        find_params = {}
+        if start is not None and start == end:
+            find_params['ts'] = start
+        else:
+            ts_filter = {}
+            if start is not None:
+                ts_filter["$gte"] = start
+            if end is not None:
+                ts_filter["$lt"] = end
+            if ts_filter:
+                find_params['ts'] = ts_filter
+        order_by = -1 if order == 'LAST_TO_FIRST' else 1
+        db = self._client.get_default_database()
+
+        def rows():
+            for topic_id in topic_ids:
+                topic_id = ObjectId(topic_id)
+                topic_name = id_name_map[topic_id]
+                find_params['topic_id'] = topic_id
+                cursor = db[collection_name].find(
+                    find_params, {"_id": 0, "ts": 1, "value": 1}).sort(
+                    "ts", order_by).batch_size(page_size)
+                try:
+                    for row in cursor:
+                        yield (topic_name,
+                               utils.format_timestamp(
+                                   row['ts'].replace(tzinfo=pytz.UTC)),
+                               self.json_string_to_dict(row['value']))
+                finally:
+                    cursor.close()
+
+        return rows(), metadata
+
+    def _get_query_topic_ids(self, topics_list, agg_type, agg_period):
+        topic_ids = []
+        id_name_map = {}
+        for topic in topics_list:
+            # find topic if based on topic table entry
+            topic_id = self._topic_id_map.get(topic.lower(), None)
+
+            if agg_type:
+                agg_type = agg_type.lower()
+                # replace id from aggregate_topics table
+                topic_id = self._agg_topic_id_map.get(
+                    (topic.lower(), agg_type, agg_period), None)
+                if topic_id is None:
+                    # load agg topic id again as it might be a newly
+                    # configured aggregation
+                    self._agg_topic_id_map = mongoutils.get_agg_topic_map(
+                        self._client, self._agg_topic_collection)
+                    topic_id = self._agg_topic_id_map.get(
+                        (topic.lower(), agg_type, agg_period), None)
+            if topic_id:
+                topic_ids.append(topic_id)
+                id_name_map[ObjectId(topic_id)] = topic
+            else:
+                _log.warn('No such topic {}'.format(topic))
+        return topic_ids, id_name_map
+
     def query_topic_data(self, topic_id, id_name_map, collection_name, start,
                          end, query_start, query_end, count, skip_count,
                          order_by, use_rolled_up_data, values):
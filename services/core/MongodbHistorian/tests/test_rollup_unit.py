@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+try:
+    from pymongo.errors import BulkWriteError
+    from mongodb.historian import MongodbHistorian, HOURLY_BUCKET
+
+    HAS_PYMONGO = True
+except ImportError:
+    HAS_PYMONGO = False
+
+pytestmark = [pytest.mark.mongodb,
+              pytest.mark.skipif(not HAS_PYMONGO,
+                                 reason='No pymongo client available.')]
+
+
+class _Collection(object):
+    """In memory rollup collection applying the update requests of bulk_write.
+    The update of the bucket in fail_on stops an ordered bulk write."""
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_on = None
+
+    def bulk_write(self, requests, ordered=True):
+        for index, request in enumerate(requests):
+            key = (request._filter['topic_id'], request._filter['ts'])
+            operation = request._doc
+            if key == self.fail_on and '$set' in operation:
+                raise BulkWriteError({'writeErrors': [{'index': index}]})
+            if '$setOnInsert' in operation:
+                if key not in self.docs:
+                    self.docs[key] = dict(operation['$setOnInsert'],
+                                          data=[])
+                continue
+            doc = self.docs[key]
+            doc.update(operation['$set'])
+            for field, value in operation.get('$inc', {}).items():
+                doc[field] += value
+            for field, values in operation.get('$push', {}).items():
+                doc['data'].extend(values['$each'])
+
+    def find(self, condition, projection):
+        return [dict(doc) for (topic_id, ts), doc in self.docs.items()
+                if topic_id in condition['topic_id']['$in'] and
+                ts in condition['ts']['$in']]
+
+    def last_updated_data(self):
+        ids = [doc['last_updated_data'] for doc in self.docs.values()
+               if doc['last_updated_data'] != '']
+        return max(ids) if ids else None
+
+
+def test_rollup_resumes_before_rows_not_written():
+    collection = _Collection()
+    db = {'hourly': collection}
+    start = datetime(2020, 1, 1)
+    # Readings of three topics interleaved in the data collection, over two
+    # hours
+    rows = [{'_id': i, 'topic_id': i % 3, 'value': 1.0,
+             'ts': start + timedelta(minutes=20 * (i // 3))}
+            for i in range(18)]
+
+    # The update of the hour of the second topic fails
+    collection.fail_on = (1, start)
+    assert MongodbHistorian.bulk_write_rolled_up_data('hourly', rows,
+                                                      HOURLY_BUCKET, db)
+    resume_id = collection.last_updated_data()
+    assert all(row['_id'] > resume_id for row in rows
+               if (row['topic_id'], row['ts'].replace(minute=0)) ==
+               collection.fail_on)
+
+    # The next periodic rollup reads the rows after the resume point again
+    collection.fail_on = None
+    assert not MongodbHistorian.bulk_write_rolled_up_data(
+        'hourly', [row for row in rows if row['_id'] > resume_id],
+        HOURLY_BUCKET, db)
+
+    assert 6 == len(collection.docs)
+    for (topic_id, ts), doc in collection.docs.items():
+        expected = [row for row in rows if row['topic_id'] == topic_id and
+                    row['ts'].replace(minute=0) == ts]
+        assert len(expected) == doc['count'] == len(doc['data'])
+        assert len(expected) == doc['sum']
+    assert rows[-1]['_id'] == collection.last_updated_data()
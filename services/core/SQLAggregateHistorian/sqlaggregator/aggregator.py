@@ -88,6 +88,9 @@ class SQLAggregateHistorian(AggregateHistorian):
     def get_topic_map(self):
         return self.dbfuncts_class.get_topic_map()
 
+    def get_topic_count(self):
+        return self.dbfuncts_class.get_topic_count()
+
     def get_agg_topic_map(self):
         return self.dbfuncts_class.get_agg_topic_map()
 
@@ -127,6 +130,14 @@ class SQLAggregateHistorian(AggregateHistorian):
             start_time,
             end_time)
 
+    def collect_aggregates(self, topic_ids_list, agg_type, start_time,
+                           end_time):
+        return self.dbfuncts_class.collect_aggregates(
+            topic_ids_list,
+            agg_type,
+            start_time,
+            end_time)
+
     def insert_aggregate(self, topic_id, agg_type, period, end_time,
                          value, topic_ids):
         self.dbfuncts_class.insert_aggregate(topic_id,
@@ -40,9 +40,14 @@
 import logging
 import sys
 import threading
+import time
+from queue import LifoQueue
+
+from gevent import get_hub
 
 from volttron.platform.agent import utils
-from volttron.platform.agent.base_historian import BaseHistorian
+from volttron.platform.agent.base_historian import BaseHistorian, \
+    QUERY_STREAM_PAGE_SIZE
 from volttron.platform.dbutils import sqlutils
 from volttron.utils.docs import doc_inherit
 
@@ -106,7 +111,10 @@ class SQLHistorian(BaseHistorian):
 
     """
 
-    def __init__(self, connection, tables_def = None, **kwargs):
+    supports_device_frames = True
+
+    def __init__(self, connection, tables_def = None, query_pool_size=0,
+                 **kwargs):
         """Initialise the historian.
 
         The historian makes two connections to the data store.  Both of
@@ -133,6 +141,11 @@ class SQLHistorian(BaseHistorian):
           4. "meta_table": name of the table that stores the metadata data
           for topics
 
+        :param query_pool_size: number of connections used to run queries in
+        threads, at most this many at the same time. Queries run in the main
+        thread on main_thread_dbutils when 0. sqlite connections of the pool
+        are read only.
+
         :param kwargs: additional keyword arguments.
         """
         self.connection = connection
@@ -156,8 +169,36 @@ class SQLHistorian(BaseHistorian):
         # One utils class instance( hence one db connection) for main thread
         # this gets initialized in the bg_thread within historian_setup
         self.bg_thread_dbutils = None
+        # Each publish worker thread gets its own utils class instance when
+        # publish_pipeline_depth is greater than one. New topics and meta
+        # data are written under the lock on a connection of their own and
+        # committed right away so every worker can use them, without
+        # committing the batch a worker is in the middle of.
+        self._worker_local = threading.local()
+        self._topic_lock = threading.Lock()
+        self._topic_dbutils = None
+        # Query connections are created as they are first needed, a None in
+        # the pool stands for one not created yet.
+        self._query_pool_size = int(query_pool_size or 0)
+        self._query_pool = LifoQueue()
+        for _ in range(self._query_pool_size):
+            self._query_pool.put(None)
+        self._query_pool_params = dict(self.connection['params'])
+        if database_type == 'sqlite':
+            self._query_pool_params.update(read_only=True,
+                                           check_same_thread=False)
         super(SQLHistorian, self).__init__(**kwargs)
 
+    @property
+    def supports_publish_pipeline(self):
+        # sqlite only allows a single writer.
+        return self.connection['type'] != 'sqlite'
+
+    @property
+    def publish_dbutils(self):
+        """The utils class instance publish_to_historian uses in the current thread."""
+        return getattr(self._worker_local, 'dbutils', None) or self.bg_thread_dbutils
+
     def record_table_definitions(self, meta_table_name):
         self.bg_thread_dbutils.record_table_definitions(self.tables_def,
                                              meta_table_name)
@@ -175,55 +216,28 @@ class SQLHistorian(BaseHistorian):
         #_log.debug(
         #    "publish_to_historian number of items: {} Thread: {}:{}".format(
         #        len(to_publish_list), threading.current_thread(), thread_name))
+        dbutils = self.publish_dbutils
         try:
             published = 0
-            with self.bg_thread_dbutils.bulk_insert() as insert_data:
+            with dbutils.bulk_insert() as insert_data:
                 for x in to_publish_list:
-                    ts = x['timestamp']
-                    topic = x['topic']
-                    value = x['value']
-                    meta = x['meta']
-
-                    # look at the topics that are stored in the database
-                    # already to see if this topic has a value
-                    lowercase_name = topic.lower()
-                    topic_id = self.topic_id_map.get(lowercase_name, None)
-                    db_topic_name = self.topic_name_map.get(lowercase_name,
-                                                            None)
-                    if topic_id is None:
-                        # _log.debug('Inserting topic: {}'.format(topic))
-                        # Insert topic name as is in db
-                        topic_id = self.bg_thread_dbutils.insert_topic(topic)
-                        # user lower case topic name when storing in map
-                        # for case insensitive comparison
-                        self.topic_id_map[lowercase_name] = topic_id
-                        self.topic_name_map[lowercase_name] = topic
-                        # _log.debug('TopicId: {} => {}'.format(topic_id, topic))
-                    elif db_topic_name != topic:
-                        # _log.debug('Updating topic: {}'.format(topic))
-                        self.bg_thread_dbutils.update_topic(topic, topic_id)
-                        self.topic_name_map[lowercase_name] = topic
-
-                    old_meta = self.topic_meta.get(topic_id, {})
-                    if set(old_meta.items()) != set(meta.items()):
-                        # _log.debug(
-                        #    'Updating meta for topic: {} {}'.format(topic,
-                        #                                            meta))
-                        self.bg_thread_dbutils.insert_meta(topic_id, meta)
-                        self.topic_meta[topic_id] = meta
-
-                    if insert_data(ts, topic_id, value):
+                    if x.get('frame'):
+                        published += self.insert_frame(insert_data, x)
+                        continue
+
+                    topic_id = self.get_topic_id(x['topic'], x['meta'])
+                    if insert_data(x['timestamp'], topic_id, x['value']):
                         # _log.debug('item was inserted')
                         published += 1
 
             if published:
-                if self.bg_thread_dbutils.commit():
+                if dbutils.commit():
                     # _log.debug('published {} data values'.format(published))
                     self.report_all_handled()
                 else:
                     _log.debug('Commit error. Rolling back {} values.'.format(
                         published))
-                    self.bg_thread_dbutils.rollback()
+                    dbutils.rollback()
             else:
                 _log.debug(
                     'Unable to publish {}'.format(len(to_publish_list)))
@@ -241,10 +255,87 @@ class SQLHistorian(BaseHistorian):
             # self.vip.health.set_status(STATUS_BAD, err_message)
             # status = Status.from_json(self.vip.health.get_status())
             # self.vip.health.send_alert(alert_id, status)
-            self.bg_thread_dbutils.rollback()
+            dbutils.rollback()
             # Raise to the platform so it is logged properly.
             raise
 
+    def get_topic_id(self, topic, meta):
+        """
+        Return the id of a topic, inserting or renaming the topic and
+        updating its metadata in the database as needed.
+        """
+        worker_dbutils = getattr(self._worker_local, 'dbutils', None)
+        if worker_dbutils is None:
+            return self._get_topic_id(self.bg_thread_dbutils, topic, meta)[0]
+
+        with self._topic_lock:
+            if self._topic_dbutils is None:
+                self._topic_dbutils = self.db_functs_class(
+                    self.connection['params'],
+                    self.table_names)
+            topic_id, changed = self._get_topic_id(self._topic_dbutils,
+                                                   topic, meta)
+            if changed:
+                self._topic_dbutils.commit()
+        return topic_id
+
+    def _get_topic_id(self, dbutils, topic, meta):
+        """
+        :returns: the topic id and whether the database was written to.
+        """
+        changed = False
+        # look at the topics that are stored in the database
+        # already to see if this topic has a value
+        lowercase_name = topic.lower()
+        topic_id = self.topic_id_map.get(lowercase_name, None)
+        db_topic_name = self.topic_name_map.get(lowercase_name,
+                                                None)
+        if topic_id is None:
+            # _log.debug('Inserting topic: {}'.format(topic))
+            # Insert topic name as is in db
+            topic_id = dbutils.insert_topic(topic)
+            # user lower case topic name when storing in map
+            # for case insensitive comparison
+            self.topic_id_map[lowercase_name] = topic_id
+            self.topic_name_map[lowercase_name] = topic
+            changed = True
+            # _log.debug('TopicId: {} => {}'.format(topic_id, topic))
+        elif db_topic_name != topic:
+            # _log.debug('Updating topic: {}'.format(topic))
+            dbutils.update_topic(topic, topic_id)
+            self.topic_name_map[lowercase_name] = topic
+            changed = True
+
+        old_meta = self.topic_meta.get(topic_id, {})
+        if set(old_meta.items()) != set(meta.items()):
+            # _log.debug(
+            #    'Updating meta for topic: {} {}'.format(topic,
+            #                                            meta))
+            dbutils.insert_meta(topic_id, meta)
+            self.topic_meta[topic_id] = meta
+            changed = True
+
+        return topic_id, changed
+
+    def insert_frame(self, insert_data, frame):
+        """
+        Insert all the points of a device frame record with the bulk insert
+        method of the database driver.
+
+        :param insert_data: insert method yielded by the driver's bulk_insert
+        :param frame: device frame record
+        :return: number of points inserted
+        """
+        ts = frame['timestamp']
+        prefix = frame['topic'] + '/'
+        meta = frame['meta']
+        inserted = 0
+        for point, value in frame['value'].items():
+            topic_id = self.get_topic_id(prefix + point, meta.get(point, {}))
+            if insert_data(ts, topic_id, value):
+                inserted += 1
+        return inserted
+
     @doc_inherit
     def query_topic_list(self):
 
@@ -290,8 +381,140 @@ class SQLHistorian(BaseHistorian):
         elif isinstance(topic, list):
             topics_list = topic
 
-        multi_topic_query = len(topics_list) > 1
+        topic_ids, id_name_map = self._get_query_topic_ids(
+            topics_list, agg_type, agg_period)
+        if agg_type:
+            agg_type = agg_type.lower()
+
+        if not topic_ids:
+            _log.warn('No topic ids found for topics{}. Returning '
+                      'empty result'.format(topics_list))
+            return results
+
+        _log.debug(
+            "Querying db reader with topic_ids {} ".format(topic_ids))
+
+        values = self._query_db(
+            'query', topic_ids, id_name_map, start=start, end=end,
+            agg_type=agg_type, agg_period=agg_period, skip=skip, count=count,
+            order=order)
+        return self._query_results(values, topics_list, topic_ids, agg_type)
+
+    def _query_db(self, method, *args, **kwargs):
+        """
+        Call a query method of the utils class. With a query pool the call
+        runs in a thread of the hub's thread pool on a pooled connection,
+        leaving the main thread free to serve other requests meanwhile.
+        """
+        if not self._query_pool_size:
+            return getattr(self.main_thread_dbutils, method)(*args, **kwargs)
+        return get_hub().threadpool.apply(self._pooled_query,
+                                          (method,) + args, kwargs)
+
+    def _pooled_query(self, method, *args, **kwargs):
+        stats = self._performance_stats
+        waiting = time.monotonic()
+        dbutils = self._query_pool.get()
+        stats.record("query_wait", time.monotonic() - waiting)
+        try:
+            if dbutils is None:
+                dbutils = self.db_functs_class(self._query_pool_params,
+                                               self.table_names)
+            with stats.timer("query"):
+                return getattr(dbutils, method)(*args, **kwargs)
+        finally:
+            self._query_pool.put(dbutils)
+
+    @doc_inherit
+    def query_historian_downsampled(self, topic, start, end, agg_type,
+                                    agg_period, skip, count, order, method,
+                                    points):
+        # skip and count apply to the rows before downsampling, which the
+        # database can not do along with it
+        if skip or count is not None:
+            return super(SQLHistorian, self).query_historian_downsampled(
+                topic, start, end, agg_type, agg_period, skip, count, order,
+                method, points)
+        topics_list = [topic] if isinstance(topic, str) else topic
+        topic_ids, id_name_map = self._get_query_topic_ids(
+            topics_list, agg_type, agg_period)
+        if agg_type:
+            agg_type = agg_type.lower()
+        if not topic_ids:
+            _log.warn('No topic ids found for topics{}. Returning '
+                      'empty result'.format(topics_list))
+            return dict()
+
+        try:
+            values = self._query_db(
+                'downsample_query', topic_ids, id_name_map, method, points,
+                start=start, end=end, agg_type=agg_type,
+                agg_period=agg_period, order=order)
+        except NotImplementedError:
+            return super(SQLHistorian, self).query_historian_downsampled(
+                topic, start, end, agg_type, agg_period, skip, count, order,
+                method, points)
+        return self._query_results(values, topics_list, topic_ids, agg_type)
+
+    def _query_results(self, values, topics_list, topic_ids, agg_type):
+        results = dict()
+        metadata = {}
+        meta_tid = None
+        if len(values) > 0:
+            # If there are results add metadata if it is a query on a
+            # single topic
+            if len(topics_list) == 1:
+                values = list(values.values())[0]
+                meta_tid = self._get_meta_topic_id(topics_list[0], topic_ids,
+                                                   agg_type)
+
+            if values:
+                metadata = self.topic_meta.get(meta_tid, {})
+                # _log.debug("metadata is {}".format(metadata))
+                results = {'values': values, 'metadata': metadata}
+            else:
+                results = dict()
+        return results
+
+    @doc_inherit
+    def query_historian_stream(self, topic, start=None, end=None,
+                               agg_type=None, agg_period=None,
+                               order="FIRST_TO_LAST",
+                               page_size=QUERY_STREAM_PAGE_SIZE):
+        topics_list = [topic] if isinstance(topic, str) else topic
+        topic_ids, id_name_map = self._get_query_topic_ids(
+            topics_list, agg_type, agg_period)
+        if agg_type:
+            agg_type = agg_type.lower()
 
+        metadata = {}
+        if len(topics_list) == 1 and topic_ids:
+            metadata = self.topic_meta.get(
+                self._get_meta_topic_id(topics_list[0], topic_ids, agg_type),
+                {})
+        if not topic_ids:
+            _log.warn('No topic ids found for topics{}. Returning '
+                      'empty result'.format(topics_list))
+            return [], metadata
+
+        # each stream reads from its own connection so that a cursor left
+        # open between pages does not get in the way of other queries
+        dbutils = self.db_functs_class(self._query_pool_params,
+                                       self.table_names)
+
+        def rows():
+            try:
+                for row in dbutils.stream_query(
+                        topic_ids, id_name_map, start=start, end=end,
+                        agg_type=agg_type, agg_period=agg_period,
+                        order=order, size=page_size):
+                    yield row
+            finally:
+                dbutils.close()
+
+        return rows(), metadata
+
+    def _get_query_topic_ids(self, topics_list, agg_type, agg_period):
         topic_ids = []
         id_name_map = {}
         for topic in topics_list:
@@ -315,47 +538,22 @@ class SQLHistorian(BaseHistorian):
                 id_name_map[topic_id] = topic
             else:
                 _log.warn('No such topic {}'.format(topic))
-
-        if not topic_ids:
-            _log.warn('No topic ids found for topics{}. Returning '
-                      'empty result'.format(topics_list))
-            return results
-
-        _log.debug(
-            "Querying db reader with topic_ids {} ".format(topic_ids))
-
-        values = self.main_thread_dbutils.query(
-            topic_ids, id_name_map, start=start, end=end, agg_type=agg_type,
-            agg_period=agg_period, skip=skip, count=count, order=order)
-        metadata = {}
-        meta_tid = None
-        if len(values) > 0:
-            # If there are results add metadata if it is a query on a
-            # single topic
-            if not multi_topic_query:
-                values = list(values.values())[0]
-                if agg_type:
-                    # if aggregation is on single topic find the topic id
-                    # in the topics table that corresponds to agg_topic_id
-                    # so that we can grab the correct metadata
-                    # if topic name does not have entry in topic_id_map
-                    # it is a user configured aggregation_topic_name
-                    # which denotes aggregation across multiple points
-                    _log.debug("Single topic aggregate query. Try to get "
-                               "metadata")
-                    meta_tid = self.topic_id_map.get(topic.lower(), None)
-                else:
-                    # this is a query on raw data, get metadata for
-                    # topic from topic_meta map
-                    meta_tid = topic_ids[0]
-
-            if values:
-                metadata = self.topic_meta.get(meta_tid, {})
-                # _log.debug("metadata is {}".format(metadata))
-                results = {'values': values, 'metadata': metadata}
-            else:
-                results = dict()
-        return results
+        return topic_ids, id_name_map
+
+    def _get_meta_topic_id(self, topic, topic_ids, agg_type):
+        if agg_type:
+            # if aggregation is on single topic find the topic id
+            # in the topics table that corresponds to agg_topic_id
+            # so that we can grab the correct metadata
+            # if topic name does not have entry in topic_id_map
+            # it is a user configured aggregation_topic_name
+            # which denotes aggregation across multiple points
+            _log.debug("Single topic aggregate query. Try to get "
+                       "metadata")
+            return self.topic_id_map.get(topic.lower(), None)
+        # this is a query on raw data, get metadata for
+        # topic from topic_meta map
+        return topic_ids[0]
 
     @doc_inherit
     def historian_setup(self):
@@ -374,6 +572,25 @@ class SQLHistorian(BaseHistorian):
         #_log.debug("updated topic name map. {}".format(self.topic_name_map))
         self.agg_topic_id_map = self.bg_thread_dbutils.get_agg_topic_map()
 
+    @doc_inherit
+    def historian_worker_setup(self):
+        self._worker_local.dbutils = self.db_functs_class(
+            self.connection['params'],
+            self.table_names)
+
+    @doc_inherit
+    def historian_worker_teardown(self):
+        dbutils = getattr(self._worker_local, 'dbutils', None)
+        if dbutils is not None:
+            dbutils.close()
+            self._worker_local.dbutils = None
+
+    @doc_inherit
+    def historian_teardown(self):
+        with self._topic_lock:
+            if self._topic_dbutils is not None:
+                self._topic_dbutils.close()
+                self._topic_dbutils = None
 
 
 def main(argv=sys.argv):
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from sqlhistorian.historian import SQLHistorian
+
+
+class _DbUtils(object):
+    """Records what was written and committed on one connection."""
+
+    def __init__(self, params=None, table_names=None):
+        self.pending = []
+        self.committed = []
+
+    def insert_topic(self, topic):
+        self.pending.append(('topic', topic))
+        return 1
+
+    def insert_meta(self, topic_id, meta):
+        self.pending.append(('meta', topic_id))
+
+    def insert_data(self, ts, topic_id, value):
+        self.pending.append(('data', topic_id))
+        return True
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.mark.historian
+def test_new_topic_does_not_commit_worker_batch():
+    historian = SQLHistorian.__new__(SQLHistorian)
+    historian.connection = {'params': {}}
+    historian.table_names = {}
+    historian.db_functs_class = _DbUtils
+    historian.topic_id_map = {}
+    historian.topic_name_map = {}
+    historian.topic_meta = {}
+    historian._worker_local = threading.local()
+    historian._topic_lock = threading.Lock()
+    historian._topic_dbutils = None
+    worker_dbutils = historian._worker_local.dbutils = _DbUtils()
+
+    # A worker half way through its batch meets a new topic.
+    worker_dbutils.insert_data(None, 0, 1.0)
+    assert historian.get_topic_id('device/point', {'units': 'F'}) == 1
+
+    assert worker_dbutils.committed == []
+    assert historian._topic_dbutils.committed == [('topic', 'device/point'),
+                                                  ('meta', 1)]
+
+    historian.historian_teardown()
+    assert historian._topic_dbutils is None
@@ -44,7 +44,6 @@ import datetime
 import hashlib
 import logging
 import os
-import re
 import shutil
 import sys
 import tempfile
@@ -66,6 +65,7 @@ from volttron.platform import jsonrpc
 from volttron.platform.agent.bacnet_proxy_reader import BACnetReader
 from volttron.platform.agent.known_identities import (
     VOLTTRON_CENTRAL, VOLTTRON_CENTRAL_PLATFORM, CONTROL, CONFIGURATION_STORE)
+from volttron.platform.agent.topic_replace import TopicReplacer
 from volttron.platform.agent.utils import (get_aware_utc_now)
 from volttron.platform.agent.utils import (get_utc_seconds_from_epoch,
                                            format_timestamp, normalize_identity)
@@ -205,7 +205,7 @@ class VolttronCentralPlatform(Agent):
 
         # This is used internally so we don't have to do replacements more
         # than one time.
-        self._topic_replacement = {}
+        self._topic_replacer = self._build_topic_replacer(topic_replace_map)
 
         # When this is not None then we are in the middle of a scan and should
         # not be able to start another scan.
@@ -278,8 +278,8 @@ class VolttronCentralPlatform(Agent):
                 self._vc_connection.core.stop()
                 self._vc_connection = None
 
-        self._topic_replacement.clear()
         self._topic_replace_map = config['topic-replace-map']
+        self._topic_replacer = self._build_topic_replacer(self._topic_replace_map)
         self._vc_address = vc_address
         self._vc_serverkey = vc_serverkey
         self._vc_rmq_ca_cert = vc_rmq_ca_cert
@@ -883,25 +883,12 @@ class VolttronCentralPlatform(Agent):
         device_dict['health'] = status.as_dict()
         device_dict['last_publish_utc'] = ts
 
-    def _replace_topic(self, original):
-        # only need to replace if we have some items in the list.
-        if not self._topic_replace_map:
-            return original
-
-        if original in self._topic_replacement:
-            return self._topic_replacement
-
-        new_value = original
-
-        for x in self._topic_replace_map:
-            new_value = new_value.replace(x, self._topic_replace_map[x])
-
-        if new_value == original:
-            return None
-
-        self._topic_replacement[original] = new_value
-
-        return new_value
+    @staticmethod
+    def _build_topic_replacer(topic_replace_map):
+        # Keys are matched against the lower cased topic so keys containing
+        # upper case characters never apply.
+        return TopicReplacer((k, v) for k, v in (topic_replace_map or {}).items()
+                             if k == k.lower())
 
     def get_renamed_topic(self, input_topic):
         """
@@ -909,36 +896,7 @@ class VolttronCentralPlatform(Agent):
         :param input_topic: 
         :return: 
         """
-        output_topic = input_topic
-        _log.debug(
-            "_topic_replace_list  is {}".format(self._topic_replace_map))
-        input_topic_lower = input_topic.lower()
-        # Only if we have some topics to replace.
-        if self._topic_replace_map:
-            # if we have already cached the topic then return it.
-            if input_topic_lower in self._topic_replacement:
-                output_topic = self._topic_replacement[input_topic_lower]
-            else:
-                self._topic_replacement[input_topic_lower] = input_topic
-                temptopics = {}
-                for k, v in self._topic_replace_map.items():
-
-                    if k in input_topic_lower:
-                        # this allows multiple things to be replaced from
-                        # from a given topic.
-                        new_topic = temptopics.get(input_topic_lower,
-                                                   input_topic)
-                        # temptopics[input_topic] = new_topic.replace(
-                        #     x['from'], x['to'])
-
-                        temptopics[input_topic_lower] = re.compile(
-                            re.escape(k), re.IGNORECASE).sub(v, new_topic)
-
-                for k, v in temptopics.items():
-                    self._topic_replacement[k] = v
-                output_topic = self._topic_replacement[input_topic_lower]
-            _log.debug("Output topic after replacements {}".format(output_topic))
-        return output_topic
+        return self._topic_replacer.replace(input_topic)
 
     def get_devices(self):
         """
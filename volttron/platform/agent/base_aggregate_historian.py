@@ -39,20 +39,141 @@
 
 
 import copy
+import json
 import logging
+import os
+import re
+import time
 from datetime import datetime, timedelta
 
 import pytz
 from abc import abstractmethod
+from gevent.threadpool import ThreadPool
 
 from volttron.platform.agent import utils
 from volttron.platform.agent.known_identities import (PLATFORM_HISTORIAN)
-from volttron.platform.vip.agent import Agent
+from volttron.platform.agent.topic_replace import TopicReplacer
+from volttron.platform.messaging import topics, headers as headers_mod
+from volttron.platform.scheduling import periodic
+from volttron.platform.vip.agent import Agent, Core
 from volttron.platform.vip.agent.subsystems import RPC
 
 _log = logging.getLogger(__name__)
 __version__ = '1.0'
 
+# Aggregation types that can be computed from the running state of a bucket
+# in streaming mode. Points with other aggregation types are still computed
+# by querying the historian's data table.
+STREAMING_AGGREGATIONS = ('avg', 'count', 'max', 'min', 'sum', 'total')
+
+# Maximum number of aggregation periods ahead of the current one that data
+# can be buffered for in streaming mode.
+MAX_STREAMING_WINDOWS = 8
+
+
+class AggregateState(object):
+    """
+    Running state of the aggregation of the values published in one time
+    period (bucket). Keeps the sum, count, min, max, first and last value
+    so that any of the :py:data:`STREAMING_AGGREGATIONS` can be computed when
+    the bucket closes.
+    """
+
+    __slots__ = ('sum', 'count', 'min', 'max', 'first', 'last')
+
+    def __init__(self):
+        self.sum = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        # (timestamp, value) tuples
+        self.first = None
+        self.last = None
+
+    def update(self, timestamp, value):
+        self.sum += value
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.first is None or timestamp < self.first[0]:
+            self.first = (timestamp, value)
+        if self.last is None or timestamp >= self.last[0]:
+            self.last = (timestamp, value)
+
+    def merge(self, other):
+        """
+        Merge the state of another part of the same bucket into this one.
+        """
+        if not other.count:
+            return
+        self.sum += other.sum
+        self.count += other.count
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+        if other.first is not None and (self.first is None or
+                                        other.first[0] < self.first[0]):
+            self.first = other.first
+        if other.last is not None and (self.last is None or
+                                       other.last[0] >= self.last[0]):
+            self.last = other.last
+
+    def value(self, agg_type):
+        """
+        :param agg_type: one of :py:data:`STREAMING_AGGREGATIONS`
+        :return: the aggregated value or None if the bucket holds no values
+        """
+        agg_type = agg_type.lower()
+        if agg_type == 'count':
+            return self.count
+        if not self.count:
+            return None
+        if agg_type == 'avg':
+            return self.sum / self.count
+        if agg_type == 'sum':
+            return self.sum
+        if agg_type == 'total':
+            return float(self.sum)
+        if agg_type == 'min':
+            return self.min
+        if agg_type == 'max':
+            return self.max
+        if agg_type == 'first':
+            return self.first[1]
+        if agg_type == 'last':
+            return self.last[1]
+        raise ValueError("Aggregation type {} can not be computed in "
+                         "streaming mode".format(agg_type))
+
+    def to_dict(self):
+        state = {'sum': self.sum, 'count': self.count, 'min': self.min,
+                 'max': self.max}
+        for name in ('first', 'last'):
+            item = getattr(self, name)
+            if item is not None:
+                item = [utils.format_timestamp(item[0]), item[1]]
+            state[name] = item
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        result = cls()
+        result.sum = state['sum']
+        result.count = state['count']
+        result.min = state['min']
+        result.max = state['max']
+        for name in ('first', 'last'):
+            item = state.get(name)
+            if item is not None:
+                item = (utils.parse_timestamp_string(item[0]), item[1])
+            setattr(result, name, item)
+        return result
+
 
 class AggregateHistorian(Agent):
     """
@@ -68,6 +189,12 @@ class AggregateHistorian(Agent):
     - :py:meth:`insert_aggregate() <AggregateHistorian.insert_aggregate>`
     - :py:meth:`get_aggregation_list() <AggregateHistorian.get_aggregation_list>`
 
+    With "streaming" set to true in the configuration the agent also
+    subscribes to the devices topics and keeps the running state of the
+    current aggregation period of each point in memory, checkpointed to
+    disk. The aggregate is then computed from that state when the period
+    closes and the historian's data table is only queried for the parts of
+    a period that were not received, i.e. before the agent started.
     """
 
     def __init__(self, config_path, **kwargs):
@@ -85,6 +212,29 @@ class AggregateHistorian(Agent):
         self.aggregate_topic_id_map = None
         self.volttron_table_defs = 'volttron_table_definitions'
 
+        # Streaming mode state. _streams maps aggregate topic ids to the
+        # configuration of the point, _buckets maps (aggregate topic id,
+        # start time, end time) to the state of an aggregation period.
+        self._streaming = False
+        self._stream_started = None
+        self._stream_subscribed = False
+        self._streams = {}
+        self._stream_names = {}
+        self._buckets = {}
+        # Lower cased names of the streamed topics received on the devices
+        # topics. Points with other topics are computed from the data table.
+        self._device_topics = set()
+        self._topic_replacer = TopicReplacer()
+        self._checkpoint_path = None
+        self._checkpoint_event = None
+
+        # topic_name_pattern -> {topic name: topic id}, cleared when the
+        # number of topics in the historian changes
+        self._pattern_topics = {}
+        self._topic_count = None
+        self._collection_pool = None
+        self._collection_stats = {}
+
         self.vip.config.set_default("config", config)
         self.vip.config.subscribe(self.configure, actions=["NEW", "UPDATE"],
                                   pattern="config")
@@ -118,9 +268,23 @@ class AggregateHistorian(Agent):
 
         self.topic_id_map, name_map = self.get_topic_map()
         self.agg_topic_id_map = self.get_agg_topic_map()
+        self._pattern_topics = {}
+        self._topic_count = len(self.topic_id_map)
         _log.debug("In start of aggregate historian. "
                    "After loading topic and aggregate topic maps")
 
+        pool_size = config.get('collection_pool_size', 1)
+        if pool_size < 1:
+            raise ValueError("Invalid collection_pool_size ({}). It should "
+                             "be 1 or more".format(pool_size))
+        if self._collection_pool is not None:
+            self._collection_pool.kill()
+            self._collection_pool = None
+        if pool_size > 1:
+            self._collection_pool = ThreadPool(pool_size)
+
+        self._configure_streaming(config)
+
         if not config.get("aggregations"):
             _log.debug("End of onstart method - current time{}".format(
                 datetime.utcnow()))
@@ -148,11 +312,18 @@ class AggregateHistorian(Agent):
             else:
                 utc_collection_start_time = datetime.utcnow().replace(
                     tzinfo=pytz.utc)
+            if self._streaming:
+                self._init_agg_group_streams(agg_group['points'],
+                                             agg_time_period,
+                                             use_calendar_periods,
+                                             utc_collection_start_time)
             self.collect_aggregate_data(
                 utc_collection_start_time,
                 agg_time_period,
                 use_calendar_periods,
                 agg_group['points'])
+        if self._streaming:
+            self._close_restored_buckets()
         _log.debug("End of onstart method - current time{}".format(
             datetime.utcnow()))
 
@@ -196,10 +367,7 @@ class AggregateHistorian(Agent):
             else:
                 # Find if the topic_name patterns result in any topics
                 # at all. If it does log them as info
-                topic_map = self.vip.rpc.call(
-                    PLATFORM_HISTORIAN,
-                    "get_topics_by_pattern",
-                    topic_pattern=topic_pattern).get()
+                topic_map = self._get_topics_by_pattern(topic_pattern)
                 if topic_map is None or len(topic_map) == 0:
                     raise ValueError(
                         "Please provide a valid topic_name or "
@@ -291,6 +459,9 @@ class AggregateHistorian(Agent):
         - :py:meth:`collect_aggregate() <AggregateHistorian.collect_aggregate>`
         - :py:meth:`insert_aggregate() <AggregateHistorian.insert_aggregate>`
 
+        In streaming mode the aggregates of the streamed points are computed
+        from the running state of the period that closes instead.
+
         :param collection_time:  time of aggregation collection
         :param param agg_time_period: time agg_time_period for which data
                                       needs to be collected and aggregated
@@ -317,11 +488,17 @@ class AggregateHistorian(Agent):
         start_time, end_time = \
             AggregateHistorian.compute_aggregation_time_slice(
                 collection_time, agg_time_period, use_calendar_periods)
+        cycle_start = time.monotonic()
         try:
             _log.debug(
                 "After  compute agg_time_period = {} start_time {} end_time "
                 "{} ".format(agg_time_period, start_time, end_time))
             schedule_next = True
+            if any(data.get('topic_name_pattern') for data in points):
+                self._refresh_topic_patterns()
+
+            # 1. Resolve the aggregate topic id and topic ids of each point
+            resolved = []
             for data in points:
                 _log.debug("data in loop {}".format(data))
                 topic_ids = data.get('topic_ids', None)
@@ -342,14 +519,12 @@ class AggregateHistorian(Agent):
                         data['aggregation_type'].lower(),
                         agg_time_period))
                     schedule_next = False
-                    break  # break out of for loop and move to finally block
+                    break  # stop resolving, collect the points found so far
 
                 if topic_pattern:
-                    # Find topic ids that match the pattern at runtime
-                    topic_map = self.vip.rpc.call(
-                        PLATFORM_HISTORIAN,
-                        "get_topics_by_pattern",
-                        topic_pattern=topic_pattern).get()
+                    # Find topic ids that match the pattern, cached until
+                    # new topics are added to the historian
+                    topic_map = self._get_topics_by_pattern(topic_pattern)
                     _log.debug("Found topics for pattern {}".format(topic_map))
                     if topic_map:
                         topic_ids = list(topic_map.values())
@@ -357,17 +532,47 @@ class AggregateHistorian(Agent):
                     else:
                         _log.warn(
                             "Skipping recording of aggregate data for {topic} "
-                            "between {start_time} and {end_time} as ".format(
+                            "between {start_time} and {end_time} as no topic "
+                            "matches the pattern".format(
                                 topic=topic_pattern,
                                 start_time=start_time,
                                 end_time=end_time))
-                        return
-
-                agg_value, count = self.collect_aggregate(
-                    topic_ids,
-                    data['aggregation_type'],
+                        continue
+                resolved.append((data, aggregate_topic_id, topic_ids))
+
+            # 2. Compute the aggregates, streamed points from their running
+            # state and the others together for each aggregation type
+            results = {}
+            by_type = {}
+            for index, (data, aggregate_topic_id, topic_ids) in \
+                    enumerate(resolved):
+                if aggregate_topic_id in self._streams and \
+                        self._is_streamed(data):
+                    results[index] = self._close_bucket(
+                        aggregate_topic_id,
+                        topic_ids,
+                        data['aggregation_type'],
+                        start_time,
+                        end_time)
+                else:
+                    # Not received on the devices topics
+                    self._buckets.pop((aggregate_topic_id, start_time,
+                                       end_time), None)
+                    by_type.setdefault(data['aggregation_type'].lower(),
+                                       []).append(index)
+            for agg_type, indexes in by_type.items():
+                values = self.collect_aggregates(
+                    [resolved[index][2] for index in indexes],
+                    agg_type,
                     start_time,
                     end_time)
+                results.update(zip(indexes, values))
+
+            # 3. Record the aggregates
+            for index, (data, aggregate_topic_id, topic_ids) in \
+                    enumerate(resolved):
+                agg_value, count = results[index]
+                topic_pattern = data.get('topic_name_pattern', None)
                 if count == 0:
                     _log.warn(
                         "No records found for topic {topic} between "
@@ -397,12 +602,27 @@ class AggregateHistorian(Agent):
                                           agg_value,
                                           topic_ids)
 
+            duration = time.monotonic() - cycle_start
+            self._collection_stats[agg_time_period] = {
+                'end_time': utils.format_timestamp(end_time),
+                'points': len(resolved),
+                'duration': duration}
+            _log.info("Collected {} aggregates of period {} ending {} in "
+                      "{:.3f} seconds".format(len(resolved), agg_time_period,
+                                              end_time, duration))
+
         finally:
             if schedule_next:
                 collection_time = AggregateHistorian.compute_next_collection_time(
                     collection_time, agg_time_period, use_calendar_periods)
                 _log.debug(
                     "Scheduling next collection at {}".format(collection_time))
+                streamed = False
+                for data in points:
+                    stream = data.get('stream')
+                    if stream is not None:
+                        stream['next_collection_time'] = collection_time
+                        streamed = True
                 event = self.core.schedule(collection_time,
                                            self.collect_aggregate_data,
                                            collection_time,
@@ -410,6 +630,378 @@ class AggregateHistorian(Agent):
                                            use_calendar_periods,
                                            points)
                 _log.debug("After Scheduling next collection.{}".format(event))
+                if streamed:
+                    self._save_checkpoint()
+
+    def _refresh_topic_patterns(self):
+        """
+        Clear the topics cached for the topic name patterns if topics were
+        added to the historian since they were resolved. Only the number of
+        topics is read each cycle, the topic map is reloaded when it changed.
+        """
+        topic_count = self.get_topic_count()
+        if topic_count != self._topic_count:
+            _log.debug("Number of topics changed from {} to {}. Resolving "
+                       "topic name patterns again".format(
+                           self._topic_count, topic_count))
+            self.topic_id_map, _ = self.get_topic_map()
+            self._pattern_topics = {}
+            self._topic_count = topic_count
+
+    def _get_topics_by_pattern(self, topic_pattern):
+        topic_map = self._pattern_topics.get(topic_pattern)
+        if topic_map is None:
+            topic_map = self.vip.rpc.call(
+                PLATFORM_HISTORIAN,
+                "get_topics_by_pattern",
+                topic_pattern=topic_pattern).get()
+            if topic_map:
+                self._pattern_topics[topic_pattern] = topic_map
+        return topic_map
+
+    def collect_aggregates(self, topic_ids_list, agg_type, start_time,
+                           end_time):
+        """
+        Collect the aggregates of several points for the same time period.
+        By default :py:meth:`collect_aggregate()
+        <AggregateHistorian.collect_aggregate>` is called for each point,
+        on up to collection_pool_size threads. Subclasses whose data store
+        can compute them all in one query should override this method.
+
+        :param topic_ids_list: list of the lists of topic ids of each point
+        :param agg_type: type of aggregation
+        :param start_time: start time for query (inclusive)
+        :param end_time:  end time for query (exclusive)
+        :return: list of (aggregated value, count of records) tuples in the
+                 order of topic_ids_list
+        """
+        if self._collection_pool is None or len(topic_ids_list) < 2:
+            return [self.collect_aggregate(topic_ids, agg_type, start_time,
+                                           end_time)
+                    for topic_ids in topic_ids_list]
+        results = [self._collection_pool.spawn(self.collect_aggregate,
+                                               topic_ids, agg_type,
+                                               start_time, end_time)
+                   for topic_ids in topic_ids_list]
+        return [result.get() for result in results]
+
+    @RPC.export
+    def get_collection_stats(self):
+        """
+        RPC method returning the duration in seconds of the last collection
+        cycle of each aggregation period, along with the end time of the
+        period collected and the number of points.
+
+        :return: {aggregation period: {'end_time': ..., 'points': ...,
+                 'duration': ...}}
+        """
+        return self._collection_stats
+
+    def _configure_streaming(self, config):
+        self._streaming = bool(config.get('streaming', False))
+        self._streams = {}
+        self._stream_names = {}
+        # Same as the historian's, so that the streamed topics match the
+        # names it stores
+        self._topic_replacer = TopicReplacer.from_replace_list(
+            config.get('topic_replace_list'))
+        if self._checkpoint_event is not None:
+            self._checkpoint_event.cancel()
+            self._checkpoint_event = None
+        if not self._streaming:
+            self._buckets = {}
+            return
+
+        checkpoint_interval = config.get('streaming_checkpoint_interval', 60)
+        if checkpoint_interval < 0:
+            raise ValueError("Invalid streaming_checkpoint_interval ({}). "
+                             "It should be 0 or more seconds".format(
+                                 checkpoint_interval))
+        self._checkpoint_path = config.get(
+            'streaming_checkpoint_file',
+            _get_checkpoint_path('aggregate_checkpoint.json'))
+
+        if self._stream_started is None:
+            # Raw data older than this is only read from the data table.
+            self._stream_started = utils.get_aware_utc_now()
+            self._load_checkpoint()
+        if checkpoint_interval:
+            self._checkpoint_event = self.core.schedule(
+                periodic(checkpoint_interval), self._save_checkpoint)
+        if not self._stream_subscribed:
+            self.vip.pubsub.subscribe(peer='pubsub',
+                                      prefix=topics.DRIVER_TOPIC_BASE,
+                                      callback=self._capture_stream_data)
+            self._stream_subscribed = True
+
+    def _init_agg_group_streams(self, points, agg_time_period,
+                                use_calendar_periods, collection_time):
+        """
+        Register the points of an aggregation group whose aggregation type
+        can be computed in streaming mode. The points of the group share the
+        same aggregation periods, the next of which closes at
+        next_collection_time.
+        """
+        group = {'agg_time_period': agg_time_period,
+                 'use_calendar_periods': use_calendar_periods,
+                 'next_collection_time': collection_time}
+        for data in points:
+            agg_type = data['aggregation_type'].lower()
+            if agg_type not in STREAMING_AGGREGATIONS:
+                _log.info("Aggregation type {} of {} can not be computed in "
+                          "streaming mode. Querying the data table "
+                          "instead".format(agg_type,
+                                           data['aggregation_topic_name']))
+                continue
+            agg_id = self.agg_topic_id_map[(
+                data['aggregation_topic_name'].lower(), agg_type,
+                agg_time_period)]
+            topic_pattern = data.get('topic_name_pattern')
+            stream = {'group': group, 'data': data}
+            if topic_pattern:
+                stream['pattern'] = re.compile(topic_pattern, re.IGNORECASE)
+            else:
+                stream['names'] = {name.lower()
+                                   for name in data['topic_names']}
+            data['stream'] = group
+            self._streams[agg_id] = stream
+
+    def _stream_ids(self, topic):
+        """
+        :return: aggregate topic ids of the streamed points that topic is
+                 part of
+        """
+        key = topic.lower()
+        agg_ids = self._stream_names.get(key)
+        if agg_ids is None:
+            agg_ids = []
+            for agg_id, stream in self._streams.items():
+                if 'names' in stream:
+                    if key in stream['names']:
+                        agg_ids.append(agg_id)
+                elif stream['pattern'].search(topic):
+                    agg_ids.append(agg_id)
+            self._stream_names[key] = agg_ids
+        return agg_ids
+
+    def _is_streamed(self, data):
+        """
+        :return: True if every topic of the point was received on the devices
+                 topics, only those are captured in streaming mode
+        """
+        topic_pattern = data.get('topic_name_pattern')
+        if topic_pattern:
+            names = self._get_topics_by_pattern(topic_pattern) or {}
+        else:
+            names = data['topic_names']
+        return bool(names) and all(name.lower() in self._device_topics
+                                   for name in names)
+
+    @staticmethod
+    def _stream_window(group, timestamp):
+        """
+        Find the aggregation period of the group timestamp falls in.
+
+        :return: (start time, end time) of the period or None if it is
+                 already closed or too far in the future
+        """
+        collection_time = group['next_collection_time']
+        for _ in range(MAX_STREAMING_WINDOWS):
+            start_time, end_time = \
+                AggregateHistorian.compute_aggregation_time_slice(
+                    collection_time, group['agg_time_period'],
+                    group['use_calendar_periods'])
+            if timestamp < start_time:
+                return None
+            if timestamp < end_time:
+                return start_time, end_time
+            collection_time = \
+                AggregateHistorian.compute_next_collection_time(
+                    collection_time, group['agg_time_period'],
+                    group['use_calendar_periods'])
+        return None
+
+    def _new_bucket(self, start_time, end_time):
+        # Data published before streaming started is read from the data
+        # table when the bucket closes.
+        gaps = []
+        if start_time < self._stream_started:
+            gaps.append((start_time, min(end_time, self._stream_started)))
+        return {'state': AggregateState(), 'gaps': gaps}
+
+    def _capture_stream_data(self, peer, sender, bus, topic, headers,
+                             message):
+        """
+        Update the running state of the streamed points with the values
+        of a devices/.../all publish.
+        """
+        if not self._streams or not topic.endswith('/all'):
+            return
+        # Named like the historian names the points of a device
+        device = '/'.join(self._topic_replacer.replace(topic).split('/')[1:-1])
+        timestamp_string = headers.get(headers_mod.TIMESTAMP,
+                                       headers.get(headers_mod.DATE))
+        timestamp = utils.get_aware_utc_now()
+        if timestamp_string is not None:
+            timestamp, _ = utils.process_timestamp(timestamp_string, topic)
+        if timestamp < self._stream_started:
+            return
+        try:
+            values = message if isinstance(message, dict) else message[0]
+        except (IndexError, KeyError, TypeError):
+            _log.error("message for {} missing message string".format(topic))
+            return
+
+        for point, value in values.items():
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                continue
+            name = device + '/' + point
+            agg_ids = self._stream_ids(name)
+            if agg_ids:
+                self._device_topics.add(name.lower())
+            for agg_id in agg_ids:
+                window = self._stream_window(self._streams[agg_id]['group'],
+                                             timestamp)
+                if window is None:
+                    continue
+                key = (agg_id,) + window
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = self._new_bucket(*window)
+                bucket['state'].update(timestamp, value)
+
+    def _close_bucket(self, agg_topic_id, topic_ids, agg_type, start_time,
+                      end_time):
+        """
+        Compute the aggregate of a streamed point for the period that
+        closes, querying the data table only for the parts of the period
+        that were not streamed.
+
+        :return: a tuple of (aggregated value, count of records over which
+                 this aggregation was computed)
+        """
+        bucket = self._buckets.pop((agg_topic_id, start_time, end_time),
+                                   None)
+        if bucket is None:
+            bucket = self._new_bucket(start_time, end_time)
+        state = bucket['state']
+        for gap_start, gap_end in bucket['gaps']:
+            state.merge(self._collect_state(topic_ids, agg_type,
+                                            gap_start, gap_end))
+        return state.value(agg_type), state.count
+
+    def _collect_state(self, topic_ids, agg_type, start_time, end_time):
+        state = AggregateState()
+        agg_type = agg_type.lower()
+        query_type = 'sum' if agg_type in ('avg', 'total') else agg_type
+        value, count = self.collect_aggregate(topic_ids, query_type,
+                                              start_time, end_time)
+        if not count:
+            return state
+        state.count = count
+        if query_type == 'sum':
+            state.sum = value
+        elif query_type in ('min', 'max'):
+            setattr(state, query_type, value)
+        return state
+
+    def _close_restored_buckets(self):
+        """
+        Write the aggregates of the restored periods that closed while the
+        agent was not running and drop the ones that no longer match the
+        configuration.
+        """
+        now = utils.get_aware_utc_now()
+        for key in list(self._buckets):
+            agg_id, start_time, end_time = key
+            stream = self._streams.get(agg_id)
+            if stream is None:
+                del self._buckets[key]
+                continue
+            if end_time > now:
+                if self._stream_window(stream['group'],
+                                       start_time) != (start_time, end_time):
+                    _log.info("Dropping streamed aggregate of {} between {} "
+                              "and {} as it does not match the configured "
+                              "periods".format(agg_id, start_time, end_time))
+                    del self._buckets[key]
+                continue
+            self._insert_closed_bucket(agg_id, stream, start_time,
+                                       end_time)
+
+    def _insert_closed_bucket(self, agg_id, stream, start_time, end_time):
+        data = stream['data']
+        topic_ids = data['topic_ids']
+        if self._is_streamed(data):
+            agg_value, count = self._close_bucket(agg_id, topic_ids,
+                                                  data['aggregation_type'],
+                                                  start_time, end_time)
+        else:
+            self._buckets.pop((agg_id, start_time, end_time), None)
+            agg_value, count = self.collect_aggregate(
+                topic_ids, data['aggregation_type'], start_time, end_time)
+        if count and count >= data.get('min_count', 0):
+            _log.info("Recording streamed aggregate of {} between {} and {} "
+                      "closed while the agent was not running".format(
+                          data['aggregation_topic_name'], start_time,
+                          end_time))
+            self.insert_aggregate(agg_id, data['aggregation_type'],
+                                  stream['group']['agg_time_period'],
+                                  end_time, agg_value, topic_ids)
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self._checkpoint_path):
+            return
+        try:
+            with open(self._checkpoint_path) as f:
+                checkpoint = json.load(f)
+            saved = utils.parse_timestamp_string(checkpoint['saved'])
+            self._device_topics.update(checkpoint.get('device_topics', []))
+            for item in checkpoint['buckets']:
+                start_time = utils.parse_timestamp_string(item['start'])
+                end_time = utils.parse_timestamp_string(item['end'])
+                gaps = [(utils.parse_timestamp_string(s),
+                         utils.parse_timestamp_string(e))
+                        for s, e in item['gaps']]
+                # Data published while the agent was not running
+                if saved < end_time:
+                    gaps.append((max(saved, start_time),
+                                 min(end_time, self._stream_started)))
+                self._buckets[(item['agg_topic_id'], start_time,
+                               end_time)] = {
+                    'state': AggregateState.from_dict(item['state']),
+                    'gaps': gaps}
+        except (ValueError, KeyError, TypeError) as e:
+            _log.error("Ignoring invalid streaming aggregation checkpoint "
+                       "{}: {}".format(self._checkpoint_path, e))
+            self._buckets = {}
+        _log.debug("Restored {} streamed aggregates from {}".format(
+            len(self._buckets), self._checkpoint_path))
+
+    def _save_checkpoint(self):
+        if not self._streaming:
+            return
+        buckets = []
+        for (agg_id, start_time, end_time), bucket in self._buckets.items():
+            buckets.append({
+                'agg_topic_id': agg_id,
+                'start': utils.format_timestamp(start_time),
+                'end': utils.format_timestamp(end_time),
+                'gaps': [[utils.format_timestamp(s), utils.format_timestamp(e)]
+                         for s, e in bucket['gaps']],
+                'state': bucket['state'].to_dict()})
+        checkpoint = {'saved': utils.format_timestamp(
+            utils.get_aware_utc_now()), 'buckets': buckets,
+            'device_topics': sorted(self._device_topics)}
+        tmp_path = self._checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self._checkpoint_path)
+
+    @Core.receiver('onstop')
+    def _stop_streaming(self, sender, **kwargs):
+        self._save_checkpoint()
 
     @abstractmethod
     def get_topic_map(self):
@@ -421,6 +1013,17 @@ class AggregateHistorian(Agent):
         """
         pass
 
+    def get_topic_count(self):
+        """
+        Return the number of topics in the historian. Checked every
+        collection cycle with topic name patterns configured, subclasses
+        should override this method with a count query as by default the
+        whole topic map is loaded.
+
+        :return: number of topics
+        """
+        return len(self.get_topic_map()[0])
+
     @abstractmethod
     def get_agg_topic_map(self):
         """
@@ -707,3 +1310,13 @@ class AggregateHistorian(Agent):
                                                          microsecond=0)
 
         return start_time, end_time
+
+
+def _get_checkpoint_path(name):
+    if utils.is_secure_mode():
+        # we want to create it in the agent-data directory since agent will
+        # not have write access to any other directory in secure mode
+        return os.path.join(os.getcwd(),
+                            os.path.basename(os.getcwd()) + ".agent-data",
+                            name)
+    return name
@@ -195,6 +195,35 @@ As records are published to the data store
 records that was published or :py:meth:`BaseHistorianAgent.report_all_handled`
 if everything was published.
 
+Device Frames
+-------------
+
+When `capture_device_frames` is enabled each device (or analysis) publish is
+kept together as a single frame record through the event queue and the
+backup cache instead of one record per point:
+
+.. code-block:: python
+
+    {
+        '_id': 3,
+        'frame': True,
+        'timestamp': timestamp1.replace(tzinfo=pytz.UTC),
+        'source': 'scrape',
+        'topic': "pnnl/isb1/hvac1",
+        'value': {"thermostat": 73.0, "temperature": 74.1},
+        'meta': {"thermostat": {"units": "F", "tz": "UTC", "type": "float"},
+                 "temperature": {"units": "F", "tz": "UTC", "type": "float"}},
+        'headers': {...}
+    }
+
+Historians only receive frames if they set
+:py:attr:`BaseHistorianAgent.supports_device_frames` to True, all other
+historians receive frames already expanded into point records with
+:py:func:`expand_device_frames`. A frame is reported as handled like any
+other record. Points expanded from a frame may also be reported one by one,
+the frame is then removed from the cache once all of its points have been
+reported.
+
 Querying Data
 -------------
 
@@ -222,26 +251,37 @@ the same date over again.
 
 
 import logging
+import mmap
+import os
 import sqlite3
+import struct
 import threading
+import time
+import uuid
 import weakref
+import zlib
 from queue import Queue, Empty
 from abc import abstractmethod
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime, timedelta
 from threading import Thread
 
 import gevent
 from gevent import get_hub
 from functools import wraps
+from itertools import chain, islice
 
 import pytz
 import re
 from dateutil.parser import parse
 from volttron.platform.agent.base_aggregate_historian import AggregateHistorian
+from volttron.platform.agent.downsample import (downsample_values,
+                                                validate_downsample)
+from volttron.platform.agent.topic_replace import TopicReplacer
 from volttron.platform.agent.utils import process_timestamp, \
     fix_sqlite3_datetime, get_aware_utc_now, parse_timestamp_string
 from volttron.platform.messaging import topics, headers as headers_mod
+from volttron.platform.scheduling import periodic
 from volttron.platform.vip.agent import *
 from volttron.platform.vip.agent import compat
 from volttron.platform.vip.agent.subsystems.query import Query
@@ -316,6 +356,66 @@ STATUS_KEY_BACKLOGGED = "backlogged"
 STATUS_KEY_CACHE_COUNT = "cache_count"
 STATUS_KEY_PUBLISHING = "publishing"
 STATUS_KEY_CACHE_FULL = "cache_full"
+STATUS_KEY_BATCHES_IN_FLIGHT = "batches_in_flight"
+STATUS_KEY_BATCH_LATENCY = "batch_latency"
+STATUS_KEY_QUEUE_OVERFLOW = "queue_overflow_count"
+
+PERFORMANCE_STATS_TOPIC = "analysis/historian_stats/{identity}"
+
+QUERY_STREAM_PAGE_SIZE = 1000
+
+BACKUP_CACHE_SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+BACKUP_CACHE_BACKENDS = ("sqlite", "segment_log")
+
+# Frames are kept apart from point records in the backup cache by prefixing
+# their source.
+_FRAME_SOURCE_PREFIX = "frame:"
+
+
+def expand_device_frame(frame):
+    """
+    Expand a device frame record into one record per point.
+
+    The point records share the timestamp, source and headers of the frame.
+    Their `_id` is a tuple of the frame `_id` and the point name, a frame is
+    removed from the cache once all of its points are reported handled.
+
+    :param frame: Frame record as passed to
+                  :py:meth:`BaseHistorianAgent.publish_to_historian`
+    :type frame: dict
+    :returns: List of point records.
+    :rtype: list
+    """
+    _id = frame.get('_id')
+    prefix = frame['topic'] + '/'
+    meta = frame['meta']
+    return [{'_id': (_id, point),
+             'timestamp': frame['timestamp'],
+             'source': frame['source'],
+             'topic': prefix + point,
+             'value': value,
+             'headers': frame['headers'],
+             'meta': meta.get(point, {})}
+            for point, value in frame['value'].items()]
+
+
+def expand_device_frames(to_publish_list):
+    """
+    Expand all the frame records in a list of records, other records are
+    passed through unchanged.
+
+    :param to_publish_list: List of records
+    :type to_publish_list: list
+    :returns: List of point records.
+    :rtype: list
+    """
+    expanded = []
+    for record in to_publish_list:
+        if record.get('frame'):
+            expanded.extend(expand_device_frame(record))
+        else:
+            expanded.append(record)
+    return expanded
 
 
 class BaseHistorianAgent(Agent):
@@ -347,12 +447,25 @@ class BaseHistorianAgent(Agent):
     historian.
     """
 
+    # Set to True by historians whose publish_to_historian handles device
+    # frame records. Others receive frames expanded into point records.
+    supports_device_frames = False
+
+    # Set to True by historians that can run publish_to_historian in several
+    # threads at once, each with the connection created by
+    # historian_worker_setup. Required for publish_pipeline_depth.
+    supports_publish_pipeline = False
+
     def __init__(self,
                  retry_period=300.0,
                  submit_size_limit=1000,
                  max_time_publishing=30.0,
                  backup_storage_limit_gb=None,
                  backup_storage_report=0.9,
+                 backup_cache_batched=False,
+                 backup_cache_synchronous=None,
+                 backup_cache_backend="sqlite",
+                 backup_segment_size_mb=64,
                  topic_replace_list=[],
                  gather_timing_data=False,
                  readonly=False,
@@ -361,6 +474,10 @@ class BaseHistorianAgent(Agent):
                  capture_log_data=True,
                  capture_analysis_data=True,
                  capture_record_data=True,
+                 capture_device_frames=False,
+                 publish_pipeline_depth=1,
+                 performance_stats_interval=0,
+                 event_queue_size=0,
                  message_publish_count=10000,
                  history_limit_days=None,
                  storage_limit_gb=None,
@@ -387,6 +504,10 @@ class BaseHistorianAgent(Agent):
         self.volttron_table_defs = 'volttron_table_definitions'
         self._backup_storage_limit_gb = backup_storage_limit_gb
         self._backup_storage_report = backup_storage_report
+        self._backup_cache_batched = bool(backup_cache_batched)
+        self._backup_cache_synchronous = backup_cache_synchronous
+        self._backup_cache_backend = backup_cache_backend
+        self._backup_segment_size_mb = float(backup_segment_size_mb)
         self._retry_period = float(retry_period)
         self._submit_size_limit = int(submit_size_limit)
         self._max_time_publishing = float(max_time_publishing)
@@ -396,13 +517,30 @@ class BaseHistorianAgent(Agent):
         # Remove the need to reset subscriptions to eliminate possible data
         # loss at config change.
         self._current_subscriptions = set()
-        self._topic_replace_map = {}
+        self._topic_replacer = TopicReplacer.from_replace_list(topic_replace_list)
         self._event_queue = gevent.queue.Queue() if self._process_loop_in_greenlet else Queue()
+        # When the event queue holds event_queue_size records new records are
+        # written straight to the backup cache, shared with the process loop
+        # under the lock.
+        self._event_queue_size = int(event_queue_size)
+        self._backup_lock = threading.Lock()
+        self._spill_backupdb = None
+        self._queue_overflow_count = 0
         self._readonly = bool(readonly)
         self._stop_process_loop = False
         self._setup_failed = False
         self._process_thread = None
         self._message_publish_count = int(message_publish_count)
+        self._capture_device_frames = bool(capture_device_frames)
+        self._publish_pipeline_depth = int(publish_pipeline_depth)
+        # Records reported by publish_to_historian in a publish worker thread.
+        self._publish_state = threading.local()
+        self._performance_stats = HistorianPerformanceStats()
+        self._performance_stats_interval = float(performance_stats_interval)
+        self._performance_stats_event = None
+        self._device_data_filter = device_data_filter
+        # device -> compiled device_data_filter, reset on configuration.
+        self._device_data_filter_cache = {}
 
         self.no_insert = False
         self.no_query = False
@@ -423,6 +561,10 @@ class BaseHistorianAgent(Agent):
                                 "max_time_publishing": self._max_time_publishing,
                                 "backup_storage_limit_gb": self._backup_storage_limit_gb,
                                 "backup_storage_report": self._backup_storage_report,
+                                "backup_cache_batched": self._backup_cache_batched,
+                                "backup_cache_synchronous": self._backup_cache_synchronous,
+                                "backup_cache_backend": self._backup_cache_backend,
+                                "backup_segment_size_mb": self._backup_segment_size_mb,
                                 "topic_replace_list": self._topic_replace_list,
                                 "gather_timing_data": self.gather_timing_data,
                                 "readonly": self._readonly,
@@ -430,6 +572,10 @@ class BaseHistorianAgent(Agent):
                                 "capture_log_data": capture_log_data,
                                 "capture_analysis_data": capture_analysis_data,
                                 "capture_record_data": capture_record_data,          
+                                "capture_device_frames": self._capture_device_frames,
+                                "publish_pipeline_depth": self._publish_pipeline_depth,
+                                "performance_stats_interval": self._performance_stats_interval,
+                                "event_queue_size": self._event_queue_size,
                                 "message_publish_count": self._message_publish_count,
                                 "storage_limit_gb": storage_limit_gb,
                                 "history_limit_days": history_limit_days,
@@ -515,6 +661,18 @@ class BaseHistorianAgent(Agent):
             else:
                 backup_storage_report = 0.9
 
+            backup_cache_batched = bool(config.get("backup_cache_batched", False))
+            backup_cache_synchronous = config.get("backup_cache_synchronous")
+            if backup_cache_synchronous is not None:
+                backup_cache_synchronous = str(backup_cache_synchronous).upper()
+                if backup_cache_synchronous not in BACKUP_CACHE_SYNCHRONOUS_LEVELS:
+                    raise ValueError("Invalid backup_cache_synchronous value: {}".format(backup_cache_synchronous))
+
+            backup_cache_backend = config.get("backup_cache_backend", "sqlite")
+            if backup_cache_backend not in BACKUP_CACHE_BACKENDS:
+                raise ValueError("Invalid backup_cache_backend value: {}".format(backup_cache_backend))
+            backup_segment_size_mb = float(config.get("backup_segment_size_mb", 64))
+
             retry_period = float(config.get("retry_period", 300.0))
 
             storage_limit_gb = config.get("storage_limit_gb")
@@ -529,6 +687,14 @@ class BaseHistorianAgent(Agent):
             max_time_publishing = float(config.get("max_time_publishing", 30.0))
 
             readonly = bool(config.get("readonly", False))
+            capture_device_frames = bool(config.get("capture_device_frames", False))
+            publish_pipeline_depth = int(config.get("publish_pipeline_depth", 1))
+            if publish_pipeline_depth < 1:
+                raise ValueError("Invalid publish_pipeline_depth value: {}".format(publish_pipeline_depth))
+            performance_stats_interval = float(config.get("performance_stats_interval") or 0)
+            event_queue_size = int(config.get("event_queue_size") or 0)
+            if event_queue_size < 0:
+                raise ValueError("Invalid event_queue_size value: {}".format(event_queue_size))
             message_publish_count = int(config.get("message_publish_count", 10000))
 
             all_platforms = bool(config.get("all_platforms", False))
@@ -541,10 +707,9 @@ class BaseHistorianAgent(Agent):
         query = Query(self.core)
         self.instance_name = query.query('instance-name').get()
 
-        # Reset replace map.
-        self._topic_replace_map = {}
-
         self._topic_replace_list = topic_replace_list
+        # Rebuild the replacer, this also resets its cache.
+        self._topic_replacer = TopicReplacer.from_replace_list(topic_replace_list)
 
         _log.info('Topic string replace list: {}'
                   .format(self._topic_replace_list))
@@ -552,6 +717,10 @@ class BaseHistorianAgent(Agent):
         self.gather_timing_data = gather_timing_data
         self._backup_storage_limit_gb = backup_storage_limit_gb
         self._backup_storage_report = backup_storage_report
+        self._backup_cache_batched = backup_cache_batched
+        self._backup_cache_synchronous = backup_cache_synchronous
+        self._backup_cache_backend = backup_cache_backend
+        self._backup_segment_size_mb = backup_segment_size_mb
         self._retry_period = retry_period
         self._submit_size_limit = submit_size_limit
         self._max_time_publishing = timedelta(seconds=max_time_publishing)
@@ -559,7 +728,11 @@ class BaseHistorianAgent(Agent):
         self._storage_limit_gb = storage_limit_gb
         self._all_platforms = all_platforms
         self._readonly = readonly
+        self._capture_device_frames = capture_device_frames
+        self._publish_pipeline_depth = publish_pipeline_depth
+        self._event_queue_size = event_queue_size
         self._message_publish_count = message_publish_count
+        self._schedule_performance_stats(performance_stats_interval)
 
         custom_topics_list = []
         for handler, topic_list in config.get("custom_topics", {}).items():
@@ -584,6 +757,7 @@ class BaseHistorianAgent(Agent):
 
         self.stop_process_thread()
         self._device_data_filter = config.get("device_data_filter")
+        self._device_data_filter_cache = {}
         try:
             self.configure(config)
         except Exception as e:
@@ -635,6 +809,38 @@ class BaseHistorianAgent(Agent):
         `historian_setup` is called after this is called. """
         pass
 
+    @RPC.export
+    def get_performance_stats(self):
+        """RPC method returning where the historian spends its time.
+
+        Latencies are in seconds and summarize the most recent samples of
+        each stage: waiting in the event queue, inserting into the backup
+        cache, reading from the cache, publish_to_historian, deleting from
+        the cache and the age of the oldest record of each published batch.
+
+        :return: Dictionary with the latency percentiles of each stage, the
+                 event queue depth and the backlog growth rate in records
+                 per second.
+        :rtype: dict
+        """
+        return self._performance_stats.as_dict()
+
+    def _schedule_performance_stats(self, interval):
+        if self._performance_stats_event is not None:
+            self._performance_stats_event.cancel()
+            self._performance_stats_event = None
+        self._performance_stats_interval = interval
+        if interval > 0:
+            self._performance_stats_event = self.core.schedule(periodic(interval),
+                                                               self._publish_performance_stats)
+
+    def _publish_performance_stats(self):
+        values, meta = self._performance_stats.as_record()
+        now = utils.format_timestamp(get_aware_utc_now())
+        headers = {headers_mod.DATE: now, headers_mod.TIMESTAMP: now}
+        topic = PERFORMANCE_STATS_TOPIC.format(identity=self.core.identity)
+        self.vip.pubsub.publish('pubsub', topic, headers=headers, message=[values, meta])
+
     @RPC.export
     def insert(self, records):
         """RPC method to allow remote inserts to the local cache
@@ -717,34 +923,7 @@ class BaseHistorianAgent(Agent):
         :param input_topic: 
         :return: 
         """
-        output_topic = input_topic
-        input_topic_lower = input_topic.lower()
-        # Only if we have some topics to replace.
-        if self._topic_replace_list:
-            # if we have already cached the topic then return it.
-            if input_topic_lower in self._topic_replace_map:
-                output_topic = self._topic_replace_map[input_topic_lower]
-            else:
-                self._topic_replace_map[input_topic_lower] = input_topic
-                temptopics = {}
-                for x in self._topic_replace_list:
-                    if x['from'].lower() in input_topic_lower:
-                        # this allows multiple things to be replaced from
-                        # from a given topic.
-                        new_topic = temptopics.get(input_topic_lower,
-                                                   input_topic)
-                        # temptopics[input_topic] = new_topic.replace(
-                        #     x['from'], x['to'])
-
-                        temptopics[input_topic_lower] = re.compile(
-                            re.escape(x['from']), re.IGNORECASE).sub(x['to'],
-                            new_topic)
-
-                for k, v in temptopics.items():
-                    self._topic_replace_map[k] = v
-                output_topic = self._topic_replace_map[input_topic_lower]
-            _log.debug("Output topic after replacements {}".format(output_topic))
-        return output_topic
+        return self._topic_replacer.replace(input_topic)
 
     def _capture_record_data(self, peer, sender, bus, topic, headers,
                              message):
@@ -762,12 +941,13 @@ class BaseHistorianAgent(Agent):
         if self.gather_timing_data:
             add_timing_data_to_header(headers, self.core.agent_uuid or self.core.identity, "collected")
 
-        self._event_queue.put(
+        self._queue_records([
             {'source': 'record',
              'topic': topic,
              'readings': [(timestamp, message)],
              'meta': {},
-             'headers': headers})
+             'headers': headers,
+             'queued': time.monotonic()}])
 
     def _capture_log_data(self, peer, sender, bus, topic, headers, message):
         """Capture log data and submit it to be published by a historian."""
@@ -794,6 +974,7 @@ class BaseHistorianAgent(Agent):
         if self.gather_timing_data:
             add_timing_data_to_header(headers, self.core.agent_uuid or self.core.identity, "collected")
 
+        records = []
         for point, item in data.items():
             if 'Readings' not in item or 'Units' not in item:
                 _log.error("logging request for {topic} missing Readings "
@@ -819,11 +1000,14 @@ class BaseHistorianAgent(Agent):
                 elif my_tz:
                     meta['tz'] = my_tz.zone
 
-            self._event_queue.put({'source': 'log',
-                                   'topic': topic + '/' + point,
-                                   'readings': readings,
-                                   'meta': meta,
-                                   'headers': headers})
+            records.append({'source': 'log',
+                            'topic': topic + '/' + point,
+                            'readings': readings,
+                            'meta': meta,
+                            'headers': headers,
+                            'queued': time.monotonic()})
+
+        self._queue_records(records)
 
     def _capture_device_data(self, peer, sender, bus, topic, headers,
                              message):
@@ -842,40 +1026,76 @@ class BaseHistorianAgent(Agent):
         # we strip it off to get the base device
         parts = topic.split('/')
         device = '/'.join(parts[1:-1])
-        # msg = [{data},{meta}] format
-        msg = [{}, {}]
-        try:
-            # If the filter is empty pass all data.
-            if self._device_data_filter:
-                for _filter, point_list in self._device_data_filter.items():
-                    # If filter is not empty only topics that contain the key
-                    # will be kept.
-                    if _filter in device:
-                        for point in point_list:
-                            # devices all publish
-                            if isinstance(message, list):
-                                # Only points in the point list will be added to the message payload
-                                if point in message[0]:
-                                    msg[0][point] = message[0][point]
-                                    msg[1][point] = message[1][point]
-                            else:
-                                # other devices publish (devices/campus/building/device/point)
-                                msg = None
-                                if point in device:
-                                    msg = message
-                                    # if the point in in the parsed topic then exit for loop
-                                    break
-                if (isinstance(msg, list) and not msg[0]) or \
-                        (isinstance(msg, (float, int, str)) and msg is None):
-                    _log.debug("Topic: {} - is not in configured to be stored".format(topic))
-                    return
-            else:
+        # If the filter is empty pass all data.
+        msg = message
+        if self._device_data_filter:
+            try:
+                msg = self._filter_device_data(device, message)
+            except Exception as e:
+                _log.debug("Error handling device_data_filter. {}".format(e))
                 msg = message
-        except Exception as e:
-            _log.debug("Error handling device_data_filter. {}".format(e))
-            msg = message
+            if msg is None:
+                _log.debug("Topic: {} - is not in configured to be stored".format(topic))
+                return
         self._capture_data(peer, sender, bus, topic, headers, msg, device)
 
+    def _compile_device_data_filter(self, device):
+        """
+        Resolve the device_data_filter for one device.
+
+        Every filter whose key is contained in the device name contributes
+        its points. For publishes that are not [{data}, {meta}] lists the
+        last matching filter decides whether the whole message is kept,
+        which is the case if one of its points is contained in the device
+        name.
+
+        :returns: (set of allowed points, keep whole message) or None if no
+                  filter applies to the device.
+        """
+        allowed = None
+        keep_message = False
+        for _filter, point_list in self._device_data_filter.items():
+            # If filter is not empty only topics that contain the key
+            # will be kept.
+            if _filter in device:
+                if allowed is None:
+                    allowed = set()
+                allowed.update(point_list)
+                if point_list:
+                    keep_message = any(point in device for point in point_list)
+        if allowed is None:
+            return None
+        return frozenset(allowed), keep_message
+
+    def _filter_device_data(self, device, message):
+        """
+        Apply the device_data_filter to a device publish. The filter is
+        compiled once per device and cached until the configuration changes.
+
+        :returns: the filtered message or None if nothing should be stored.
+        """
+        try:
+            compiled = self._device_data_filter_cache[device]
+        except KeyError:
+            compiled = self._device_data_filter_cache[device] = \
+                self._compile_device_data_filter(device)
+
+        if compiled is None:
+            return None
+
+        allowed, keep_message = compiled
+        # devices all publish
+        if isinstance(message, list):
+            # Only points in the point list will be added to the message payload
+            values = {point: value for point, value in message[0].items() if point in allowed}
+            if not values:
+                return None
+            meta = message[1]
+            return [values, {point: meta[point] for point in values}]
+
+        # other devices publish (devices/campus/building/device/point)
+        return message if keep_message else None
+
     def _capture_analysis_data(self, peer, sender, bus, topic, headers,
                                message):
         """Capture analaysis data and submit it to be published by a historian.
@@ -947,13 +1167,26 @@ class BaseHistorianAgent(Agent):
         if self.gather_timing_data:
             add_timing_data_to_header(headers, self.core.agent_uuid or self.core.identity, "collected")
 
-        for key, value in values.items():
-            point_topic = device + '/' + key
-            self._event_queue.put({'source': source,
-                                   'topic': point_topic,
-                                   'readings': [(timestamp, value)],
-                                   'meta': meta.get(key, {}),
-                                   'headers': headers})
+        queued = time.monotonic()
+        if self._capture_device_frames:
+            # Keep the whole publish together, it is only expanded into
+            # points for historians that do not handle frames.
+            self._queue_records([{'source': source,
+                                  'topic': device,
+                                  'readings': [(timestamp, dict(values))],
+                                  'meta': meta,
+                                  'headers': headers,
+                                  'frame': True,
+                                  'queued': queued}])
+            return
+
+        self._queue_records([{'source': source,
+                              'topic': device + '/' + key,
+                              'readings': [(timestamp, value)],
+                              'meta': meta.get(key, {}),
+                              'headers': headers,
+                              'queued': queued}
+                             for key, value in values.items()])
 
     def _capture_actuator_data(self, topic, headers, message, match):
         """Capture actuation data and submit it to be published by a historian.
@@ -995,11 +1228,51 @@ class BaseHistorianAgent(Agent):
         if self.gather_timing_data:
             add_timing_data_to_header(headers, self.core.agent_uuid or self.core.identity, "collected")
 
-        self._event_queue.put({'source': source,
-                               'topic': topic,
-                               'readings': [timestamp, value],
-                               'meta': {},
-                               'headers': headers})
+        self._queue_records([{'source': source,
+                              'topic': topic,
+                              'readings': [timestamp, value],
+                              'meta': {},
+                              'headers': headers,
+                              'queued': time.monotonic()}])
+
+    def _queue_records(self, records):
+        """
+        Hand the records of a publish to the process loop. Once the event
+        queue holds event_queue_size records they are written to the backup
+        cache in bulk instead, unless the process loop is using the cache at
+        that moment. The callbacks run in the agent's main loop and never wait
+        for it, the records are queued then.
+        """
+        if self._event_queue_size and self._event_queue.qsize() >= self._event_queue_size:
+            backupdb = self._spill_backupdb
+            if backupdb is not None and records and self._spill_records(backupdb, records):
+                return
+        for record in records:
+            self._event_queue.put(record)
+
+    def _spill_records(self, backupdb, records):
+        try:
+            spilled = backupdb.try_backup_new_data(records)
+        except Exception:
+            # The process loop may have closed the cache.
+            _log.exception("Failed to write overflowing records to the backup cache.")
+            return False
+        if spilled is None:
+            return False
+        cache_full, backlog_count = spilled
+
+        if not self._queue_overflow_count:
+            _log.warning("Event queue is full ({} records), writing new records "
+                         "to the backup cache.".format(self._event_queue_size))
+        self._queue_overflow_count += len(records)
+        updates = {STATUS_KEY_QUEUE_OVERFLOW: self._queue_overflow_count,
+                   STATUS_KEY_CACHE_COUNT: backlog_count}
+        if cache_full:
+            updates.update({STATUS_KEY_CACHE_FULL: True, STATUS_KEY_BACKLOGGED: True})
+            self._send_alert(updates, "historian_cache_full")
+        else:
+            self._update_status(updates)
+        return True
 
     @staticmethod
     def _get_status_from_context(context):
@@ -1024,6 +1297,8 @@ class BaseHistorianAgent(Agent):
         self.vip.health.send_alert(key, alert_status)
 
     def _update_and_get_context_status(self, updates):
+        if STATUS_KEY_CACHE_COUNT in updates:
+            self._performance_stats.update_backlog(updates[STATUS_KEY_CACHE_COUNT])
         self._current_status_context.update(updates)
         context_copy = self._current_status_context.copy()
         new_status = self._get_status_from_context(context_copy)
@@ -1033,6 +1308,36 @@ class BaseHistorianAgent(Agent):
         context_copy, new_status = self._update_and_get_context_status(updates)
         self._async_call.send(None, self._send_alert_callback, new_status, context_copy, key)
 
+    def _create_backup_database(self):
+        if self._backup_cache_backend == "segment_log":
+            return SegmentLogBackupDatabase(self, self._backup_storage_limit_gb,
+                                            self._backup_storage_report,
+                                            segment_size_mb=self._backup_segment_size_mb)
+        # Shared with the subscriber callbacks when the event queue is bounded.
+        return BackupDatabase(self, self._backup_storage_limit_gb,
+                              self._backup_storage_report,
+                              check_same_thread=not self._event_queue_size,
+                              batched=self._backup_cache_batched,
+                              synchronous=self._backup_cache_synchronous)
+
+    def _create_publish_workers(self):
+        """
+        Start the publish worker threads used when publish_pipeline_depth is
+        greater than one. Returns an empty list for serial publishing.
+        """
+        depth = self._publish_pipeline_depth
+        if depth <= 1:
+            return []
+        if not self.supports_publish_pipeline:
+            _log.warning("{} does not support publish_pipeline_depth. "
+                         "Publishing serially.".format(self.__class__.__name__))
+            return []
+        if self._process_loop_in_greenlet:
+            _log.warning("publish_pipeline_depth is not supported with the process loop in a greenlet. "
+                         "Publishing serially.")
+            return []
+        return [_PublishWorker(self, "publish-worker-{}".format(index)) for index in range(depth)]
+
     def _process_loop(self):
         """
         The process loop is called off of the main thread and will not exit
@@ -1062,10 +1367,17 @@ class BaseHistorianAgent(Agent):
             _log.info("Historian setup in readonly mode.")
             return
 
-        backupdb = BackupDatabase(self, self._backup_storage_limit_gb,
-                                  self._backup_storage_report)
+        backupdb = self._create_backup_database()
+        if self._event_queue_size:
+            backupdb = _LockedBackupDatabase(backupdb, self._backup_lock)
+            self._spill_backupdb = backupdb
         self._update_status({STATUS_KEY_CACHE_COUNT: backupdb.get_backlog_count()})
 
+        workers = self._create_publish_workers()
+        if workers:
+            self._update_status({STATUS_KEY_BATCHES_IN_FLIGHT: 0,
+                                 STATUS_KEY_BATCH_LATENCY: None})
+
         # now that everything is setup we need to make sure that the topics
         # are synchronized between
 
@@ -1075,10 +1387,13 @@ class BaseHistorianAgent(Agent):
         # before proceeding with the rest of the loop.
         wait_for_input = not bool(backupdb.get_outstanding_to_publish(1))
 
+        stats = self._performance_stats
+
         while True:
             if not wait_for_input:
                 self._update_status({STATUS_KEY_BACKLOGGED: True})
 
+            stats.update_queue_depth(self._event_queue.qsize())
             try:
                 # _log.debug("Reading from/waiting for queue.")
                 new_to_publish = [
@@ -1097,7 +1412,10 @@ class BaseHistorianAgent(Agent):
 
             # We wake the thread after a configuration change by passing a None to the queue.
             # Backup anything new before checking for a stop.
-            cache_full = backupdb.backup_new_data((x for x in new_to_publish if x is not None))
+            new_to_publish = [x for x in new_to_publish if x is not None]
+            stats.record_queue_wait(new_to_publish)
+            with stats.timer("cache_insert"):
+                cache_full = backupdb.backup_new_data(new_to_publish)
             backlog_count = backupdb.get_backlog_count()
             if cache_full:
                 self._send_alert({STATUS_KEY_CACHE_FULL: cache_full,
@@ -1123,76 +1441,91 @@ class BaseHistorianAgent(Agent):
                 wait_for_input = True
                 start_time = datetime.utcnow()
 
-                while True:
-                    to_publish_list = backupdb.get_outstanding_to_publish(
-                        self._submit_size_limit)
-
-                    # Check to see if we are caught up.
-                    if not to_publish_list:
-                        if self._message_publish_count > 0 and next_report_count < current_published_count:
-                            _log.info("Historian processed {} total records.".format(current_published_count))
-                            next_report_count = current_published_count + self._message_publish_count
-                        self._update_status({STATUS_KEY_BACKLOGGED: False,
-                                             STATUS_KEY_CACHE_COUNT: backupdb.get_backlog_count()})
-                        break
-
-                    # Check for a stop for reconfiguration.
-                    if self._stop_process_loop:
-                        break
-
-                    history_limit_timestamp = None
-                    if self._history_limit_days is not None:
-                        last_element = to_publish_list[-1]
-                        last_time_stamp = last_element["timestamp"]
-                        history_limit_timestamp = last_time_stamp - self._history_limit_days
-
-                    try:
-                        self.publish_to_historian(to_publish_list)
-                        self.manage_db_size(history_limit_timestamp, self._storage_limit_gb)
-                    except:
-                        _log.exception(
-                            "An unhandled exception occurred while publishing.")
-
-                    # if the success queue is empty then we need not remove
-                    # them from the database and we are probably having connection problems.
-                    # Update the status and send alert accordingly.
-                    if not self._successful_published:
-                        self._send_alert({STATUS_KEY_PUBLISHING: False}, "historian_not_publishing")
-                        break
-
-                    backupdb.remove_successfully_published(
-                        self._successful_published, self._submit_size_limit)
-
-                    backlog_count = backupdb.get_backlog_count()
-                    old_backlog_state = self._current_status_context[STATUS_KEY_BACKLOGGED]
-                    self._update_status({STATUS_KEY_PUBLISHING: True,
-                                         STATUS_KEY_BACKLOGGED: old_backlog_state and backlog_count > 0,
-                                         STATUS_KEY_CACHE_COUNT: backlog_count})
-
-                    if None in self._successful_published:
-                        current_published_count += len(to_publish_list)
-                    else:
-                        current_published_count += len(self._successful_published)
-
-                    if self._message_publish_count > 0:
-                        if current_published_count >= next_report_count:
-                            _log.info("Historian processed {} total records.".format(current_published_count))
-                            next_report_count = current_published_count + self._message_publish_count
-
-                    self._successful_published = set()
-                    now = datetime.utcnow()
-                    if now - start_time > self._max_time_publishing:
-                        wait_for_input = False
-                        break
-
-                    # Check for a stop for reconfiguration.
-                    if self._stop_process_loop:
-                        break
+                if workers:
+                    published, wait_for_input = self._publish_pipelined(backupdb, workers, start_time)
+                    current_published_count += published
+                    if self._message_publish_count > 0 and current_published_count >= next_report_count:
+                        _log.info("Historian processed {} total records.".format(current_published_count))
+                        next_report_count = current_published_count + self._message_publish_count
+                else:
+                    while True:
+                        with stats.timer("cache_read"):
+                            to_publish_list = backupdb.get_outstanding_to_publish(
+                                self._submit_size_limit)
+
+                        # Check to see if we are caught up.
+                        if not to_publish_list:
+                            if self._message_publish_count > 0 and next_report_count < current_published_count:
+                                _log.info("Historian processed {} total records.".format(current_published_count))
+                                next_report_count = current_published_count + self._message_publish_count
+                            self._update_status({STATUS_KEY_BACKLOGGED: False,
+                                                 STATUS_KEY_CACHE_COUNT: backupdb.get_backlog_count()})
+                            break
+
+                        # Check for a stop for reconfiguration.
+                        if self._stop_process_loop:
+                            break
+
+                        history_limit_timestamp = self._history_limit_timestamp(to_publish_list)
+
+                        publish_list = to_publish_list
+                        if not self.supports_device_frames:
+                            publish_list = expand_device_frames(to_publish_list)
+
+                        try:
+                            with stats.timer("publish"):
+                                self.publish_to_historian(publish_list)
+                            self.manage_db_size(history_limit_timestamp, self._storage_limit_gb)
+                        except:
+                            _log.exception(
+                                "An unhandled exception occurred while publishing.")
+
+                        # if the success queue is empty then we need not remove
+                        # them from the database and we are probably having connection problems.
+                        # Update the status and send alert accordingly.
+                        if not self._successful_published:
+                            self._send_alert({STATUS_KEY_PUBLISHING: False}, "historian_not_publishing")
+                            break
+
+                        with stats.timer("cache_delete"):
+                            backupdb.remove_successfully_published(
+                                self._get_handled_ids(to_publish_list), self._submit_size_limit)
+                        stats.record_age(to_publish_list)
+
+                        backlog_count = backupdb.get_backlog_count()
+                        old_backlog_state = self._current_status_context[STATUS_KEY_BACKLOGGED]
+                        self._update_status({STATUS_KEY_PUBLISHING: True,
+                                             STATUS_KEY_BACKLOGGED: old_backlog_state and backlog_count > 0,
+                                             STATUS_KEY_CACHE_COUNT: backlog_count})
+
+                        if None in self._successful_published:
+                            current_published_count += len(to_publish_list)
+                        else:
+                            current_published_count += len(self._successful_published)
+
+                        if self._message_publish_count > 0:
+                            if current_published_count >= next_report_count:
+                                _log.info("Historian processed {} total records.".format(current_published_count))
+                                next_report_count = current_published_count + self._message_publish_count
+
+                        self._successful_published = set()
+                        now = datetime.utcnow()
+                        if now - start_time > self._max_time_publishing:
+                            wait_for_input = False
+                            break
+
+                        # Check for a stop for reconfiguration.
+                        if self._stop_process_loop:
+                            break
 
             # Check for a stop for reconfiguration.
             if self._stop_process_loop:
                 break
 
+        for worker in workers:
+            worker.stop()
+
+        self._spill_backupdb = None
         backupdb.close()
 
         try:
@@ -1203,6 +1536,121 @@ class BaseHistorianAgent(Agent):
         _log.debug("Process loop stopped.")
         self._stop_process_loop = False
 
+    def _history_limit_timestamp(self, records):
+        """
+        Data older than the returned timestamp is removed by manage_db_size.
+        It is measured from the newest of the records as the segment log
+        cache returns records in the order they were cached rather than in
+        timestamp order.
+        """
+        if self._history_limit_days is None:
+            return None
+        # Forwarded records may keep their timestamp as a string.
+        newest = max((x['timestamp'] for x in records
+                      if isinstance(x['timestamp'], datetime)), default=None)
+        if newest is None:
+            return None
+        return newest - self._history_limit_days
+
+    def _publish_pipelined(self, backupdb, workers, start_time):
+        """
+        Publish the backlog with up to one batch in flight per worker.
+
+        Batches are read from the cache ahead of the ones in flight and
+        acknowledged in the order they were read. Only the batches for the
+        free workers are read, skipping the records already in flight. Once a
+        batch fails no new batches are started, the ones in flight are still
+        acknowledged.
+
+        :returns: The number of records published and whether to wait for new
+                  input before publishing again.
+        """
+        in_flight = deque()
+        dispatched = set()
+        dispatch_count = 0
+        published = 0
+        wait_for_input = True
+        dispatching = True
+        failed = False
+        depth = len(workers)
+        stats = self._performance_stats
+
+        while True:
+            if dispatching and len(in_flight) < depth:
+                with stats.timer("cache_read"):
+                    window = backupdb.get_outstanding_to_publish(
+                        self._submit_size_limit * (depth - len(in_flight)), len(dispatched))
+                # Records cached since with an older timestamp shift the
+                # in flight ones past the skipped part.
+                window = [x for x in window if x['_id'] not in dispatched]
+                while window and len(in_flight) < depth:
+                    batch = window[:self._submit_size_limit]
+                    window = window[self._submit_size_limit:]
+                    publish_list = batch
+                    if not self.supports_device_frames:
+                        publish_list = expand_device_frames(batch)
+                    # The worker of the batch at the head is free again
+                    # once it is acknowledged.
+                    worker = workers[dispatch_count % depth]
+                    dispatch_count += 1
+                    in_flight.append(worker.submit(batch, publish_list))
+                    dispatched.update(x['_id'] for x in batch)
+
+            # Caught up, or done after a stop or failure.
+            if not in_flight:
+                break
+
+            pending = in_flight.popleft()
+            pending.wait()
+            batch = pending.batch
+            stats.record("publish", pending.latency)
+            dispatched.difference_update(x['_id'] for x in batch)
+
+            if not pending.handled:
+                failed = True
+                dispatching = False
+                continue
+
+            handled_ids = self._get_handled_ids(batch, pending.handled)
+            if None in handled_ids:
+                handled_ids = [x['_id'] for x in batch]
+                published += len(batch)
+            else:
+                published += len(pending.handled)
+            with stats.timer("cache_delete"):
+                backupdb.remove_successfully_published(handled_ids, len(batch))
+            stats.record_age(batch)
+
+            history_limit_timestamp = self._history_limit_timestamp(batch)
+            try:
+                self.manage_db_size(history_limit_timestamp, self._storage_limit_gb)
+            except:
+                _log.exception("An unhandled exception occurred while managing the database size.")
+
+            backlog_count = backupdb.get_backlog_count()
+            old_backlog_state = self._current_status_context[STATUS_KEY_BACKLOGGED]
+            self._update_status({STATUS_KEY_PUBLISHING: True,
+                                 STATUS_KEY_BACKLOGGED: old_backlog_state and backlog_count > 0,
+                                 STATUS_KEY_CACHE_COUNT: backlog_count,
+                                 STATUS_KEY_BATCHES_IN_FLIGHT: len(in_flight),
+                                 STATUS_KEY_BATCH_LATENCY: pending.latency})
+
+            if dispatching:
+                if self._stop_process_loop:
+                    dispatching = False
+                elif datetime.utcnow() - start_time > self._max_time_publishing:
+                    dispatching = False
+                    wait_for_input = False
+
+        if failed:
+            self._send_alert({STATUS_KEY_PUBLISHING: False,
+                              STATUS_KEY_BATCHES_IN_FLIGHT: 0}, "historian_not_publishing")
+        elif dispatching:
+            self._update_status({STATUS_KEY_BACKLOGGED: False,
+                                 STATUS_KEY_CACHE_COUNT: backupdb.get_backlog_count(),
+                                 STATUS_KEY_BATCHES_IN_FLIGHT: 0})
+        return published, wait_for_input
+
     def _historian_setup(self):
         try:
             _log.info("Trying to setup historian")
@@ -1229,11 +1677,12 @@ class BaseHistorianAgent(Agent):
         :param record: Record or list of records to remove from cache.
         :type record: dict or list
         """
+        successful_published = self._get_successful_published()
         if isinstance(record, list):
             for x in record:
-                self._successful_published.add(x['_id'])
+                successful_published.add(x['_id'])
         else:
-            self._successful_published.add(record['_id'])
+            successful_published.add(record['_id'])
 
     def report_all_handled(self):
         """
@@ -1242,7 +1691,11 @@ class BaseHistorianAgent(Agent):
         :py:meth:`BaseHistorianAgent.publish_to_historian`
         have been successfully published and should be removed from the cache.
         """
-        self._successful_published.add(None)
+        self._get_successful_published().add(None)
+
+    def _get_successful_published(self):
+        # Publish workers each report into their own set.
+        return getattr(self._publish_state, 'successful_published', self._successful_published)
 
     @abstractmethod
     def publish_to_historian(self, to_publish_list):
@@ -1288,6 +1741,32 @@ class BaseHistorianAgent(Agent):
         report records as being published.
         """
 
+    def _get_handled_ids(self, to_publish_list, handled=None):
+        """
+        Translate the reported records into cache ids. Points expanded from
+        a frame are reported as (frame id, point), the frame is only handled
+        once every one of its points is.
+        """
+        if handled is None:
+            handled = self._successful_published
+        if None in handled:
+            return handled
+
+        ids = set()
+        frame_points = defaultdict(set)
+        for _id in handled:
+            if isinstance(_id, tuple):
+                frame_points[_id[0]].add(_id[1])
+            else:
+                ids.add(_id)
+
+        if frame_points:
+            for record in to_publish_list:
+                points = frame_points.get(record['_id'])
+                if points is not None and record.get('frame') and points.issuperset(record['value']):
+                    ids.add(record['_id'])
+        return ids
+
     def historian_setup(self):
         """
         Optional setup routine, run in the processing thread before
@@ -1302,6 +1781,20 @@ class BaseHistorianAgent(Agent):
         arrives from the config store.
         """
 
+    def historian_worker_setup(self):
+        """
+        Optional setup routine, run in each publish worker thread when
+        publish_pipeline_depth is greater than one. Gives the Historian a
+        chance to open the connection :py:meth:`publish_to_historian` uses in
+        that thread. Called again before the next batch if it raises.
+        """
+
+    def historian_worker_teardown(self):
+        """
+        Optional teardown routine, run in each publish worker thread when
+        the processing loop is stopped.
+        """
+
     @abstractmethod
     def record_table_definitions(self, meta_table_name):
         """
@@ -1378,7 +1871,293 @@ class BaseHistorianAgent(Agent):
 #             my_deque.popleft()
 
 
-class BackupDatabase:
+def _get_backup_path(name):
+    if utils.is_secure_mode():
+        # we want to create it in the agent-data directory since agent will not have write access to any other
+        # directory in secure mode
+        return os.path.join(os.getcwd(), os.path.basename(os.getcwd()) + ".agent-data", name)
+    return name
+
+
+class _StageTimer:
+    """Context manager adding the time spent in its block to a stage."""
+
+    __slots__ = ('_stats', '_stage', '_start')
+
+    def __init__(self, stats, stage):
+        self._stats = stats
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.monotonic()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.record(self._stage, time.monotonic() - self._start)
+
+
+class HistorianPerformanceStats:
+    """
+    Latency samples of the stages of the :py:class:`BaseHistorianAgent`
+    process loop along with the event queue depth and the backlog size.
+
+    Only the most recent `window_size` samples of each stage are kept, the
+    percentiles describe the historian's current behaviour. Samples are
+    added by the process loop and read from the agent's main thread.
+    Historians running queries on a pool of connections also add the time
+    a query waits for a connection and the time it runs.
+    """
+
+    STAGES = ("queue_wait", "cache_insert", "cache_read", "publish", "cache_delete", "record_age",
+              "query_wait", "query")
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window_size=1024, backlog_window=60.0):
+        self._samples = {stage: deque(maxlen=window_size) for stage in self.STAGES}
+        self._counts = dict.fromkeys(self.STAGES, 0)
+        self._backlog_window = backlog_window
+        # (monotonic time, backlog count)
+        self._backlog = deque()
+        self._queue_depth = 0
+        self._queue_depth_max = 0
+
+    def timer(self, stage):
+        return _StageTimer(self, stage)
+
+    def record(self, stage, seconds):
+        if seconds is None:
+            return
+        self._samples[stage].append(seconds)
+        self._counts[stage] += 1
+
+    def record_queue_wait(self, records):
+        """Record how long each of the records waited in the event queue."""
+        now = time.monotonic()
+        for record in records:
+            queued = record.get('queued')
+            if queued is not None:
+                self.record("queue_wait", now - queued)
+
+    def record_age(self, records):
+        """Record the age of the oldest of the published records."""
+        if records:
+            oldest = min(x['timestamp'] for x in records)
+            # Forwarded records may keep their timestamp as a string.
+            if isinstance(oldest, datetime):
+                if oldest.tzinfo is None:
+                    oldest = oldest.replace(tzinfo=pytz.UTC)
+                self.record("record_age", (get_aware_utc_now() - oldest).total_seconds())
+
+    def update_queue_depth(self, depth):
+        self._queue_depth = depth
+        self._queue_depth_max = max(self._queue_depth_max, depth)
+
+    def update_backlog(self, count, now=None):
+        now = time.monotonic() if now is None else now
+        self._backlog.append((now, count))
+        while len(self._backlog) > 2 and now - self._backlog[1][0] >= self._backlog_window:
+            self._backlog.popleft()
+
+    def backlog_growth_rate(self):
+        """Change of the backlog in records per second over the last
+        `backlog_window` seconds."""
+        backlog = list(self._backlog)
+        if len(backlog) < 2 or backlog[-1][0] <= backlog[0][0]:
+            return 0.0
+        (start, first), (end, last) = backlog[0], backlog[-1]
+        return (last - first) / (end - start)
+
+    def stage_summary(self, stage):
+        samples = sorted(self._samples[stage])
+        summary = {'count': self._counts[stage]}
+        if samples:
+            for percentile in self.PERCENTILES:
+                index = min(len(samples) - 1, len(samples) * percentile // 100)
+                summary['p{}'.format(percentile)] = samples[index]
+            summary['max'] = samples[-1]
+        return summary
+
+    def as_dict(self):
+        backlog = self._backlog[-1][1] if self._backlog else 0
+        return {'stages': {stage: self.stage_summary(stage) for stage in self.STAGES},
+                'queue_depth': self._queue_depth,
+                'queue_depth_max': self._queue_depth_max,
+                'backlog_count': backlog,
+                'backlog_growth_rate': self.backlog_growth_rate()}
+
+    def as_record(self):
+        """Flatten the statistics into the values and meta data of an
+        analysis publish."""
+        stats = self.as_dict()
+        seconds = {'units': 'seconds', 'type': 'float', 'tz': 'UTC'}
+        values, meta = {}, {}
+        for stage, summary in stats.pop('stages').items():
+            for key, value in summary.items():
+                name = '{}_{}'.format(stage, key)
+                values[name] = value
+                meta[name] = {'units': 'count', 'type': 'integer', 'tz': 'UTC'} if key == 'count' else seconds
+        for name, value in stats.items():
+            values[name] = value
+            meta[name] = {'units': 'records/second' if name == 'backlog_growth_rate' else 'records',
+                          'type': 'float' if name == 'backlog_growth_rate' else 'integer',
+                          'tz': 'UTC'}
+        return values, meta
+
+
+class _PendingBatch:
+    """A batch of records handed to a :py:class:`_PublishWorker`."""
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.handled = None
+        self.latency = None
+        self._done = threading.Event()
+
+    def finish(self, handled, latency):
+        self.handled = handled
+        self.latency = latency
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+
+class _PublishWorker:
+    """
+    Thread calling :py:meth:`BaseHistorianAgent.publish_to_historian` for
+    the batches submitted to it, one at a time, when publish_pipeline_depth
+    is greater than one.
+    """
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        # Plain threading primitives, the worker never runs in a greenlet.
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._thread = Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, batch, publish_list):
+        pending = _PendingBatch(batch)
+        self._put((pending, publish_list))
+        return pending
+
+    def stop(self, timeout=9.0):
+        self._put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            _log.error("Failed to stop publish worker {}!".format(self._thread.name))
+
+    def _put(self, item):
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify()
+
+    def _get(self):
+        with self._condition:
+            while not self._items:
+                self._condition.wait()
+            return self._items.popleft()
+
+    def _setup(self):
+        try:
+            self._owner.historian_worker_setup()
+            return True
+        except Exception:
+            _log.exception("Failed to setup publish worker!")
+            return False
+
+    def _run(self):
+        owner = self._owner
+        state = owner._publish_state
+        ready = self._setup()
+        while True:
+            item = self._get()
+            if item is None:
+                break
+            pending, publish_list = item
+            state.successful_published = set()
+            start = time.monotonic()
+            if not ready:
+                ready = self._setup()
+            if ready:
+                try:
+                    owner.publish_to_historian(publish_list)
+                except Exception:
+                    _log.exception("An unhandled exception occurred while publishing.")
+            pending.finish(state.successful_published, time.monotonic() - start)
+
+        try:
+            owner.historian_worker_teardown()
+        except Exception:
+            _log.exception("Publish worker teardown failed!")
+
+
+class BaseBackupDatabase:
+    """
+    Interface of the backup cache used by the :py:class:`BaseHistorianAgent`
+    process loop. Records are handed to the cache as soon as they are taken
+    off the event queue and are only removed from it once they have been
+    published to the data store.
+
+    Historian implementors do not need to use this class. It is for internal
+    use only.
+    """
+
+    @abstractmethod
+    def backup_new_data(self, new_publish_list):
+        """
+        :param new_publish_list: An iterable of records to cache to disk.
+        :type new_publish_list: iterable
+        :returns: True if records the cache has reached a full state.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def remove_successfully_published(self, successful_publishes,
+                                      submit_size):
+        """
+        Removes the reported successful publishes from the cache.
+        If None is found in `successful_publishes` we assume that everything
+        returned by the last call to
+        :py:meth:`get_outstanding_to_publish` was published.
+
+        :param successful_publishes: List of records that was published.
+        :param submit_size: Number of things requested from previous call to
+                            :py:meth:`get_outstanding_to_publish`
+
+        :type successful_publishes: list
+        :type submit_size: int
+        """
+
+    @abstractmethod
+    def get_outstanding_to_publish(self, size_limit, skip=0):
+        """
+        Retrieve up to `size_limit` of the oldest records from the cache.
+
+        :param size_limit: Max number of records to retrieve.
+        :param skip: Number of oldest records to pass over, such as the ones
+                     already being published.
+        :type size_limit: int
+        :type skip: int
+        :returns: List of records for publication.
+        :rtype: list
+        """
+
+    @abstractmethod
+    def get_backlog_count(self):
+        """
+        Retrieve the current number of records in the cache.
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        Release the resources held by the cache.
+        """
+
+
+class BackupDatabase(BaseBackupDatabase):
     """
     A creates and manages backup cache for the
     :py:class:`BaseHistorianAgent` class.
@@ -1388,7 +2167,7 @@ class BackupDatabase:
     """
 
     def __init__(self, owner, backup_storage_limit_gb, backup_storage_report,
-                 check_same_thread=True):
+                 check_same_thread=True, batched=False, synchronous=None):
         # The topic cache is only meant as a local lookup and should not be
         # accessed via the implemented historians.
         self._backup_cache = {}
@@ -1398,6 +2177,10 @@ class BackupDatabase:
         self._owner = weakref.ref(owner)
         self._backup_storage_limit_gb = backup_storage_limit_gb
         self._backup_storage_report = backup_storage_report
+        # In batched mode readings are written with executemany and the
+        # database runs in WAL mode.
+        self._batched = batched
+        self._synchronous = synchronous
         self._connection = None
         self._setupdb(check_same_thread)
 
@@ -1411,48 +2194,10 @@ class BackupDatabase:
         #_log.debug("Backing up unpublished values.")
         c = self._connection.cursor()
 
-        for item in new_publish_list:
-            source = item['source']
-            topic = item['topic']
-            meta = item.get('meta', {})
-            readings = item['readings']
-            headers = item.get('headers', {})
-
-            topic_id = self._backup_cache.get(topic)
-
-            if topic_id is None:
-                c.execute('''INSERT INTO topics values (?,?)''',
-                          (None, topic))
-                c.execute('''SELECT last_insert_rowid()''')
-                row = c.fetchone()
-                topic_id = row[0]
-                self._backup_cache[topic_id] = topic
-                self._backup_cache[topic] = topic_id
-
-            meta_dict = self._meta_data[(source, topic_id)]
-            for name, value in meta.items():
-                current_meta_value = meta_dict.get(name)
-                if current_meta_value != value:
-                    c.execute('''INSERT OR REPLACE INTO metadata
-                                 values(?, ?, ?, ?)''',
-                              (source, topic_id, name, value))
-                    meta_dict[name] = value
-
-            for timestamp, value in readings:
-                if timestamp is None:
-                    timestamp = get_aware_utc_now()
-                try:
-                    c.execute(
-                        '''INSERT INTO outstanding
-                        values(NULL, ?, ?, ?, ?, ?)''',
-                        (timestamp, source, topic_id, dumps(value), dumps(headers)))
-                    self._record_count += 1
-                except sqlite3.IntegrityError:
-                    # In the case where we are upgrading an existing installed historian the
-                    # unique constraint may still exist on the outstanding database.
-                    # Ignore this case.
-                    _log.warning(f"sqlite3.Integrity error -- {e}")
-                    pass
+        if self._batched:
+            self._backup_new_data_batched(c, new_publish_list)
+        else:
+            self._backup_new_data_per_row(c, new_publish_list)
 
         cache_full = False
         if self._backup_storage_limit_gb is not None:
@@ -1466,40 +2211,41 @@ class BackupDatabase:
                     return c.fetchone()[0]
 
                 p = page_count()
-                f = free_count()
 
                 # check if we are over the alert threshold.
-                if page_count() >= self.max_pages - int(self.max_pages * (1.0 - self._backup_storage_report)):
+                if p >= self.max_pages - int(self.max_pages * (1.0 - self._backup_storage_report)):
                     cache_full = True
 
                 # Now check if we are above the limit, if so start deleting in batches of 100
                 # page count doesnt update even after deleting all records
                 # and record count becomes zero. If we have deleted all record
                 # exit.
-                _log.debug(f"record count before check is {self._record_count} page count is {p}"
-                           f" free count is {f}")
-                # max_pages  gets updated based on inserts but freelist_count doesn't
-                # enter delete loop based on page_count
-                min_free_pages = p - self.max_pages
-                while p > self.max_pages:
-                    cache_full = True
-                    c.execute(
-                        '''DELETE FROM outstanding
-                        WHERE ROWID IN
-                        (SELECT ROWID FROM outstanding
-                        ORDER BY ROWID ASC LIMIT 100)''')
-                    #self._connection.commit()
-                    if self._record_count < c.rowcount:
-                        self._record_count = 0
-                    else:
-                        self._record_count -= c.rowcount
-                    p = page_count()  #page count doesn't reflect delete without commit
-                    f = free_count() # freelist count does. So using that to break from loop
-                    if f >= min_free_pages:
-                        break
-                    _log.debug(f" Cleaning cache since we are over the limit. "
-                               f"After delete of 100 records from cache"
-                               f" record count is {self._record_count} page count is {p} freelist count is{f}")
+                if p > self.max_pages:
+                    f = free_count()
+                    _log.debug(f"record count before check is {self._record_count} page count is {p}"
+                               f" free count is {f}")
+                    # max_pages  gets updated based on inserts but freelist_count doesn't
+                    # enter delete loop based on page_count
+                    min_free_pages = p - self.max_pages
+                    while p > self.max_pages:
+                        cache_full = True
+                        c.execute(
+                            '''DELETE FROM outstanding
+                            WHERE ROWID IN
+                            (SELECT ROWID FROM outstanding
+                            ORDER BY ROWID ASC LIMIT 100)''')
+                        #self._connection.commit()
+                        if self._record_count < c.rowcount:
+                            self._record_count = 0
+                        else:
+                            self._record_count -= c.rowcount
+                        p = page_count()  #page count doesn't reflect delete without commit
+                        f = free_count() # freelist count does. So using that to break from loop
+                        if f >= min_free_pages:
+                            break
+                        _log.debug(f" Cleaning cache since we are over the limit. "
+                                   f"After delete of 100 records from cache"
+                                   f" record count is {self._record_count} page count is {p} freelist count is{f}")
 
             except Exception as e:
                 _log.warning(f"Exception when check page count and deleting{e}")
@@ -1511,6 +2257,113 @@ class BackupDatabase:
 
         return cache_full
 
+    def _get_topic_id(self, c, topic):
+        topic_id = self._backup_cache.get(topic)
+
+        if topic_id is None:
+            c.execute('''INSERT INTO topics values (?,?)''',
+                      (None, topic))
+            c.execute('''SELECT last_insert_rowid()''')
+            row = c.fetchone()
+            topic_id = row[0]
+            self._backup_cache[topic_id] = topic
+            self._backup_cache[topic] = topic_id
+
+        return topic_id
+
+    def _update_meta(self, c, source, topic_id, meta, frame=False):
+        meta_dict = self._meta_data[(source, topic_id)]
+        for name, value in meta.items():
+            current_meta_value = meta_dict.get(name)
+            if current_meta_value != value:
+                # The meta of a frame maps each point to its meta dict.
+                c.execute('''INSERT OR REPLACE INTO metadata
+                             values(?, ?, ?, ?)''',
+                          (source, topic_id, name, dumps(value) if frame else value))
+                meta_dict[name] = value
+
+    def _backup_new_data_per_row(self, c, new_publish_list):
+        for item in new_publish_list:
+            source = item['source']
+            topic = item['topic']
+            meta = item.get('meta', {})
+            readings = item['readings']
+            headers = item.get('headers', {})
+            frame = item.get('frame', False)
+            if frame:
+                source = _FRAME_SOURCE_PREFIX + source
+
+            topic_id = self._get_topic_id(c, topic)
+            self._update_meta(c, source, topic_id, meta, frame)
+
+            for timestamp, value in readings:
+                if timestamp is None:
+                    timestamp = get_aware_utc_now()
+                try:
+                    c.execute(
+                        '''INSERT INTO outstanding
+                        values(NULL, ?, ?, ?, ?, ?)''',
+                        (timestamp, source, topic_id, dumps(value), dumps(headers)))
+                    self._record_count += 1
+                except sqlite3.IntegrityError as e:
+                    # In the case where we are upgrading an existing installed historian the
+                    # unique constraint may still exist on the outstanding database.
+                    # Ignore this case.
+                    _log.warning(f"sqlite3.Integrity error -- {e}")
+
+    def _backup_new_data_batched(self, c, new_publish_list):
+        rows = []
+        # Every point of a device publish shares the same headers dict so
+        # encode it once. The dict is kept in the map so its id cannot be
+        # reused by another object while this batch is being built.
+        header_strings = {}
+        for item in new_publish_list:
+            source = item['source']
+            topic = item['topic']
+            meta = item.get('meta', {})
+            readings = item['readings']
+            headers = item.get('headers', {})
+            frame = item.get('frame', False)
+            if frame:
+                source = _FRAME_SOURCE_PREFIX + source
+
+            topic_id = self._get_topic_id(c, topic)
+            self._update_meta(c, source, topic_id, meta, frame)
+
+            interned = header_strings.get(id(headers))
+            if interned is None:
+                interned = header_strings[id(headers)] = (headers, dumps(headers))
+            header_string = interned[1]
+
+            for timestamp, value in readings:
+                if timestamp is None:
+                    timestamp = get_aware_utc_now()
+                rows.append((timestamp, source, topic_id, dumps(value), header_string))
+
+        if not rows:
+            return
+
+        # executemany keeps the rows inserted before a failing one, they are
+        # rolled back to the savepoint before inserting one row at a time.
+        c.execute('SAVEPOINT backup_rows')
+        try:
+            c.executemany('''INSERT INTO outstanding
+                             values(NULL, ?, ?, ?, ?, ?)''', rows)
+            self._record_count += len(rows)
+        except sqlite3.IntegrityError:
+            c.execute('ROLLBACK TO SAVEPOINT backup_rows')
+            # An old unique constraint on the outstanding table rejects the
+            # whole statement, fall back to inserting one row at a time.
+            for row in rows:
+                try:
+                    c.execute('''INSERT INTO outstanding
+                                 values(NULL, ?, ?, ?, ?, ?)''', row)
+                    self._record_count += 1
+                except sqlite3.IntegrityError as e:
+                    _log.warning(f"sqlite3.Integrity error -- {e}")
+        finally:
+            c.execute('RELEASE SAVEPOINT backup_rows')
+
     def remove_successfully_published(self, successful_publishes,
                                       submit_size):
         """
@@ -1550,19 +2403,21 @@ class BackupDatabase:
 
         self._connection.commit()
 
-    def get_outstanding_to_publish(self, size_limit):
+    def get_outstanding_to_publish(self, size_limit, skip=0):
         """
         Retrieve up to `size_limit` records from the cache.
 
         :param size_limit: Max number of records to retrieve.
+        :param skip: Number of oldest records to pass over.
         :type size_limit: int
+        :type skip: int
         :returns: List of records for publication.
         :rtype: list
         """
         # _log.debug("Getting oldest outstanding to publish.")
         c = self._connection.cursor()
-        c.execute('select * from outstanding order by ts limit ?',
-                  (size_limit,))
+        c.execute('select * from outstanding order by ts limit ? offset ?',
+                  (size_limit, skip))
         results = []
         for row in c:
             _id = row[0]
@@ -1572,19 +2427,23 @@ class BackupDatabase:
             value = loads(row[4])
             headers = {} if row[5] is None else loads(row[5])
             meta = self._meta_data[(source, topic_id)].copy()
-            results.append({'_id': _id,
-                            'timestamp': timestamp.replace(tzinfo=pytz.UTC),
-                            'source': source,
-                            'topic': self._backup_cache[topic_id],
-                            'value': value,
-                            'headers': headers,
-                            'meta': meta})
+            record = {'_id': _id,
+                      'timestamp': timestamp.replace(tzinfo=pytz.UTC),
+                      'source': source,
+                      'topic': self._backup_cache[topic_id],
+                      'value': value,
+                      'headers': headers,
+                      'meta': meta}
+            if source.startswith(_FRAME_SOURCE_PREFIX):
+                record['source'] = source[len(_FRAME_SOURCE_PREFIX):]
+                record['frame'] = True
+            results.append(record)
 
         c.close()
 
         # If we were backlogged at startup and our initial estimate was
         # off this will correct it.
-        if len(results) < size_limit:
+        if len(results) < size_limit and not skip:
             self._record_count = len(results)
 
         return results
@@ -1604,12 +2463,7 @@ class BackupDatabase:
         """ Creates a backup database for the historian if doesn't exist."""
 
         _log.debug("Setting up backup DB.")
-        if utils.is_secure_mode():
-            # we want to create it in the agent-data directory since agent will not have write access to any other
-            # directory in secure mode
-            backup_db = os.path.join(os.getcwd(), os.path.basename(os.getcwd()) + ".agent-data", 'backup.sqlite')
-        else:
-            backup_db = 'backup.sqlite'
+        backup_db = _get_backup_path('backup.sqlite')
         _log.info(f"Creating  backup db at {backup_db}")
         self._connection = sqlite3.connect(
             backup_db,
@@ -1618,6 +2472,17 @@ class BackupDatabase:
 
         c = self._connection.cursor()
 
+        if self._batched:
+            c.execute('''PRAGMA journal_mode = WAL''')
+
+        synchronous = self._synchronous
+        if synchronous is None and self._batched:
+            # NORMAL is durable in WAL mode, a crash can only lose the last
+            # few transactions, never corrupt the cache.
+            synchronous = "NORMAL"
+        if synchronous is not None:
+            c.execute('''PRAGMA synchronous = {}'''.format(synchronous))
+
         if self._backup_storage_limit_gb is not None:
             c.execute('''PRAGMA page_size''')
             page_size = c.fetchone()[0]
@@ -1693,7 +2558,8 @@ class BackupDatabase:
         else:
             c.execute("SELECT * FROM metadata")
             for row in c:
-                self._meta_data[(row[0], row[1])][row[2]] = row[3]
+                value = loads(row[3]) if row[0].startswith(_FRAME_SOURCE_PREFIX) else row[3]
+                self._meta_data[(row[0], row[1])][row[2]] = value
 
         c.execute("SELECT name FROM sqlite_master WHERE type='table' "
                   "AND name='topics';")
@@ -1737,6 +2603,479 @@ for method in [BackupDatabase.get_outstanding_to_publish,
     setattr(AsyncBackupDatabase, method.__name__, _using_threadpool(method))
 
 
+class _LockedBackupDatabase(BaseBackupDatabase):
+    """
+    Backup cache shared by the process loop and the subscriber callbacks
+    writing to it when the event queue is full. Every call holds the lock,
+    the callbacks only write when it is free.
+    """
+
+    def __init__(self, backupdb, lock):
+        self._backupdb = backupdb
+        self._lock = lock
+
+    def backup_new_data(self, new_publish_list):
+        with self._lock:
+            return self._backupdb.backup_new_data(new_publish_list)
+
+    def try_backup_new_data(self, new_publish_list):
+        """
+        Back up the records unless the lock is held, without waiting for it.
+
+        :returns: None if the lock is held, otherwise whether the cache is
+                  full and the number of records in it.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            cache_full = self._backupdb.backup_new_data(new_publish_list)
+            return cache_full, self._backupdb.get_backlog_count()
+        finally:
+            self._lock.release()
+
+    def remove_successfully_published(self, successful_publishes, submit_size):
+        with self._lock:
+            return self._backupdb.remove_successfully_published(successful_publishes, submit_size)
+
+    def get_outstanding_to_publish(self, size_limit, skip=0):
+        with self._lock:
+            return self._backupdb.get_outstanding_to_publish(size_limit, skip)
+
+    def get_backlog_count(self):
+        with self._lock:
+            return self._backupdb.get_backlog_count()
+
+    def close(self):
+        with self._lock:
+            self._backupdb.close()
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class SegmentLogBackupDatabase(BaseBackupDatabase):
+    """
+    Backup cache for the :py:class:`BaseHistorianAgent` class stored as an
+    append-only log of fixed size, memory mapped segment files.
+
+    New records are appended to the newest segment. A read cursor marks the
+    oldest record that has not been published yet, once every record in a
+    segment is behind the cursor the whole segment file is deleted. Nothing
+    is ever updated in place, so draining a deep backlog costs sequential
+    reads and file deletes instead of index maintenance and vacuuming.
+
+    Each record is stored as a little endian (length, crc32) header followed
+    by a JSON payload. A segment ends at the first zero length header. At
+    startup the newest segment is scanned and anything after the last record
+    with a valid checksum, such as a write torn by a crash, is discarded.
+
+    Records are returned in the order they were cached rather than in
+    timestamp order. Records reported as published out of order are
+    remembered in memory, after a restart they may be published again which
+    historians must already tolerate.
+
+    Historian implementors do not need to use this class. It is for internal
+    use only.
+    """
+
+    RECORD_HEADER = struct.Struct("<II")
+    CURSOR = struct.Struct("<QII")
+    SEGMENT_PREFIX = "segment_"
+    SEGMENT_SUFFIX = ".log"
+    MIN_SEGMENT_SIZE = 64 * 1024
+    # Record ids pack the offset into the low 32 bits.
+    MAX_SEGMENT_SIZE = 1024 ** 3
+
+    def __init__(self, owner, backup_storage_limit_gb, backup_storage_report,
+                 segment_size_mb=64, directory='backup_segments'):
+        self._owner = weakref.ref(owner)
+        self._backup_storage_limit_gb = backup_storage_limit_gb
+        self._backup_storage_report = backup_storage_report
+        self._directory = _get_backup_path(directory)
+
+        segment_size = int(segment_size_mb * 1024 ** 2)
+        self._max_bytes = None
+        if backup_storage_limit_gb is not None:
+            self._max_bytes = backup_storage_limit_gb * 1024 ** 3
+            # Whole segments are dropped when over the limit, keep them
+            # small enough for the limit to be meaningful.
+            segment_size = min(segment_size, int(self._max_bytes / 4))
+        self._segment_size = max(self.MIN_SEGMENT_SIZE, min(self.MAX_SEGMENT_SIZE, segment_size))
+
+        self._meta_data = defaultdict(dict)
+        # seq -> (file, mmap)
+        self._segments = {}
+        self._write_seq = None
+        self._write_offset = 0
+        self._dirty_offset = None
+        self._read_seq = None
+        self._read_offset = 0
+        self._acked = set()
+        self._last_batch = []
+        self._record_count = 0
+        self._setup()
+
+    def backup_new_data(self, new_publish_list):
+        """
+        :param new_publish_list: An iterable of records to cache to disk.
+        :type new_publish_list: iterable
+        :returns: True if records the cache has reached a full state.
+        :rtype: bool
+        """
+        meta_changed = False
+        # Every point of a device publish shares the same headers dict so
+        # encode it once. The dict is kept in the map so its id cannot be
+        # reused by another object while this batch is being written.
+        header_strings = {}
+        for item in new_publish_list:
+            source = item['source']
+            topic = item['topic']
+            meta = item.get('meta', {})
+            readings = item['readings']
+            headers = item.get('headers', {})
+            if item.get('frame', False):
+                source = _FRAME_SOURCE_PREFIX + source
+
+            meta_dict = self._meta_data[(source, topic)]
+            for name, value in meta.items():
+                if meta_dict.get(name) != value:
+                    meta_dict[name] = value
+                    meta_changed = True
+
+            interned = header_strings.get(id(headers))
+            if interned is None:
+                interned = header_strings[id(headers)] = (headers, dumps(headers))
+            prefix = '{},{},'.format(dumps(source), dumps(topic))
+            suffix = ',{}]'.format(interned[1])
+
+            for timestamp, value in readings:
+                if timestamp is None:
+                    timestamp = get_aware_utc_now()
+                elif isinstance(timestamp, str):
+                    # Forwarded records carry the Date header, kept as it
+                    # is when it can not be parsed.
+                    try:
+                        timestamp = parse_timestamp_string(timestamp)
+                    except (ValueError, OverflowError):
+                        pass
+                if isinstance(timestamp, str):
+                    ts = dumps(timestamp)
+                else:
+                    if timestamp.tzinfo is None:
+                        timestamp = timestamp.replace(tzinfo=pytz.UTC)
+                    ts = (timestamp - _EPOCH) // _MICROSECOND
+                payload = '[{},{}{}{}'.format(ts, prefix, dumps(value), suffix)
+                self._append(payload.encode('utf-8'))
+                self._record_count += 1
+
+        self._flush()
+        if meta_changed:
+            self._save_meta()
+
+        return self._enforce_storage_limit()
+
+    def remove_successfully_published(self, successful_publishes,
+                                      submit_size):
+        """
+        Removes the reported successful publishes from the cache.
+        If None is found in `successful_publishes` we assume that everything
+        returned by the last call to :py:meth:`get_outstanding_to_publish`
+        was published.
+
+        :param successful_publishes: List of records that was published.
+        :param submit_size: Number of things requested from previous call to
+                            :py:meth:`get_outstanding_to_publish`
+
+        :type successful_publishes: list
+        :type submit_size: int
+
+        """
+        if None in successful_publishes:
+            published = set(self._last_batch[:submit_size])
+        else:
+            published = set(successful_publishes)
+
+        published -= self._acked
+        self._acked |= published
+        self._record_count = max(0, self._record_count - len(published))
+
+        for seq, offset, _ in self._iter_positions(self._read_seq, self._read_offset):
+            _id = seq << 32 | offset
+            if _id not in self._acked:
+                self._read_seq, self._read_offset = seq, offset
+                break
+            self._acked.discard(_id)
+        else:
+            self._read_seq, self._read_offset = self._write_seq, self._write_offset
+
+        self._save_cursor()
+        self._drop_segments_before(self._read_seq)
+
+    def get_outstanding_to_publish(self, size_limit, skip=0):
+        """
+        Retrieve up to `size_limit` records from the cache.
+
+        :param size_limit: Max number of records to retrieve.
+        :param skip: Number of oldest records to pass over.
+        :type size_limit: int
+        :type skip: int
+        :returns: List of records for publication.
+        :rtype: list
+        """
+        results = []
+        skipped = 0
+        if size_limit > 0:
+            header_size = self.RECORD_HEADER.size
+            for seq, offset, length in self._iter_positions(self._read_seq, self._read_offset):
+                _id = seq << 32 | offset
+                if _id in self._acked:
+                    continue
+                if skipped < skip:
+                    skipped += 1
+                    continue
+                start = offset + header_size
+                payload = self._segments[seq][1][start:start + length]
+                ts, source, topic, value, headers = loads(payload.decode('utf-8'))
+                if not isinstance(ts, str):
+                    ts = _EPOCH + ts * _MICROSECOND
+                record = {'_id': _id,
+                          'timestamp': ts,
+                          'source': source,
+                          'topic': topic,
+                          'value': value,
+                          'headers': headers,
+                          'meta': self._meta_data[(source, topic)].copy()}
+                if source.startswith(_FRAME_SOURCE_PREFIX):
+                    record['source'] = source[len(_FRAME_SOURCE_PREFIX):]
+                    record['frame'] = True
+                results.append(record)
+                if len(results) >= size_limit:
+                    break
+
+        self._last_batch = [r['_id'] for r in results]
+
+        # If we were backlogged at startup and our initial estimate was
+        # off this will correct it.
+        if len(results) < size_limit:
+            self._record_count = skipped + len(results)
+
+        return results
+
+    def get_backlog_count(self):
+        """
+        Retrieve the current number of records in the cashe.
+        """
+        return self._record_count
+
+    def close(self):
+        self._flush()
+        for f, mm in self._segments.values():
+            mm.close()
+            f.close()
+        self._segments = {}
+
+    def _segment_path(self, seq):
+        return os.path.join(self._directory,
+                            "{}{:016d}{}".format(self.SEGMENT_PREFIX, seq, self.SEGMENT_SUFFIX))
+
+    def _open_segment(self, seq, size=None):
+        path = self._segment_path(seq)
+        f = open(path, 'r+b' if size is None else 'w+b')
+        if size is not None:
+            # Sparse and zero filled, a zero length header marks the end.
+            f.truncate(size)
+        mm = mmap.mmap(f.fileno(), 0)
+        self._segments[seq] = (f, mm)
+        return mm
+
+    def _iter_positions(self, seq, offset):
+        """Yield (seq, offset, payload length) of the records from the given
+        position to the end of the log."""
+        header = self.RECORD_HEADER
+        for current in sorted(self._segments):
+            if current < seq:
+                continue
+            if current > seq:
+                offset = 0
+            mm = self._segments[current][1]
+            end = self._write_offset if current == self._write_seq else len(mm)
+            while offset + header.size <= end:
+                length, _ = header.unpack_from(mm, offset)
+                if length == 0:
+                    break
+                yield current, offset, length
+                offset += header.size + length
+
+    def _append(self, payload):
+        header = self.RECORD_HEADER
+        size = header.size + len(payload)
+        mm = self._segments[self._write_seq][1]
+        # Always leave room for the zero length header ending the segment.
+        if self._write_offset + size + header.size > len(mm):
+            self._flush()
+            self._write_seq += 1
+            self._write_offset = 0
+            mm = self._open_segment(self._write_seq,
+                                    max(self._segment_size, size + header.size))
+        offset = self._write_offset
+        if self._dirty_offset is None:
+            self._dirty_offset = offset
+        mm[offset + header.size:offset + size] = payload
+        header.pack_into(mm, offset, len(payload), zlib.crc32(payload))
+        self._write_offset = offset + size
+
+    def _flush(self):
+        if self._dirty_offset is None or self._write_seq not in self._segments:
+            return
+        start = self._dirty_offset - self._dirty_offset % mmap.ALLOCATIONGRANULARITY
+        self._segments[self._write_seq][1].flush(start, self._write_offset - start)
+        self._dirty_offset = None
+
+    def _drop_segments_before(self, seq):
+        for old in sorted(self._segments):
+            if old >= seq or old == self._write_seq:
+                break
+            f, mm = self._segments.pop(old)
+            mm.close()
+            f.close()
+            os.remove(self._segment_path(old))
+
+    def _enforce_storage_limit(self):
+        if self._max_bytes is None:
+            return False
+
+        def used_bytes():
+            return sum(len(mm) for seq, (_, mm) in self._segments.items()
+                       if seq != self._write_seq) + self._write_offset
+
+        used = used_bytes()
+        cache_full = used >= self._max_bytes * self._backup_storage_report
+
+        while used > self._max_bytes and len(self._segments) > 1:
+            cache_full = True
+            oldest = min(self._segments)
+            dropped = 0
+            for seq, offset, _ in self._iter_positions(self._read_seq, self._read_offset):
+                if seq != oldest:
+                    break
+                _id = seq << 32 | offset
+                if _id in self._acked:
+                    self._acked.discard(_id)
+                else:
+                    dropped += 1
+            self._record_count = max(0, self._record_count - dropped)
+            self._read_seq, self._read_offset = oldest + 1, 0
+            self._save_cursor()
+            self._drop_segments_before(self._read_seq)
+            _log.debug(f"Cleaning cache since we are over the limit. Dropped segment {oldest} "
+                       f"with {dropped} records, record count is {self._record_count}")
+            used = used_bytes()
+
+        return cache_full
+
+    def _save_cursor(self):
+        data = struct.pack("<QI", self._read_seq, self._read_offset)
+        path = os.path.join(self._directory, "cursor")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(self.CURSOR.pack(self._read_seq, self._read_offset, zlib.crc32(data)))
+        os.replace(path + ".tmp", path)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self._directory, "cursor"), 'rb') as f:
+                seq, offset, crc = self.CURSOR.unpack(f.read(self.CURSOR.size))
+        except (OSError, struct.error):
+            return None
+        if zlib.crc32(struct.pack("<QI", seq, offset)) != crc:
+            _log.warning("Backup cache cursor is corrupt, replaying from the oldest segment.")
+            return None
+        return seq, offset
+
+    def _save_meta(self):
+        path = os.path.join(self._directory, "meta.json")
+        with open(path + ".tmp", 'w') as f:
+            f.write(dumps([[source, topic, meta]
+                           for (source, topic), meta in self._meta_data.items()]))
+        os.replace(path + ".tmp", path)
+
+    def _recover_write_offset(self, mm):
+        """Find the end of the last complete record in a segment and wipe
+        anything after it."""
+        header = self.RECORD_HEADER
+        offset = 0
+        while offset + header.size <= len(mm):
+            length, crc = header.unpack_from(mm, offset)
+            start = offset + header.size
+            if length == 0 or start + length > len(mm) or \
+                    zlib.crc32(mm[start:start + length]) != crc:
+                break
+            offset = start + length
+        tail = mm[offset:offset + header.size]
+        if tail.strip(b'\0'):
+            _log.warning(f"Discarding incomplete record at offset {offset} of backup cache segment.")
+            mm[offset:] = bytes(len(mm) - offset)
+            mm.flush()
+        return offset
+
+    def _setup(self):
+        _log.info(f"Opening backup segment log at {self._directory}")
+        os.makedirs(self._directory, exist_ok=True)
+
+        try:
+            with open(os.path.join(self._directory, "meta.json")) as f:
+                for source, topic, meta in loads(f.read()):
+                    self._meta_data[(source, topic)] = meta
+        except (OSError, ValueError):
+            pass
+
+        seqs = []
+        for name in os.listdir(self._directory):
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX):
+                try:
+                    seqs.append(int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        seqs.sort()
+
+        for seq in list(seqs):
+            path = self._segment_path(seq)
+            size = os.path.getsize(path)
+            if size >= self.MIN_SEGMENT_SIZE:
+                self._open_segment(seq)
+            elif size == 0 and seq != seqs[-1]:
+                # Left by a crash between creating and sizing the segment,
+                # before the segment was written to.
+                _log.warning(f"Removing empty backup cache segment {path}.")
+                os.remove(path)
+                seqs.remove(seq)
+            else:
+                # Zero filled past the records it holds, if any.
+                _log.warning(f"Resizing short backup cache segment {path} of {size} bytes.")
+                with open(path, 'r+b') as f:
+                    f.truncate(self._segment_size)
+                self._open_segment(seq)
+
+        if seqs:
+            self._write_seq = seqs[-1]
+            self._write_offset = self._recover_write_offset(self._segments[self._write_seq][1])
+        else:
+            self._write_seq = 0
+            self._write_offset = 0
+            self._open_segment(0, self._segment_size)
+
+        cursor = self._load_cursor()
+        if cursor is None or cursor[0] not in self._segments:
+            cursor = (min(self._segments), 0)
+        self._read_seq, self._read_offset = cursor
+        if self._read_seq == self._write_seq:
+            self._read_offset = min(self._read_offset, self._write_offset)
+        self._drop_segments_before(self._read_seq)
+
+        _log.info("Counting existing records.")
+        self._record_count = sum(1 for _ in self._iter_positions(self._read_seq, self._read_offset))
+
+
 class BaseQueryHistorianAgent(Agent):
     """This is the base agent for historian Agents that support querying of
     their data stores.
@@ -1758,6 +3097,15 @@ class BaseQueryHistorianAgent(Agent):
             else:
                 time_parser = yacc.yacc(write_tables=0)
         super(BaseQueryHistorianAgent, self).__init__(**kwargs)
+        self._query_streams = OrderedDict()
+
+    # Seconds a streamed query may wait for its next query_next call
+    # before it is closed.
+    query_stream_timeout = 300.0
+    # Number of streamed queries that may be open at a time. The least
+    # recently read one is closed to make room for a new one.
+    max_query_streams = 16
+
     @RPC.export
     def get_version(self):
         """RPC call to get the version of the historian
@@ -1878,7 +3226,8 @@ class BaseQueryHistorianAgent(Agent):
 
     @RPC.export
     def query(self, topic=None, start=None, end=None, agg_type=None,
-              agg_period=None, skip=0, count=None, order="FIRST_TO_LAST"):
+              agg_period=None, skip=0, count=None, order="FIRST_TO_LAST",
+              downsample=None):
         """RPC call to query an Historian for time series data.
 
         :param topic: Topic or topics to query for.
@@ -1897,9 +3246,15 @@ class BaseQueryHistorianAgent(Agent):
                          aggregation ( for example, sum, avg)
         :param agg_period: If this is a query for aggregate data, the time
                            period of aggregation
+        :param downsample: Reduce the results to about a number of points,
+                           for example {'method': 'lttb', 'points': 500}.
+                           See :py:mod:`volttron.platform.agent.downsample`
+                           for the methods. Only numeric values are
+                           returned.
         :type skip: int
         :type count: int
         :type order: str
+        :type downsample: dict
 
         :return: Results of the query
         :rtype: dict
@@ -1928,6 +3283,209 @@ class BaseQueryHistorianAgent(Agent):
 
         """
 
+        start, end, agg_period = self._parse_query_args(
+            topic, start, end, agg_type, agg_period)
+
+        if downsample is not None:
+            method, points = validate_downsample(downsample)
+            results = self.query_historian_downsampled(
+                topic, start, end, agg_type, agg_period, skip, count, order,
+                method, points)
+        else:
+            results = self.query_historian(topic, start, end, agg_type,
+                                           agg_period, skip, count, order)
+        metadata = results.get("metadata", None)
+        values = results.get("values", None)
+        if values and metadata is None:
+            results['metadata'] = {}
+
+        return results
+
+    def query_historian_downsampled(self, topic, start, end, agg_type,
+                                    agg_period, skip, count, order, method,
+                                    points):
+        """
+        This function is called by :py:meth:`BaseQueryHistorianAgent.query`
+        for downsampled queries and returns the results in the format of
+        :py:meth:`query_historian`.
+
+        Historians that can downsample in their data store should override
+        this. The default downsamples the results of
+        :py:meth:`query_historian` with
+        :py:func:`volttron.platform.agent.downsample.downsample_values`.
+
+        See :py:meth:`query_historian` for the other parameters.
+
+        :param method: Downsampling method, one of
+                       :py:data:`volttron.platform.agent.downsample.DOWNSAMPLE_METHODS`
+        :param points: Number of points to reduce each topic to.
+        :return: Results of the query
+        :rtype: dict
+        """
+        results = self.query_historian(topic, start, end, agg_type,
+                                       agg_period, skip, count, order)
+        if results.get('values'):
+            results['values'] = downsample_values(
+                results['values'], method, points, start, end, order)
+        return results
+
+    @RPC.export
+    def query_stream(self, topic=None, start=None, end=None, agg_type=None,
+                     agg_period=None, order="FIRST_TO_LAST",
+                     page_size=QUERY_STREAM_PAGE_SIZE):
+        """RPC call to query an Historian for time series data a page at a
+        time. Takes the same arguments as :py:meth:`query`, but instead of
+        skip and count the results are returned page_size records at a
+        time. The historian reads them from the data store as the pages are
+        requested, so that large results do not have to be held in memory.
+
+        :param page_size: Number of records in each page. When the query is
+                          for multiple topics a page may hold records of
+                          more than one topic.
+        :type page_size: int
+
+        :return: First page of the results
+        :rtype: dict
+
+        Return values have the form of :py:meth:`query` with a "next" token
+        to pass to :py:meth:`query_next` for the next page, None once all the
+        results have been returned:
+
+        .. code-block:: python
+
+            {
+                "values": [(<timestamp string1>: value1),
+                           (<timestamp string2>: value2),
+                            ...],
+                "metadata": {"key1": value1,
+                             "key2": value2,
+                             ...},
+                "next": "<token>"
+            }
+
+        A stream that is not read for query_stream_timeout seconds is
+        closed and its token is no longer valid.
+        """
+        start, end, agg_period = self._parse_query_args(
+            topic, start, end, agg_type, agg_period)
+        if not isinstance(page_size, int) or page_size < 1:
+            raise ValueError("page_size must be a positive integer, "
+                             "got {}".format(page_size))
+
+        rows, metadata = self.query_historian_stream(
+            topic, start, end, agg_type, agg_period, order, page_size)
+        stream = _QueryStream(rows, isinstance(topic, list) and
+                              len(topic) > 1, page_size)
+        results = self._next_query_page(stream)
+        results['metadata'] = metadata or {}
+        return results
+
+    @RPC.export
+    def query_next(self, token):
+        """RPC call to get the next page of a query started with
+        :py:meth:`query_stream`.
+
+        :param token: The "next" token of the previous page.
+        :type token: str
+        :return: The next page of the results, in the form returned by
+                 :py:meth:`query_stream` without "metadata".
+        :rtype: dict
+        """
+        self._expire_query_streams()
+        stream = self._query_streams.pop(token, None)
+        if stream is None:
+            raise ValueError("Unknown or expired query token {}".format(token))
+        return self._next_query_page(stream)
+
+    @RPC.export
+    def query_stream_close(self, token):
+        """RPC call to close a query started with :py:meth:`query_stream`
+        without reading the rest of its pages.
+
+        :param token: The "next" token of the last page read.
+        :type token: str
+        """
+        stream = self._query_streams.pop(token, None)
+        if stream is not None:
+            stream.close()
+
+    def _next_query_page(self, stream):
+        values = stream.next_page()
+        token = None
+        if not stream.exhausted:
+            self._expire_query_streams(reserve=1)
+            token = uuid.uuid4().hex
+            self._query_streams[token] = stream
+        return {'values': values, 'next': token}
+
+    def _expire_query_streams(self, reserve=0):
+        now = time.monotonic()
+        for token, stream in list(self._query_streams.items()):
+            if now - stream.last_read > self.query_stream_timeout:
+                del self._query_streams[token]
+                stream.close()
+        while self._query_streams and \
+                len(self._query_streams) + reserve > self.max_query_streams:
+            token, stream = self._query_streams.popitem(last=False)
+            _log.warning("Closing query stream {} to make room for a new "
+                         "one".format(token))
+            stream.close()
+
+    def query_historian_stream(self, topic, start=None, end=None,
+                               agg_type=None, agg_period=None,
+                               order="FIRST_TO_LAST",
+                               page_size=QUERY_STREAM_PAGE_SIZE):
+        """
+        This function is called by
+        :py:meth:`BaseQueryHistorianAgent.query_stream` to query the data
+        store and returns a tuple (rows, metadata). rows is an iterable of
+        (topic_name, timestamp string, value) tuples holding all the rows
+        of a topic before the rows of the next topic, in the order of the
+        topics queried for. metadata is the metadata of the topic for a
+        single topic query, otherwise {}.
+
+        rows is read as the pages are requested. If it has a close method it
+        is called when the stream is closed before all the rows are read.
+
+        Historians that can read their results from a server side cursor
+        should override this. The default reads the rows of each topic
+        page_size records at a time with the skip and count of
+        :py:meth:`query_historian`.
+
+        See :py:meth:`query_historian` for the other parameters.
+
+        :param page_size: Number of records in each page of the stream.
+        :return: tuple (rows, metadata)
+        :rtype: tuple
+        """
+        topics_list = [topic] if isinstance(topic, str) else list(topic)
+
+        def read(name, skip):
+            results = self.query_historian(name, start, end, agg_type,
+                                           agg_period, skip, page_size, order)
+            return results.get('values') or [], results.get('metadata') or {}
+
+        first_values, metadata = read(topics_list[0], 0) if topics_list \
+            else ([], {})
+
+        def rows():
+            for index, name in enumerate(topics_list):
+                values = first_values if index == 0 else read(name, 0)[0]
+                skip = 0
+                while True:
+                    for ts, value in values:
+                        yield name, ts, value
+                    if len(values) < page_size:
+                        break
+                    skip += page_size
+                    values = read(name, skip)[0]
+
+        if len(topics_list) > 1:
+            metadata = {}
+        return rows(), metadata
+
+    @staticmethod
+    def _parse_query_args(topic, start, end, agg_type, agg_period):
         if topic is None:
             raise TypeError('"Topic" required')
 
@@ -1962,15 +3520,7 @@ class BaseQueryHistorianAgent(Agent):
 
         if start:
             _log.debug("start={}".format(start))
-
-        results = self.query_historian(topic, start, end, agg_type,
-                                       agg_period, skip, count, order)
-        metadata = results.get("metadata", None)
-        values = results.get("values", None)
-        if values and metadata is None:
-            results['metadata'] = {}
-
-        return results
+        return start, end, agg_period
 
     @abstractmethod
     def query_historian(self, topic, start=None, end=None, agg_type=None,
@@ -2041,6 +3591,45 @@ class BaseQueryHistorianAgent(Agent):
         """
 
 
+class _QueryStream(object):
+    """Rows of a query started with
+    :py:meth:`BaseQueryHistorianAgent.query_stream` that are waiting to be
+    read by :py:meth:`BaseQueryHistorianAgent.query_next`."""
+
+    def __init__(self, rows, multi_topic, page_size):
+        self._rows = rows
+        self._iter = iter(rows)
+        self._multi_topic = multi_topic
+        self._page_size = page_size
+        self._lookahead = []
+        self.exhausted = False
+        self.last_read = time.monotonic()
+
+    def next_page(self):
+        self.last_read = time.monotonic()
+        page = list(islice(chain(self._lookahead, self._iter),
+                           self._page_size + 1))
+        # one row more than the page is read to know if it is the last one
+        if len(page) > self._page_size:
+            self._lookahead = [page.pop()]
+        else:
+            self._lookahead = []
+            self.exhausted = True
+            self.close()
+
+        if self._multi_topic:
+            values = defaultdict(list)
+            for name, ts, value in page:
+                values[name].append((ts, value))
+            return dict(values)
+        return [(ts, value) for _, ts, value in page]
+
+    def close(self):
+        close = getattr(self._rows, 'close', None)
+        if close is not None:
+            close()
+
+
 class BaseHistorian(BaseHistorianAgent, BaseQueryHistorianAgent):
     def __init__(self, **kwargs):
         _log.debug('Constructor of BaseHistorian thread: {}'.format(
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+"""
+Downsampling of historian query results.
+
+Used by :py:meth:`BaseQueryHistorianAgent.query
+<volttron.platform.agent.base_historian.BaseQueryHistorianAgent.query>` to
+reduce a result to about a given number of points. The methods are
+
+``bucket_avg``
+    The time range of the query is split into ``points`` buckets of equal
+    length and each bucket with data is replaced by the average of its
+    values, timestamped with the start of the bucket.
+``min_max``
+    The time range is split into ``points // 2`` buckets and the points with
+    the smallest and largest value of each bucket are kept.
+``lttb``
+    Largest Triangle Three Buckets. Keeps ``points`` of the original points,
+    chosen to preserve the visual shape of the series.
+
+Only numeric values are downsampled, other values are dropped. The
+arithmetic is done with NumPy when it is installed.
+"""
+
+from datetime import datetime, timedelta
+
+import pytz
+
+from volttron.platform.agent.utils import (format_timestamp,
+                                           parse_timestamp_string)
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+__all__ = ['DOWNSAMPLE_METHODS', 'validate_downsample', 'bucket_width',
+           'downsample_values']
+
+DOWNSAMPLE_METHODS = ('bucket_avg', 'min_max', 'lttb')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def validate_downsample(downsample):
+    """Check the downsample argument of a query.
+
+    :param downsample: {'method': <one of DOWNSAMPLE_METHODS>,
+                        'points': <number of points>}
+    :return: tuple (method, points)
+    :raises ValueError: if the argument is not valid
+    """
+    if not isinstance(downsample, dict):
+        raise ValueError("downsample must be a dictionary with a method "
+                         "and a number of points, got {}".format(downsample))
+    method = downsample.get('method')
+    points = downsample.get('points')
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError("Invalid downsample method {}. Valid methods are "
+                         "{}".format(method, DOWNSAMPLE_METHODS))
+    if isinstance(points, bool) or not isinstance(points, int) or \
+            points < 1 or (method == 'min_max' and points < 2):
+        raise ValueError("Invalid number of downsample points {} for {}"
+                         "".format(points, method))
+    return method, points
+
+
+def bucket_width(start, end, buckets):
+    """Length in whole microseconds of each of the buckets splitting
+    [start, end)."""
+    return _width((end - start) // _MICROSECOND, buckets)
+
+
+def _width(span, buckets):
+    # rounded up so that the buckets cover the whole span
+    return max(1, -(-span // buckets))
+
+
+def _to_micros(ts):
+    try:
+        stamp = datetime.fromisoformat(ts)
+    except ValueError:
+        stamp = parse_timestamp_string(ts)
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=pytz.UTC)
+    return (stamp - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(micros):
+    return format_timestamp(_EPOCH + timedelta(microseconds=int(micros)))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def downsample_values(values, method, points, start=None, end=None,
+                      order="FIRST_TO_LAST"):
+    """Downsample the values of a query result.
+
+    :param values: list of (timestamp string, value) of a single topic query
+                   or dictionary of such lists by topic name
+    :param method: one of DOWNSAMPLE_METHODS
+    :param points: number of points to reduce the values to
+    :param start: start of the query, defaults to the first timestamp
+    :param end: end of the query, defaults to just after the last timestamp
+    :param order: order of the values, "FIRST_TO_LAST" or "LAST_TO_FIRST"
+    :return: the downsampled values in the form of values. Buckets are the
+             same for all the topics of a dictionary.
+    """
+    series = values if isinstance(values, dict) else {None: values}
+    parsed = {}
+    for name, rows in series.items():
+        rows = [row for row in rows if _is_number(row[1])]
+        if order == 'LAST_TO_FIRST':
+            rows.reverse()
+        parsed[name] = (rows, [_to_micros(ts) for ts, _ in rows])
+
+    first = min((times[0] for _, times in parsed.values() if times),
+                default=None)
+    last = max((times[-1] for _, times in parsed.values() if times),
+               default=None)
+    start = (start - _EPOCH) // _MICROSECOND if start is not None else first
+    end = (end - _EPOCH) // _MICROSECOND if end is not None else \
+        (last + 1 if last is not None else None)
+
+    results = {}
+    for name, (rows, times) in parsed.items():
+        if len(rows) > points:
+            rows = _METHODS[method](rows, times, points, start, end)
+        if order == 'LAST_TO_FIRST':
+            rows.reverse()
+        results[name] = rows
+    return results if isinstance(values, dict) else results[None]
+
+
+def _bucket_indexes(times, buckets, start, end):
+    width = _width(end - start, buckets)
+    return width, [min(buckets - 1, max(0, (t - start) // width))
+                   for t in times]
+
+
+def _bucket_avg(rows, times, points, start, end):
+    if HAS_NUMPY:
+        width = _width(end - start, points)
+        index = np.clip((np.asarray(times, dtype=np.int64) - start) // width,
+                        0, points - 1)
+        data = np.asarray([value for _, value in rows], dtype=np.float64)
+        counts = np.bincount(index, minlength=points)
+        sums = np.bincount(index, weights=data, minlength=points)
+        filled = np.nonzero(counts)[0]
+        return [(_from_micros(start + bucket * width), float(total / count))
+                for bucket, total, count in
+                zip(filled.tolist(), sums[filled], counts[filled])]
+
+    width, index = _bucket_indexes(times, points, start, end)
+    sums = {}
+    for bucket, (_, value) in zip(index, rows):
+        total, count = sums.get(bucket, (0.0, 0))
+        sums[bucket] = (total + value, count + 1)
+    return [(_from_micros(start + bucket * width), total / count)
+            for bucket, (total, count) in sorted(sums.items())]
+
+
+def _min_max(rows, times, points, start, end):
+    buckets = points // 2
+    if HAS_NUMPY:
+        width = _width(end - start, buckets)
+        index = np.clip((np.asarray(times, dtype=np.int64) - start) // width,
+                        0, buckets - 1)
+        data = np.asarray([value for _, value in rows], dtype=np.float64)
+        # sorted by bucket then value, the first and last of each bucket
+        # are its minimum and maximum
+        ordered = np.lexsort((data, index))
+        grouped = index[ordered]
+        firsts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+        lasts = np.r_[firsts[1:] - 1, len(ordered) - 1]
+        keep = np.union1d(ordered[firsts], ordered[lasts])
+        return [rows[i] for i in keep.tolist()]
+
+    _, index = _bucket_indexes(times, buckets, start, end)
+    extremes = {}
+    for i, (bucket, (_, value)) in enumerate(zip(index, rows)):
+        low, high = extremes.get(bucket, (i, i))
+        if value < rows[low][1]:
+            low = i
+        if value >= rows[high][1]:
+            high = i
+        extremes[bucket] = (low, high)
+    keep = sorted({i for pair in extremes.values() for i in pair})
+    return [rows[i] for i in keep]
+
+
+def _lttb(rows, times, points, start, end):
+    if points < 3:
+        return [rows[0], rows[-1]][:points]
+    count = len(rows)
+    every = (count - 2) / (points - 2)
+    keep = [0]
+    selected = 0
+    if HAS_NUMPY:
+        x = np.asarray(times, dtype=np.float64)
+        y = np.asarray([value for _, value in rows], dtype=np.float64)
+    else:
+        x = [float(t) for t in times]
+        y = [float(value) for _, value in rows]
+    for bucket in range(points - 2):
+        low = int(bucket * every) + 1
+        high = int((bucket + 1) * every) + 1
+        next_high = min(int((bucket + 2) * every) + 1, count)
+        if bucket == points - 3:
+            next_low, next_high = count - 1, count
+        else:
+            next_low = high
+        ax, ay = x[selected], y[selected]
+        if HAS_NUMPY:
+            cx = x[next_low:next_high].mean()
+            cy = y[next_low:next_high].mean()
+            area = np.abs((ax - cx) * (y[low:high] - ay) -
+                          (ax - x[low:high]) * (cy - ay))
+            selected = low + int(area.argmax())
+        else:
+            size = next_high - next_low
+            cx = sum(x[next_low:next_high]) / size
+            cy = sum(y[next_low:next_high]) / size
+            selected = max(range(low, high), key=lambda i: abs(
+                (ax - cx) * (y[i] - ay) - (ax - x[i]) * (cy - ay)))
+        keep.append(selected)
+    keep.append(count - 1)
+    return [rows[i] for i in keep]
+
+
+_METHODS = {
+    'bucket_avg': _bucket_avg,
+    'min_max': _min_max,
+    'lttb': _lttb,
+}
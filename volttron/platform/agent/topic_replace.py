@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""
+Topic string replacement shared by the historians and the VOLTTRON Central
+Platform agent.
+
+A :class:`TopicReplacer` is built from an ordered list of ``(from, to)``
+rules. Each rule whose ``from`` string appears in the lower cased topic is
+applied, in order, as a case insensitive replacement of every occurrence of
+``from`` by ``to`` on the topic produced by the previous rules.
+
+When the rules cannot interact with each other (no ``from`` string can
+overlap another one or the result of an earlier replacement) all of them are
+compiled into a single alternation regular expression and applied in one
+pass over the topic. Otherwise the precompiled rules are applied one after
+the other. Both give the same result.
+
+Results are kept in a bounded LRU cache keyed by the lower cased topic, the
+first casing of a topic seen decides the cached result.
+"""
+
+import re
+from collections import OrderedDict
+
+__all__ = ['TopicReplacer', 'DEFAULT_CACHE_SIZE']
+
+DEFAULT_CACHE_SIZE = 10000
+
+
+def _overlaps(a, b):
+    """Return True if a match of ``a`` and a match of ``b`` can share
+    characters in some string."""
+    if a in b or b in a:
+        return True
+    shortest = min(len(a), len(b))
+    for size in range(1, shortest):
+        if a.endswith(b[:size]) or b.endswith(a[:size]):
+            return True
+    return False
+
+
+class TopicReplacer(object):
+    """Apply an ordered list of topic replacement rules.
+
+    :param rules: Iterable of ``(from, to)`` string pairs.
+    :param cache_size: Maximum number of topics kept in the result cache.
+    """
+
+    def __init__(self, rules=(), cache_size=DEFAULT_CACHE_SIZE):
+        self._rules = [(str(frm), str(to)) for frm, to in rules]
+        self._cache_size = max(int(cache_size), 1)
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self._lowered = [frm.lower() for frm, _ in self._rules]
+        self._compiled = [re.compile(re.escape(frm), re.IGNORECASE)
+                          for frm, _ in self._rules]
+        self._pattern = None
+        if self._rules and self._independent():
+            self._pattern = re.compile(
+                "|".join("({})".format(re.escape(frm)) for frm, _ in self._rules),
+                re.IGNORECASE)
+
+    @classmethod
+    def from_replace_list(cls, replace_list, cache_size=DEFAULT_CACHE_SIZE):
+        """Build from a historian ``topic_replace_list``, a list of
+        ``{"from": ..., "to": ...}`` dictionaries."""
+        return cls(((x['from'], x['to']) for x in replace_list or []),
+                   cache_size=cache_size)
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def _independent(self):
+        """Return True if one pass of the alternation gives the same result
+        as applying the rules one after the other."""
+        for frm, to in self._rules:
+            # Replacement templates and empty strings are left to the
+            # sequential path.
+            if not frm or not to or '\\' in to:
+                return False
+            if not (frm.isascii() and to.isascii()):
+                return False
+        count = len(self._rules)
+        for i in range(count):
+            to_lower = self._rules[i][1].lower()
+            for j in range(i + 1, count):
+                if _overlaps(self._lowered[i], self._lowered[j]):
+                    return False
+                # A later rule must not match text written by an earlier one.
+                if _overlaps(to_lower, self._lowered[j]):
+                    return False
+        return True
+
+    def replace(self, topic):
+        """Return ``topic`` with the replacement rules applied."""
+        if not self._rules:
+            return topic
+        key = topic.lower()
+        try:
+            result = self._cache[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+
+        result = self._apply(topic, key)
+        self._cache[key] = result
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _apply(self, topic, topic_lower):
+        rules = self._rules
+        lowered = self._lowered
+        if self._pattern is not None:
+            def substitute(match):
+                index = match.lastindex - 1
+                # Rules only apply when they are found in the lower cased
+                # topic.
+                if lowered[index] in topic_lower:
+                    return rules[index][1]
+                return match.group(0)
+            return self._pattern.sub(substitute, topic)
+
+        result = topic
+        for index, regex in enumerate(self._compiled):
+            if lowered[index] in topic_lower:
+                result = regex.sub(rules[index][1], result)
+        return result
+
+    def cache_info(self):
+        """Return the cache hit and miss counters and its current size."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'maxsize': self._cache_size}
+
+    def clear_cache(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
@@ -112,12 +112,12 @@ class DbDriver(object):
         """
         yield self.insert_data
 
-    def cursor(self):
+    def cursor(self, **kwargs):
 
         self.stash.cursor = None
         if self.__connection is not None and not getattr(self.__connection, "closed", False):
             try:
-                self.stash.cursor = self.__connection.cursor()
+                self.stash.cursor = self.__connection.cursor(**kwargs)
                 return self.stash.cursor
             except Exception:
                 _log.warn("An exception occurred while creating "
@@ -133,10 +133,21 @@ class DbDriver(object):
                 "Unknown error. Could not connect to database")
 
         # if any exception happens here have it go to the caller.
-        self.stash.cursor = self.__connection.cursor()
+        self.stash.cursor = self.__connection.cursor(**kwargs)
 
         return self.stash.cursor
 
+    def streaming_cursor(self):
+        """
+        Create a cursor that reads the rows of a select from the database as
+        they are fetched instead of loading the whole result set at execute
+        time. Drivers whose default cursor buffers the result set override
+        this.
+
+        :return: cursor
+        """
+        return self.cursor()
+
     def read_tablenames_from_db(self, meta_table_name):
         """
         Reads names of the tables used by this historian to store data,
@@ -190,6 +201,15 @@ class DbDriver(object):
         """
         pass
 
+    def get_topic_count(self):
+        """
+        Returns the number of topics in database
+
+        :return: count of rows in the topics table
+        """
+        rows = self.select('SELECT count(*) FROM ' + self.topics_table)
+        return rows[0][0]
+
     @abstractmethod
     def get_agg_topics(self):
         """
@@ -453,6 +473,28 @@ class DbDriver(object):
                 return cursor.fetchall()
         return cursor
 
+    def stream_select(self, query, args=None, size=1000):
+        """
+        Execute a select statement on a streaming cursor and yield the
+        resultant rows, fetching at most size rows from the database at a
+        time. The cursor is closed once the generator is exhausted or closed.
+
+        :param query: select statement
+        :param args: arguments for the where clause
+        :param size: number of rows fetched at a time
+        """
+        if not args:
+            args = ()
+        cursor = self.streaming_cursor()
+        with closing(cursor):
+            cursor.execute(query, args)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
     def execute_stmt(self, stmt, args=None, commit=False):
         """
         Execute a sql statement
@@ -530,6 +572,69 @@ class DbDriver(object):
         """
         pass
 
+    def stream_query(self, topic_ids, id_name_map, start=None, end=None,
+                     agg_type=None, agg_period=None, order="FIRST_TO_LAST",
+                     size=1000):
+        """
+        Queries the raw historian data or aggregate data like
+        :py:meth:`query` but yields the rows one at a time instead of
+        returning them all at once. All the rows of a topic are yielded
+        before the rows of the next topic, in the order of topic_ids, and at
+        most size rows are read from the database at a time.
+
+        Drivers should override this to read from a server side cursor.
+        This default reads the rows of each topic a page at a time with the
+        skip and count of :py:meth:`query`.
+
+        :param topic_ids: list of topic ids to query for.
+        :param id_name_map: dictionary that maps topic id to topic name
+        :param start: Start of query timestamp as a datetime.
+        :param end: End of query timestamp as a datetime.
+        :param agg_type: If this is a query for aggregate data, the type of
+                         aggregation ( for example, sum, avg)
+        :param agg_period: If this is a query for aggregate data, the time
+                           period of aggregation
+        :param order: How to order the results, either "FIRST_TO_LAST" or
+                      "LAST_TO_FIRST"
+        :param size: Number of rows read from the database at a time.
+        :return: generator of (topic_name, timestamp string, value) tuples
+        """
+        for topic_id in topic_ids:
+            name = id_name_map[topic_id]
+            skip = 0
+            while True:
+                values = self.query([topic_id], id_name_map, start=start,
+                                    end=end, agg_type=agg_type,
+                                    agg_period=agg_period, skip=skip,
+                                    count=size, order=order).get(name, [])
+                for ts, value in values:
+                    yield name, ts, value
+                if len(values) < size:
+                    break
+                skip += size
+
+    def downsample_query(self, topic_ids, id_name_map, method, points,
+                         start=None, end=None, agg_type=None,
+                         agg_period=None, order="FIRST_TO_LAST"):
+        """
+        Queries the raw historian data or aggregate data like
+        :py:meth:`query` and downsamples it in the database. See
+        :py:mod:`volttron.platform.agent.downsample` for the methods and
+        their results.
+
+        :param topic_ids: list of topic ids to query for.
+        :param id_name_map: dictionary that maps topic id to topic name
+        :param method: Downsampling method
+        :param points: Number of points to reduce each topic to.
+        :return: result of the query in the format of :py:meth:`query`
+        :raises NotImplementedError: if the driver can not downsample the
+            given method in the database. The caller then downsamples the
+            results of :py:meth:`query`.
+        """
+        raise NotImplementedError(
+            "{} does not downsample in the database".format(
+                self.__class__.__name__))
+
     @abstractmethod
     def create_aggregate_store(self, agg_type, period):
         """
@@ -596,3 +701,20 @@ class DbDriver(object):
                  this aggregation was computed)
         """
         pass
+
+    def collect_aggregates(self, topic_ids_list, agg_type, start=None,
+                           end=None):
+        """
+        Collect the aggregates of several points for the same time period.
+        Drivers that can compute them in a single grouped query override
+        this method, by default collect_aggregate is called for each point.
+
+        :param topic_ids_list: list of the lists of topic ids of each point
+        :param agg_type: type of aggregation
+        :param start: start time for query (inclusive)
+        :param end:  end time for query (exclusive)
+        :return: list of (aggregated value, count of records) tuples in the
+                 order of topic_ids_list
+        """
+        return [self.collect_aggregate(topic_ids, agg_type, start, end)
+                for topic_ids in topic_ids_list]
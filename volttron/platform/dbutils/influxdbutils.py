@@ -45,9 +45,11 @@ used in:
 
 import logging
 import re
+from datetime import datetime
 from requests.exceptions import ConnectionError
 
 from dateutil import parser
+from dateutil.tz import tzutc
 from importlib import reload
 # reload to get the socket that is not patched by gevent.
 # volttron platform uses grequest, which patches ssl and socket.
@@ -71,6 +73,16 @@ SUPPORTED_AGG_TYPE = ["COUNT", "DISTINCT", "INTEGRAL", "MEAN", "MEDIAN", "MODE",
 TOPIC_REGEX = r"^[-\w\/]+$"  # Alphanumeric + '_' + '-' + '/'
 AGG_PERIOD_REGEX = r"^\d+[mhdw]$"   # Number + 'm'/'h'/'d'/'w'
 
+# Write precisions of the line protocol from the coarsest, with the number
+# of microseconds in one unit
+PRECISIONS = (('s', 1000000), ('ms', 1000), ('u', 1))
+
+# Default maximum size in bytes of the body of one write request. Larger
+# batches are written in several requests.
+MAX_WRITE_SIZE = 5000000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=tzutc())
+
 
 def value_type_matching(value_type, value):
     if value_type == 'integer':
@@ -96,8 +108,13 @@ def get_client(connection_params):
     user = connection_params.get('user', None)
     passwd = connection_params.get('passwd', None)
 
+    kwargs = {}
+    if connection_params.get('gzip', False):
+        # Compress the body of write requests and the query responses
+        kwargs['gzip'] = True
+
     try:
-        client = InfluxDBClient(host, port, user, passwd, db)
+        client = InfluxDBClient(host, port, user, passwd, db, **kwargs)
         dbs = client.get_list_database()
         if {"name": db} not in dbs:
             _log.error("Database {} does not exist.".format(db))
@@ -344,6 +361,132 @@ def insert_data_point(client, time, topic_id, source, value, value_string):
         client.write_points(json_body)
 
 
+def get_precision(timestamps):
+    """
+    Find the coarsest write precision that represents all the timestamps
+    exactly.
+
+    :param timestamps: aware datetime objects
+    :return: precision name and the number of microseconds in one unit
+    """
+    for precision, unit in PRECISIONS[:-1]:
+        if all(ts.microsecond % unit == 0 for ts in timestamps):
+            return precision, unit
+    return PRECISIONS[-1]
+
+
+def _escape_key(value):
+    return value.replace(',', '\\,').replace(' ', '\\ ').replace(
+        '=', '\\=').replace('\n', '\\n')
+
+
+def _format_field(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n'))
+
+
+def make_line(measurement, tags, fields, timestamp=None):
+    """
+    Build one point in InfluxDB line protocol. Tags with an empty value and
+    fields that are None are left out, like the client does for json points.
+
+    :param measurement: measurement name
+    :param tags: dictionary of tag names and values
+    :param fields: dictionary of field names and values
+    :param timestamp: integer timestamp in the unit of the write precision
+    :return: line protocol string
+    """
+    line = [measurement.replace(',', '\\,').replace(' ', '\\ ')]
+    for key in sorted(tags):
+        if tags[key]:
+            line.append(',{}={}'.format(_escape_key(key),
+                                        _escape_key(str(tags[key]))))
+    line.append(' ')
+    line.append(','.join('{}={}'.format(_escape_key(key),
+                                        _format_field(value))
+                         for key, value in sorted(fields.items())
+                         if value is not None))
+    if timestamp is not None:
+        line.append(' {}'.format(timestamp))
+    return ''.join(line)
+
+
+def data_point_line(time, topic_id, source, value, value_string, unit=1):
+    """
+    Build the line protocol of one data point of a specific topic. Same
+    schema as :py:func:`insert_data_point`.
+
+    :param time: aware datetime of the data point
+    :param unit: number of microseconds in one unit of the write precision
+    """
+    tags_values = topic_id.rsplit('/', 3)
+    measurement = tags_values.pop()
+    tags_title = ["device", "building", "campus"]
+    tags_dict = {}
+
+    for i, tag in enumerate(tags_values[::-1]):
+        tags_dict[tags_title[i]] = tag
+
+    tags_dict["source"] = source
+
+    delta = time - EPOCH
+    timestamp = ((delta.days * 86400 + delta.seconds) * 1000000 +
+                 delta.microseconds) // unit
+    return make_line(measurement, tags_dict,
+                     {"value": value, "value_string": value_string},
+                     timestamp)
+
+
+def meta_line(topic_id, topic, meta, updated_time):
+    """
+    Build the line protocol of the metadata of a specific topic. Same schema
+    as :py:func:`insert_meta`.
+    """
+    return make_line("meta", {"topic_id": topic_id},
+                     {"topic": topic, "meta_dict": str(meta),
+                      "last_updated": updated_time}, 0)
+
+
+def chunk_lines(lines, max_write_size=MAX_WRITE_SIZE):
+    """
+    Split lines into chunks whose write request body stays under
+    max_write_size bytes.
+
+    :return: generator of (start, end) indexes of the lines of each chunk
+    """
+    start = 0
+    size = 0
+    for index, line in enumerate(lines):
+        line_size = len(line.encode('utf-8')) + 1
+        if index > start and size + line_size > max_write_size:
+            yield start, index
+            start = index
+            size = 0
+        size += line_size
+    if start < len(lines):
+        yield start, len(lines)
+
+
+def write_lines(client, database, lines, precision):
+    """
+    Write points in line protocol with one request, over the client's
+    keep-alive session.
+
+    :param client: InfluxDB client connected in historian_setup method.
+    :param database: database to write to
+    :param lines: list of line protocol strings
+    :param precision: precision of the timestamps of the lines
+    """
+    client.write(lines, params={'db': database, 'precision': precision},
+                 expected_response_code=204, protocol='line')
+
+
 def get_topics_by_pattern(client, pattern):
     """
 
@@ -105,6 +105,11 @@ def get_topic_map(client, topics_collection):
     return topic_id_map, topic_name_map
 
 
+def get_topic_count(client, topics_collection):
+    db = client.get_default_database()
+    return db[topics_collection].estimated_document_count()
+
+
 def get_agg_topic_map(client, agg_topics_collection):
     _log.debug('loading agg topic map')
     topic_id_map = dict()
@@ -36,6 +36,7 @@
 # under Contract DE-AC05-76RL01830
 # }}}
 import ast
+import contextlib
 import logging
 from collections import defaultdict
 
@@ -44,12 +45,21 @@ import re
 from .basedb import DbDriver
 from mysql.connector import Error as MysqlError
 from mysql.connector import errorcode as mysql_errorcodes
+from mysql.connector.errors import DataError as MysqlDataError, \
+    IntegrityError as MysqlIntegrityError
 from volttron.platform.agent import utils
 from volttron.platform import jsonapi
 
 utils.setup_logging()
 _log = logging.getLogger(__name__)
 
+# Rows written by one multi-row insert, full chunks reuse the same prepared
+# statement.
+INSERT_CHUNK_ROWS = 1000
+# Estimate of the bytes a row takes in a statement execute packet besides
+# its value string.
+INSERT_ROW_OVERHEAD = 32
+
 """
 Implementation of Mysql database operation for
 :py:class:`sqlhistorian.historian.SQLHistorian` and
@@ -67,6 +77,7 @@ class MySqlFuncts(DbDriver):
         self.meta_table = None
         self.agg_topics_table = None
         self.agg_meta_table = None
+        self._max_allowed_packet = None
 
         if table_names:
             self.data_table = table_names['data_table']
@@ -81,6 +92,93 @@ class MySqlFuncts(DbDriver):
         super(MySqlFuncts, self).__init__('mysql.connector', auth_plugin='mysql_native_password',
                                           **connect_params)
 
+    @contextlib.contextmanager
+    def bulk_insert(self):
+        """
+        This function implements the bulk insert requirements for the MySQL historian by overriding the
+        DbDriver::bulk_insert() in basedb.py and yields nescessary data insertion method needed for bulk inserts
+
+        The records are written with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements run as server side
+        prepared statements, in chunks small enough for the server's max_allowed_packet. The rows of a chunk that
+        fails are inserted one at a time so that a bad row does not keep the others from being written.
+
+        :yields: insert method
+        """
+        records = []
+
+        def insert_data(ts, topic_id, data):
+            """
+            Inserts data records to the list
+
+            :param ts: time stamp
+            :type string
+            :param topic_id: topic ID
+            :type string
+            :param data: data value
+            :type any valid JSON serializable value
+            :return: Returns True after insert
+            :rtype: bool
+            """
+            records.append((ts, topic_id, jsonapi.dumps(data)))
+            return True
+
+        yield insert_data
+
+        if records:
+            self._insert_records(records)
+
+    def _insert_records(self, records):
+        if self._max_allowed_packet is None:
+            self._max_allowed_packet = self.select(
+                "SELECT @@max_allowed_packet")[0][0]
+        # leave room for the statement and the protocol
+        max_bytes = self._max_allowed_packet // 2
+        chunk = []
+        size = 0
+        cursor = self.cursor(prepared=True)
+        try:
+            for record in records:
+                row_size = len(record[2].encode('utf-8')) + INSERT_ROW_OVERHEAD
+                if chunk and (len(chunk) >= INSERT_CHUNK_ROWS or
+                              size + row_size > max_bytes):
+                    self._insert_chunk(cursor, chunk)
+                    chunk = []
+                    size = 0
+                chunk.append(record)
+                size += row_size
+            if chunk:
+                self._insert_chunk(cursor, chunk)
+        finally:
+            cursor.close()
+
+    def _insert_chunk(self, cursor, chunk):
+        stmt = 'INSERT INTO ' + self.data_table + ' VALUES ' + \
+            ', '.join(['(%s, %s, %s)'] * len(chunk)) + \
+            ' ON DUPLICATE KEY UPDATE value_string = VALUES(value_string)'
+        # Only errors caused by the values of a row fall back to inserting
+        # the rows one at a time. Anything else, such as a lost connection,
+        # a missing table or privilege, is left to the caller so the batch
+        # stays in the backup cache.
+        try:
+            cursor.execute(stmt, [value for record in chunk
+                                  for value in record])
+            return
+        except (MysqlDataError, MysqlIntegrityError) as err:
+            _log.warning("Inserting {} rows failed, inserting them one at "
+                         "a time. Error: {}".format(len(chunk), err))
+        error = None
+        inserted = 0
+        for record in chunk:
+            try:
+                cursor.execute(self.insert_data_query(), record)
+                inserted += 1
+            except (MysqlDataError, MysqlIntegrityError) as err:
+                _log.error("Dropping row {} that can not be inserted. "
+                           "Error: {}".format(record, err))
+                error = err
+        if not inserted:
+            raise error
+
     def init_microsecond_support(self):
         rows = self.select("SELECT version()", None)
         p = re.compile('(\d+)\D+(\d+)\D+(\d+)\D*')
@@ -205,6 +303,58 @@ class MySqlFuncts(DbDriver):
               agg_type=None, agg_period=None, count=None,
               order="FIRST_TO_LAST"):
 
+        # can't have an offset without a limit
+        # -1 = no limit and allows the user to
+        # provide just an offset
+        if count is None:
+            count = 100
+
+        real_query, args = self._query_statement(
+            topic_ids[0], agg_type, agg_period, start, end, skip, count, order)
+
+        _log.debug("About to do real_query")
+        values = defaultdict(list)
+        for topic_id in topic_ids:
+            args[0] = topic_id
+            values[id_name_map[topic_id]] = []
+            _log.debug("Real Query: " + real_query)
+            _log.debug("args: " + str(args))
+
+            cursor = self.select(real_query, args, fetch_all=False)
+            if cursor:
+                for _id, ts, value in cursor:
+                    values[id_name_map[topic_id]].append(
+                        (utils.format_timestamp(ts.replace(tzinfo=pytz.UTC)),
+                         jsonapi.loads(value)))
+
+            if cursor is not None:
+                cursor.close()
+        return values
+
+    def stream_query(self, topic_ids, id_name_map, start=None, end=None,
+                     agg_type=None, agg_period=None, order="FIRST_TO_LAST",
+                     size=1000):
+        real_query, args = self._query_statement(
+            topic_ids[0], agg_type, agg_period, start, end, order=order)
+        for topic_id in topic_ids:
+            args[0] = topic_id
+            name = id_name_map[topic_id]
+            for _id, ts, value in self.stream_select(real_query, args, size):
+                yield (name, utils.format_timestamp(ts.replace(tzinfo=pytz.UTC)),
+                       jsonapi.loads(value))
+
+    def streaming_cursor(self):
+        # An unbuffered cursor reads the rows from the server as they are
+        # fetched. The connection can not run another statement until all
+        # of them are read.
+        return self.cursor(buffered=False)
+
+    def _query_statement(self, topic_id, agg_type, agg_period, start, end,
+                         skip=0, count=None, order="FIRST_TO_LAST"):
+        """
+        Build the select statement of :py:meth:`query` and its arguments.
+        The first argument is the topic id.
+        """
         table_name = self.data_table
         if agg_type and agg_period:
             table_name = agg_type + "_" + agg_period
@@ -220,7 +370,7 @@ class MySqlFuncts(DbDriver):
             self.init_microsecond_support()
 
         where_clauses = ["WHERE topic_id = %s"]
-        args = [topic_ids[0]]
+        args = [topic_id]
 
         if start is not None:
             if start.tzinfo != pytz.UTC:
@@ -253,42 +403,21 @@ class MySqlFuncts(DbDriver):
         if order == 'LAST_TO_FIRST':
             order_by = ' ORDER BY topic_id DESC, ts DESC'
 
-        # can't have an offset without a limit
-        # -1 = no limit and allows the user to
-        # provide just an offset
-        if count is None:
-            count = 100
-
-        limit_statement = 'LIMIT %s'
-        args.append(int(count))
+        limit_statement = ''
+        if count is not None:
+            limit_statement = 'LIMIT %s'
+            args.append(int(count))
 
         offset_statement = ''
         if skip > 0:
             offset_statement = 'OFFSET %s'
             args.append(skip)
 
-        _log.debug("About to do real_query")
-        values = defaultdict(list)
-        for topic_id in topic_ids:
-            args[0] = topic_id
-            values[id_name_map[topic_id]] = []
-            real_query = query.format(where=where_statement,
-                                      limit=limit_statement,
-                                      offset=offset_statement,
-                                      order_by=order_by)
-            _log.debug("Real Query: " + real_query)
-            _log.debug("args: " + str(args))
-
-            cursor = self.select(real_query, args, fetch_all=False)
-            if cursor:
-                for _id, ts, value in cursor:
-                    values[id_name_map[topic_id]].append(
-                        (utils.format_timestamp(ts.replace(tzinfo=pytz.UTC)),
-                         jsonapi.loads(value)))
-
-            if cursor is not None:
-                cursor.close()
-        return values
+        real_query = query.format(where=where_statement,
+                                  limit=limit_statement,
+                                  offset=offset_statement,
+                                  order_by=order_by)
+        return real_query, args
 
     def insert_meta_query(self):
         return '''REPLACE INTO ''' + self.meta_table + ''' values(%s, %s)'''
@@ -459,3 +588,48 @@ class MySqlFuncts(DbDriver):
             return rows[0][0], rows[0][1]
         else:
             return 0, 0
+
+    def collect_aggregates(self, topic_ids_list, agg_type, start=None,
+                           end=None):
+        """
+        Computes the aggregates of all the points in one query, joining the
+        data table to a derived table of (point, topic_id) pairs and
+        grouping by point.
+        """
+        if len(topic_ids_list) < 2:
+            return super(MySqlFuncts, self).collect_aggregates(
+                topic_ids_list, agg_type, start, end)
+        if agg_type.upper() not in ['AVG', 'MIN', 'MAX', 'COUNT', 'SUM']:
+            raise ValueError("Invalid aggregation type {}".format(agg_type))
+
+        points = []
+        args = []
+        for point, topic_ids in enumerate(topic_ids_list):
+            for topic_id in topic_ids:
+                points.append("SELECT %s AS point, %s AS topic_id")
+                args.extend((point, topic_id))
+
+        where_clauses = []
+        for clause, ts in (("ts >= %s", start), ("ts < %s", end)):
+            if ts is None:
+                continue
+            where_clauses.append(clause)
+            if self.MICROSECOND_SUPPORT:
+                args.append(ts)
+            else:
+                ts_str = ts.isoformat()
+                args.append(ts_str[:ts_str.rfind('.')])
+        where_statement = ''
+        if where_clauses:
+            where_statement = 'WHERE ' + ' AND '.join(where_clauses)
+
+        query = '''SELECT points.point, ''' + agg_type + '''(value_string),
+            count(value_string) FROM ''' + self.data_table + ''' AS data
+            JOIN (''' + ' UNION ALL '.join(points) + ''') AS points
+            ON data.topic_id = points.topic_id ''' + where_statement + '''
+            GROUP BY points.point'''
+        _log.debug("Real Query: " + query)
+        results = {point: (value, count)
+                   for point, value, count in self.select(query, args)}
+        return [results.get(point, (None, 0))
+                for point in range(len(topic_ids_list))]
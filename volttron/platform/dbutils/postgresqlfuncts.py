@@ -18,8 +18,12 @@
 
 import ast
 import contextlib
+import csv
+import io
 import logging
 import copy
+import uuid
+from datetime import datetime, timedelta
 
 import pytz
 import psycopg2
@@ -27,6 +31,7 @@ from psycopg2 import InterfaceError, ProgrammingError, errorcodes
 from psycopg2.sql import Identifier, Literal, SQL
 
 from volttron.platform.agent import utils
+from volttron.platform.agent.downsample import bucket_width
 from volttron.platform import jsonapi
 
 from .basedb import DbDriver
@@ -68,12 +73,18 @@ class PostgreSqlFuncts(DbDriver):
     @contextlib.contextmanager
     def bulk_insert(self):
         """
-        This function implements the bulk insert requirements for Redshift historian by overriding the
+        This function implements the bulk insert requirements for the PostgreSQL historian by overriding the
         DbDriver::bulk_insert() in basedb.py and yields nescessary data insertion method needed for bulk inserts
 
+        The records are written as CSV and streamed with COPY into a temporary staging table, which is then
+        merged into the data table with a single INSERT ... ON CONFLICT statement. This also works for TimescaleDB
+        hypertables. When a batch holds more than one value for a topic and timestamp the last one is kept.
+
         :yields: insert method
         """
-        records = []
+        records = io.StringIO()
+        writer = csv.writer(records)
+        count = 0
 
         def insert_data(ts, topic_id, data):
             """
@@ -88,18 +99,44 @@ class PostgreSqlFuncts(DbDriver):
             :return: Returns True after insert
             :rtype: bool
             """
-            value = jsonapi.dumps(data)
-            records.append(SQL('({}, {}, {})').format(Literal(ts), Literal(topic_id), Literal(value)))
+            nonlocal count
+            if isinstance(ts, datetime):
+                # the session time zone is UTC
+                if ts.tzinfo is not None:
+                    ts = ts.astimezone(pytz.UTC).replace(tzinfo=None)
+                ts = ts.isoformat()
+            writer.writerow((ts, topic_id, jsonapi.dumps(data)))
+            count += 1
             return True
 
         yield insert_data
 
-        if records:
-            query = SQL('INSERT INTO {} VALUES {} '
-                        'ON CONFLICT (ts, topic_id) DO UPDATE '
-                        'SET value_string = EXCLUDED.value_string').format(
-                            Identifier(self.data_table), SQL(', ').join(records))
-            self.execute_stmt(query)
+        if count:
+            records.seek(0)
+            staging = Identifier(self.data_table + '_staging')
+            with self.cursor() as cursor:
+                # seq keeps the order of the records for the merge
+                cursor.execute(SQL(
+                    'CREATE TEMPORARY TABLE IF NOT EXISTS {} ('
+                        'ts TIMESTAMP NOT NULL, '
+                        'topic_id INTEGER NOT NULL, '
+                        'value_string TEXT NOT NULL, '
+                        'seq BIGSERIAL'
+                    ')').format(staging))
+                cursor.execute(SQL('TRUNCATE {}').format(staging))
+                cursor.copy_expert(SQL(
+                    'COPY {} (ts, topic_id, value_string) '
+                    'FROM STDIN WITH (FORMAT csv)').format(
+                        staging).as_string(cursor), records)
+                cursor.execute(SQL(
+                    'INSERT INTO {} (ts, topic_id, value_string) '
+                    'SELECT DISTINCT ON (topic_id, ts) '
+                    'ts, topic_id, value_string FROM {} '
+                    'ORDER BY topic_id, ts, seq DESC '
+                    'ON CONFLICT (ts, topic_id) DO UPDATE '
+                    'SET value_string = EXCLUDED.value_string').format(
+                        Identifier(self.data_table), staging))
+                cursor.execute(SQL('TRUNCATE {}').format(staging))
 
     def rollback(self):
         try:
@@ -195,6 +232,91 @@ class PostgreSqlFuncts(DbDriver):
     def query(self, topic_ids, id_name_map, start=None, end=None, skip=0,
               agg_type=None, agg_period=None, count=None,
               order='FIRST_TO_LAST'):
+        if len(topic_ids) > 1:
+            return self._query_topics(topic_ids, id_name_map, start, end,
+                                      skip, agg_type, agg_period, count,
+                                      order)
+        query, topic_id = self._query_statement(
+            agg_type, agg_period, start, end, skip, count, order)
+        values = {}
+        for topic_id._wrapped in topic_ids:
+            name = id_name_map[topic_id.wrapped]
+            with self.select(query, fetch_all=False) as cursor:
+                values[name] = [(ts, jsonapi.loads(value))
+                                for ts, value in cursor]
+        return values
+
+    def _query_topics(self, topic_ids, id_name_map, start, end, skip,
+                      agg_type, agg_period, count, order):
+        """
+        Query multiple topics with a single statement. When skip or count
+        apply the rows of each topic are numbered with row_number() so that
+        they apply to each topic as they do when querying one topic.
+        """
+        if agg_type and agg_period:
+            table_name = agg_type + '_' + agg_period
+        else:
+            table_name = self.data_table
+        direction = 'DESC' if order == 'LAST_TO_FIRST' else 'ASC'
+        limit = count if count and count > 0 else None
+        offset = skip if skip and skip > 0 else 0
+        where = [SQL('topic_id IN ({})').format(
+            SQL(', ').join(Literal(topic_id) for topic_id in topic_ids))]
+        where.extend(self._ts_conditions(start, end))
+        where = SQL(' AND ').join(where)
+        if limit is None and not offset:
+            query = SQL(
+                '''SELECT topic_id, to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS.USOF:00'), '''
+                    'value_string\n'
+                'FROM {}\n'
+                'WHERE {}\n'
+                'ORDER BY topic_id, ts ' + direction
+            ).format(Identifier(table_name), where)
+        else:
+            query = [SQL(
+                '''SELECT topic_id, to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS.USOF:00'), '''
+                    'value_string\n'
+                'FROM (SELECT topic_id, ts, value_string, row_number() OVER '
+                    '(PARTITION BY topic_id ORDER BY ts ' + direction + ') AS rn\n'
+                    'FROM {}\n'
+                    'WHERE {}) AS numbered\n'
+                'WHERE rn > {}'
+            ).format(Identifier(table_name), where, Literal(offset))]
+            if limit is not None:
+                query.append(SQL(' AND rn <= {}').format(
+                    Literal(offset + limit)))
+            query.append(SQL('\nORDER BY topic_id, ts ' + direction))
+            query = SQL('').join(query)
+        values = {id_name_map[topic_id]: [] for topic_id in topic_ids}
+        with self.select(query, fetch_all=False) as cursor:
+            for topic_id, ts, value in cursor:
+                values[id_name_map[topic_id]].append(
+                    (ts, jsonapi.loads(value)))
+        return values
+
+    def stream_query(self, topic_ids, id_name_map, start=None, end=None,
+                     agg_type=None, agg_period=None, order='FIRST_TO_LAST',
+                     size=1000):
+        query, topic_id = self._query_statement(
+            agg_type, agg_period, start, end, order=order)
+        for topic_id._wrapped in topic_ids:
+            name = id_name_map[topic_id.wrapped]
+            for ts, value in self.stream_select(query, size=size):
+                yield name, ts, jsonapi.loads(value)
+
+    def streaming_cursor(self):
+        # A named cursor keeps the result set on the server and fetchmany
+        # reads it from there. WITH HOLD lets it live outside of a
+        # transaction as the connection is in autocommit mode.
+        return self.cursor(name='stream_' + uuid.uuid4().hex, withhold=True)
+
+    def _query_statement(self, agg_type, agg_period, start, end, skip=0,
+                         count=None, order='FIRST_TO_LAST'):
+        """
+        Build the select statement of :py:meth:`query`. The topic id is a
+        placeholder literal returned along with the statement, to be set to
+        each topic id in turn.
+        """
         if agg_type and agg_period:
             table_name = agg_type + '_' + agg_period
         else:
@@ -206,32 +328,141 @@ class PostgreSqlFuncts(DbDriver):
             'FROM {}\n'
             'WHERE topic_id = {}'
         ).format(Identifier(table_name), topic_id)]
-        if start and start.tzinfo != pytz.UTC:
-            start = start.astimezone(pytz.UTC)
-        if end and end.tzinfo != pytz.UTC:
-            end = end.astimezone(pytz.UTC)
-        if start and start == end:
-            query.append(SQL(' AND ts = {}').format(Literal(start)))
-        else:
-            if start:
-                query.append(SQL(' AND ts >= {}').format(Literal(start)))
-            if end:
-                query.append(SQL(' AND ts < {}').format(Literal(end)))
+        query.extend(SQL(' AND {}').format(condition)
+                     for condition in self._ts_conditions(start, end))
         query.append(SQL('ORDER BY ts {}'.format(
             'DESC' if order == 'LAST_TO_FIRST' else 'ASC')))
         if skip or count:
             query.append(SQL('LIMIT {} OFFSET {}').format(
                 Literal(None if not count or count < 0 else count),
                 Literal(None if not skip or skip < 0 else skip)))
-        query = SQL('\n').join(query)
-        values = {}
-        for topic_id._wrapped in topic_ids:
-            name = id_name_map[topic_id.wrapped]
+        return SQL('\n').join(query), topic_id
+
+    def downsample_query(self, topic_ids, id_name_map, method, points,
+                         start=None, end=None, agg_type=None,
+                         agg_period=None, order='FIRST_TO_LAST'):
+        if method not in ('bucket_avg', 'min_max'):
+            raise NotImplementedError(
+                '{} is not downsampled in the database'.format(method))
+        if agg_type and agg_period:
+            table_name = agg_type + '_' + agg_period
+        else:
+            table_name = self.data_table
+        buckets = points if method == 'bucket_avg' else points // 2
+        values = {id_name_map[topic_id]: [] for topic_id in topic_ids}
+
+        # JSON numbers are the only values starting with a digit or a minus
+        conditions = [SQL("value_string ~ '^-?[0-9]'")]
+        conditions.extend(self._ts_conditions(start, end))
+
+        def where_topics(ids):
+            return SQL(' AND ').join(
+                [SQL('topic_id IN ({})').format(
+                    SQL(', ').join(Literal(topic_id) for topic_id in ids))] +
+                conditions)
+
+        where = where_topics(topic_ids)
+        timestamp = SQL('''to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS.USOF:00')''')
+
+        # topics with no more values than points are returned as they are,
+        # as downsample_values does
+        counts = dict(self.select(SQL(
+            'SELECT topic_id, count(*) FROM {} WHERE {} '
+            'GROUP BY topic_id').format(Identifier(table_name), where)))
+        kept = [topic_id for topic_id in topic_ids
+                if counts.get(topic_id, 0) <= points]
+        downsampled = [topic_id for topic_id in topic_ids
+                       if counts.get(topic_id, 0) > points]
+        if kept:
+            query = SQL(
+                'SELECT topic_id, {}, value_string FROM {} WHERE {} '
+                'ORDER BY topic_id, ts').format(
+                timestamp, Identifier(table_name), where_topics(kept))
             with self.select(query, fetch_all=False) as cursor:
-                values[name] = [(ts, jsonapi.loads(value))
-                                for ts, value in cursor]
+                for topic_id, ts, value in cursor:
+                    values[id_name_map[topic_id]].append(
+                        (ts, jsonapi.loads(value)))
+
+        if downsampled:
+            # the buckets split the query range, or the range of the data
+            # found when the query is open ended, and are the same for all
+            # the topics
+            if start is None or end is None:
+                first, last = self.select(SQL(
+                    'SELECT min(ts), max(ts) FROM {} WHERE {}').format(
+                    Identifier(table_name), where))[0]
+                # ts is stored without a time zone, in UTC
+                if start is None:
+                    start = first.replace(tzinfo=pytz.UTC)
+                if end is None:
+                    end = last.replace(tzinfo=pytz.UTC) + \
+                        timedelta(microseconds=1)
+            start = start.astimezone(pytz.UTC)
+            width = bucket_width(start, end, buckets)
+            where = where_topics(downsampled)
+            bucket = SQL(
+                'least(floor(extract(epoch FROM ts - {}) * 1000000 / {})'
+                '::bigint, {})').format(Literal(start), Literal(width),
+                               Literal(buckets - 1))
+
+            if method == 'bucket_avg':
+                query = SQL(
+                    'SELECT topic_id, {} AS bucket, '
+                        'avg(value_string::double precision)\n'
+                    'FROM {}\n'
+                    'WHERE {}\n'
+                    'GROUP BY topic_id, bucket\n'
+                    'ORDER BY topic_id, bucket'
+                ).format(bucket, Identifier(table_name), where)
+                with self.select(query, fetch_all=False) as cursor:
+                    for topic_id, number, average in cursor:
+                        values[id_name_map[topic_id]].append(
+                            (utils.format_timestamp(start + timedelta(
+                                microseconds=number * width)), average))
+            else:
+                query = SQL(
+                    'WITH numbered AS (\n'
+                        'SELECT topic_id, ts, value_string, '
+                        'value_string::double precision AS number, {} AS bucket\n'
+                        'FROM {}\n'
+                        'WHERE {})\n'
+                    'SELECT topic_id, {}, value_string\n'
+                    'FROM ((SELECT DISTINCT ON (topic_id, bucket) '
+                            'topic_id, ts, value_string FROM numbered '
+                            'ORDER BY topic_id, bucket, number ASC, ts)\n'
+                        'UNION\n'
+                        '(SELECT DISTINCT ON (topic_id, bucket) '
+                            'topic_id, ts, value_string FROM numbered '
+                            'ORDER BY topic_id, bucket, number DESC, ts DESC)'
+                    ') AS extremes\n'
+                    'ORDER BY topic_id, ts'
+                ).format(bucket, Identifier(table_name), where, timestamp)
+                with self.select(query, fetch_all=False) as cursor:
+                    for topic_id, ts, value in cursor:
+                        values[id_name_map[topic_id]].append(
+                            (ts, jsonapi.loads(value)))
+
+        if order == 'LAST_TO_FIRST':
+            for rows in values.values():
+                rows.reverse()
         return values
 
+    @staticmethod
+    def _ts_conditions(start, end):
+        conditions = []
+        if start and start.tzinfo != pytz.UTC:
+            start = start.astimezone(pytz.UTC)
+        if end and end.tzinfo != pytz.UTC:
+            end = end.astimezone(pytz.UTC)
+        if start and start == end:
+            conditions.append(SQL('ts = {}').format(Literal(start)))
+        else:
+            if start:
+                conditions.append(SQL('ts >= {}').format(Literal(start)))
+            if end:
+                conditions.append(SQL('ts < {}').format(Literal(end)))
+        return conditions
+
     def insert_topic(self, topic):
         with self.cursor() as cursor:
             cursor.execute(self.insert_topic_query(), {'topic': topic})
@@ -300,6 +531,11 @@ class PostgreSqlFuncts(DbDriver):
         name_map = {key: name for _, name, key in rows}
         return id_map, name_map
 
+    def get_topic_count(self):
+        query = SQL('SELECT count(*) FROM {}').format(
+            Identifier(self.topics_table))
+        return self.select(query)[0][0]
+
     def get_agg_topics(self):
         query = SQL(
             'SELECT agg_topic_name, agg_type, agg_time_period, metadata '
@@ -376,3 +612,34 @@ class PostgreSqlFuncts(DbDriver):
             query.append(SQL(' AND ts < {}').format(Literal(end)))
         rows = self.select(SQL('\n').join(query))
         return rows[0] if rows else (0, 0)
+
+    def collect_aggregates(self, topic_ids_list, agg_type, start=None,
+                           end=None):
+        if len(topic_ids_list) < 2:
+            return super(PostgreSqlFuncts, self).collect_aggregates(
+                topic_ids_list, agg_type, start, end)
+        if (isinstance(agg_type, str) and
+                agg_type.upper() not in self.get_aggregation_list()):
+            raise ValueError('Invalid aggregation type {}'.format(agg_type))
+        points = SQL(', ').join(
+            SQL('({}, {})').format(Literal(point), Literal(topic_id))
+            for point, topic_ids in enumerate(topic_ids_list)
+            for topic_id in topic_ids)
+        query = [
+            SQL('WITH points (point, topic_id) AS (VALUES {})').format(points),
+            SQL('SELECT points.point, {}(CAST(value_string as float)), '
+                'COUNT(value_string)'.format(agg_type.upper())),
+            SQL('FROM {} AS data JOIN points '
+                'ON data.topic_id = points.topic_id').format(
+                Identifier(self.data_table)),
+            SQL('WHERE TRUE'),
+        ]
+        if start is not None:
+            query.append(SQL(' AND ts >= {}').format(Literal(start)))
+        if end is not None:
+            query.append(SQL(' AND ts < {}').format(Literal(end)))
+        query.append(SQL('GROUP BY points.point'))
+        results = {point: (value, count) for point, value, count
+                   in self.select(SQL('\n').join(query))}
+        return [results.get(point, (None, 0))
+                for point in range(len(topic_ids_list))]
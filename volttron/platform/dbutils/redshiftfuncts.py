@@ -287,6 +287,11 @@ class RedshiftFuncts(DbDriver):
         name_map = {key: name for _, name, key in rows}
         return id_map, name_map
 
+    def get_topic_count(self):
+        query = SQL('SELECT count(*) FROM {}').format(
+            Identifier(self.topics_table))
+        return self.select(query)[0][0]
+
     def get_agg_topics(self):
         query = SQL(
             'SELECT agg_topic_name, agg_type, agg_time_period, metadata '
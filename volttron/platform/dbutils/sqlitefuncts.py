@@ -36,19 +36,22 @@
 # under Contract DE-AC05-76RL01830
 # }}}
 import ast
+import contextlib
 import errno
 import logging
 import sqlite3
 import pytz
 import threading
-from collections import defaultdict
-from datetime import datetime
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
 from math import ceil
 
 import os
 import re
-from .basedb import DbDriver
+from urllib.request import pathname2url
+from .basedb import DbDriver, closing
 from volttron.platform.agent import utils
+from volttron.platform.agent.downsample import bucket_width
 from volttron.platform import jsonapi
 
 utils.setup_logging()
@@ -58,6 +61,61 @@ from volttron.platform.agent.utils import fix_sqlite3_datetime
 #Make sure sqlite3 datetime adapters are updated.
 fix_sqlite3_datetime()
 
+# Number of topics read by one query statement, well under the 999 host
+# parameters older SQLite versions allow per statement.
+MAX_QUERY_TOPICS = 500
+# Window functions are available from SQLite 3.25
+WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+
+PARTITION_PERIODS = ('day', 'week', 'month')
+_PARTITION_KEYS = {'day': re.compile(r'\d{4}-\d{2}-\d{2}$'),
+                   'week': re.compile(r'\d{4}-W\d{2}$'),
+                   'month': re.compile(r'\d{4}-\d{2}$')}
+# SQLite allows 10 attached databases by default
+MAX_ATTACHED_PARTITIONS = 8
+
+
+def partition_key(ts, period):
+    """
+    Name of the partition holding the data of a timestamp, for example
+    2020-01-31 for a day, 2020-W05 for a week (ISO week) or 2020-01 for a
+    month. Naive timestamps are taken as UTC.
+    """
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(pytz.UTC)
+    if period == 'day':
+        return ts.strftime('%Y-%m-%d')
+    if period == 'week':
+        year, week, _ = ts.isocalendar()
+        return '{:04d}-W{:02d}'.format(year, week)
+    return ts.strftime('%Y-%m')
+
+
+def partition_bounds(key, period):
+    """
+    Time range of a partition as (start, end), end excluded.
+
+    :raises ValueError: if key is not a partition name of the period
+    """
+    if not _PARTITION_KEYS[period].match(key):
+        raise ValueError("Invalid {} partition {}".format(period, key))
+    if period == 'day':
+        start = datetime.strptime(key, '%Y-%m-%d')
+        end = start + timedelta(days=1)
+    elif period == 'week':
+        start = datetime.strptime(key + '-1', '%G-W%V-%u')
+        end = start + timedelta(weeks=1)
+    else:
+        start = datetime.strptime(key, '%Y-%m')
+        end = start.replace(year=start.year + start.month // 12,
+                            month=start.month % 12 + 1)
+    return start.replace(tzinfo=pytz.UTC), end.replace(tzinfo=pytz.UTC)
+
+
 """
 Implementation of SQLite3 database operation for
 :py:class:`sqlhistorian.historian.SQLHistorian` and
@@ -67,7 +125,34 @@ For method details please refer to base class
 """
 class SqlLiteFuncts(DbDriver):
     def __init__(self, connect_params, table_names):
+        # the params are shared with the other connections of the historian
+        connect_params = dict(connect_params)
+        self.partition = connect_params.pop('partition', None)
+        if self.partition not in (None,) + PARTITION_PERIODS:
+            raise ValueError("Invalid partition {}, expected one of {}".format(
+                self.partition, ', '.join(PARTITION_PERIODS)))
         database = connect_params['database']
+        if self.partition and database == ':memory:':
+            raise ValueError("An in memory database can not be partitioned")
+        # read only connections are opened through a URI filename and do
+        # not change the database
+        self.read_only = bool(connect_params.pop('read_only', False))
+        # pragmas run on every new connection, journal_mode WAL lets
+        # readers and the writer work at the same time
+        self._pragmas = []
+        for pragma in ('journal_mode', 'wal_autocheckpoint',
+                       'journal_size_limit'):
+            value = connect_params.pop(pragma, None)
+            if value is None:
+                continue
+            if pragma == 'journal_mode':
+                if value.upper() not in JOURNAL_MODES:
+                    raise ValueError("Invalid journal_mode {}".format(value))
+                if self.read_only:
+                    continue
+            self._pragmas.append('PRAGMA {}={}'.format(
+                pragma, value.upper() if pragma == 'journal_mode'
+                else int(value)))
         thread_name = threading.currentThread().getName()
         _log.debug(
             "initializing sqlitefuncts in thread {}".format(thread_name))
@@ -95,6 +180,9 @@ class SqlLiteFuncts(DbDriver):
                     raise
 
         connect_params['database'] = self.__database
+        if self.read_only and database != ':memory:':
+            connect_params['database'] = self._uri(self.__database)
+            connect_params['uri'] = True
 
         if 'detect_types' not in connect_params:
             connect_params['detect_types'] = \
@@ -107,6 +195,10 @@ class SqlLiteFuncts(DbDriver):
         self.meta_table = None
         self.agg_topics_table = None
         self.agg_meta_table = None
+        # attached partition schemas by partition key, least recently used
+        # first, and the connection they are attached to
+        self._attached = OrderedDict()
+        self._connection = None
 
         if table_names:
             self.data_table = table_names['data_table']
@@ -149,6 +241,122 @@ class SqlLiteFuncts(DbDriver):
                 metadata TEXT NOT NULL)''', commit=True)
         _log.debug("Created data topics and meta tables")
 
+    def cursor(self, **kwargs):
+        cursor = super(SqlLiteFuncts, self).cursor(**kwargs)
+        if cursor.connection is not self._connection:
+            # partitions stay attached only as long as their connection
+            self._connection = cursor.connection
+            self._attached.clear()
+            for pragma in self._pragmas:
+                cursor.execute(pragma)
+        return cursor
+
+    @staticmethod
+    def _uri(path):
+        return 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+
+    def _partition_path(self, key):
+        return '{}.{}.{}'.format(self.__database, self.data_table, key)
+
+    def _partition_keys(self):
+        """
+        Keys of the partitions on disk, oldest first.
+        """
+        prefix = os.path.basename(self._partition_path(''))
+        directory = os.path.dirname(self.__database) or '.'
+        keys = []
+        for name in os.listdir(directory):
+            if not name.startswith(prefix):
+                continue
+            key = name[len(prefix):]
+            try:
+                partition_bounds(key, self.partition)
+            except ValueError:
+                # journal files and partitions of another period
+                continue
+            keys.append(key)
+        return sorted(keys, key=lambda k: partition_bounds(k, self.partition))
+
+    def _end_transaction(self):
+        # ATTACH and DETACH can not run within a transaction
+        with closing(self.cursor()) as cursor:
+            if cursor.connection.in_transaction:
+                self.commit()
+
+    def _detach(self, key):
+        schema = self._attached.pop(key)
+        self._end_transaction()
+        self.execute_stmt('DETACH DATABASE "{}"'.format(schema))
+
+    def _table(self, key):
+        """
+        Name of the data table of a partition, attaching the partition when
+        it is not. None is the data table of the main database, which holds
+        the data written before partitioning was turned on.
+        """
+        if key is None:
+            return self.data_table
+        schema = self._attached.get(key)
+        if schema is None:
+            while len(self._attached) >= MAX_ATTACHED_PARTITIONS:
+                self._detach(next(iter(self._attached)))
+            self._end_transaction()
+            schema = 'partition_' + key.replace('-', '_')
+            path = self._partition_path(key)
+            self.execute_stmt('ATTACH DATABASE ? AS "{}"'.format(schema),
+                              (self._uri(path) if self.read_only else path,))
+            self._attached[key] = schema
+            if not self.read_only:
+                self.execute_stmt(
+                    'CREATE TABLE IF NOT EXISTS "' + schema + '".' +
+                    self.data_table +
+                    ''' (ts timestamp NOT NULL,
+                         topic_id INTEGER NOT NULL,
+                         value_string TEXT NOT NULL,
+                         UNIQUE(topic_id, ts))''')
+                self.execute_stmt(
+                    'CREATE INDEX IF NOT EXISTS "' + schema + '".data_idx ON ' +
+                    self.data_table + ' (ts ASC)', commit=True)
+        self._attached.move_to_end(key)
+        return '"{}".{}'.format(schema, self.data_table)
+
+    def _data_keys(self, start=None, end=None):
+        """
+        Partitions holding the data between start and end, oldest first,
+        preceded by None for the data table of the main database.
+        """
+        if not self.partition:
+            return [None]
+        if start:
+            start = start.astimezone(pytz.UTC)
+        if end:
+            end = end.astimezone(pytz.UTC)
+        keys = self._partition_keys()
+        # partitions deleted through another connection
+        for key in [k for k in self._attached if k not in keys]:
+            self._detach(key)
+        selected = [None]
+        for key in keys:
+            p_start, p_end = partition_bounds(key, self.partition)
+            if start and end and start == end:
+                if p_start <= start < p_end:
+                    selected.append(key)
+            elif (start is None or p_end > start) and \
+                    (end is None or p_start < end):
+                selected.append(key)
+        return selected
+
+    def _drop_partition(self, key):
+        if key in self._attached:
+            self._detach(key)
+        path = self._partition_path(key)
+        for name in (path, path + '-journal', path + '-wal', path + '-shm'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        _log.info("Deleted historian partition {}".format(path))
+
 
     def record_table_definitions(self, table_defs, meta_table_name):
         _log.debug(
@@ -219,19 +427,316 @@ class SqlLiteFuncts(DbDriver):
         @param count:
         @param order:
         """
+        where_clauses, ts_args = self._ts_filter(start, end)
+        direction = 'DESC' if order == 'LAST_TO_FIRST' else 'ASC'
+
+        # can't have an offset without a limit
+        # -1 = no limit and allows the user to
+        # provide just an offset
+        if count is None:
+            count = -1
+        skip = max(skip, 0)
+
+        values = defaultdict(list)
+        for topic_id in topic_ids:
+            values[id_name_map[topic_id]] = []
+        start_t = datetime.utcnow()
+        if agg_type and agg_period:
+            self._query_table(agg_type + "_" + agg_period, topic_ids,
+                              id_name_map, where_clauses, ts_args, direction,
+                              skip, count, values)
+        elif not self.partition:
+            self._query_table(self.data_table, topic_ids, id_name_map,
+                              where_clauses, ts_args, direction, skip, count,
+                              values)
+        else:
+            self._query_partitions(topic_ids, id_name_map, start, end,
+                                   where_clauses, ts_args, direction, skip,
+                                   count, values)
+
+        _log.debug("Time taken to load results from db:{}".format(
+            datetime.utcnow()-start_t))
+        return values
+
+    def _query_table(self, table_name, topic_ids, id_name_map, where_clauses,
+                     ts_args, direction, skip, count, values):
+        paged = count >= 0 or skip > 0
+
+        # The topics are read with one statement for up to
+        # MAX_QUERY_TOPICS topics. When skip and count apply the rows of
+        # each topic are numbered with a window function, without one the
+        # topics are read one at a time with limit and offset.
+        chunk_size = MAX_QUERY_TOPICS
+        if paged and not WINDOW_FUNCTIONS:
+            chunk_size = 1
+
+        for index in range(0, len(topic_ids), chunk_size):
+            chunk = topic_ids[index:index + chunk_size]
+            where_statement = ' AND '.join(
+                ['topic_id IN ({})'.format(', '.join('?' * len(chunk)))] +
+                where_clauses)
+            args = list(chunk) + ts_args
+            if len(chunk) == 1 or not paged:
+                real_query = (
+                    'SELECT topic_id, ts, value_string FROM ' + table_name +
+                    ' WHERE ' + where_statement +
+                    ' ORDER BY topic_id, ts ' + direction +
+                    ' LIMIT ? OFFSET ?')
+                args.extend([count, skip])
+            else:
+                real_query = (
+                    'SELECT topic_id, ts AS "ts [timestamp]", value_string '
+                    'FROM (SELECT topic_id, ts, value_string, ROW_NUMBER() '
+                    'OVER (PARTITION BY topic_id ORDER BY ts ' + direction +
+                    ') AS row_number FROM ' + table_name +
+                    ' WHERE ' + where_statement + ') WHERE row_number > ?')
+                args.append(skip)
+                if count >= 0:
+                    real_query += ' AND row_number <= ?'
+                    args.append(skip + count)
+                real_query += ' ORDER BY topic_id, ts ' + direction
+            _log.debug("Real Query: " + real_query)
+            _log.debug("args: " + str(args))
+
+            cursor = self.select(real_query, args, fetch_all=False)
+            if cursor:
+                for topic_id, ts, value in cursor:
+                    values[id_name_map[topic_id]].append(
+                        (utils.format_timestamp(ts), jsonapi.loads(value)))
+                cursor.close()
+
+    def _query_partitions(self, topic_ids, id_name_map, start, end,
+                          where_clauses, ts_args, direction, skip, count,
+                          values):
+        """
+        Reads the partitions overlapping the query range one after the
+        other in the order of the query, keeping track of the rows still to
+        skip and to read for each topic.
+        """
+        keys = self._data_keys(start, end)
+        if direction == 'DESC':
+            keys.reverse()
+        remaining = dict((topic_id, (skip, count)) for topic_id in topic_ids)
+        for key in keys:
+            active = dict((topic_id, paging) for topic_id, paging
+                          in remaining.items() if paging[1] != 0)
+            if not active:
+                break
+            table_name = self._table(key)
+            skipping = [topic_id for topic_id, (to_skip, _) in active.items()
+                        if to_skip > 0]
+            # topics with fewer rows in the partition than they have left to
+            # skip are not read from it
+            for index in range(0, len(skipping), MAX_QUERY_TOPICS):
+                chunk = skipping[index:index + MAX_QUERY_TOPICS]
+                where_statement = ' AND '.join(
+                    ['topic_id IN ({})'.format(', '.join('?' * len(chunk)))] +
+                    where_clauses)
+                rows = dict(self.select(
+                    'SELECT topic_id, COUNT(*) FROM ' + table_name +
+                    ' WHERE ' + where_statement + ' GROUP BY topic_id',
+                    list(chunk) + ts_args))
+                for topic_id in chunk:
+                    to_skip, to_read = active[topic_id]
+                    if rows.get(topic_id, 0) <= to_skip:
+                        remaining[topic_id] = (
+                            to_skip - rows.get(topic_id, 0), to_read)
+                        del active[topic_id]
+
+            groups = defaultdict(list)
+            for topic_id, paging in active.items():
+                groups[paging].append(topic_id)
+            for (to_skip, to_read), group in groups.items():
+                read_before = dict((topic_id, len(values[id_name_map[topic_id]]))
+                                   for topic_id in group)
+                self._query_table(table_name, group, id_name_map,
+                                  where_clauses, ts_args, direction, to_skip,
+                                  to_read, values)
+                for topic_id in group:
+                    read = len(values[id_name_map[topic_id]]) - \
+                        read_before[topic_id]
+                    remaining[topic_id] = (
+                        0, to_read - read if to_read >= 0 else -1)
+
+    def stream_query(self, topic_ids, id_name_map, start=None, end=None,
+                     agg_type=None, agg_period=None, order="FIRST_TO_LAST",
+                     size=1000):
+        """
+        Reads the rows a page at a time, each page starting after the last
+        timestamp of the previous one (topic_id and ts are unique together),
+        so that a stream left open between pages does not hold a read lock
+        on the database.
+        """
+        if agg_type and agg_period:
+            keys = [agg_type + "_" + agg_period]
+            table = lambda key: key
+        else:
+            # partitions are read one after the other
+            keys = self._data_keys(start, end)
+            table = self._table
+
+        where_clauses, time_args = self._ts_filter(start, end)
+        where_clauses.insert(0, "topic_id = ?")
+        if order == 'LAST_TO_FIRST':
+            order_by, seek = 'ts DESC', 'ts < ?'
+            keys.reverse()
+        else:
+            order_by, seek = 'ts ASC', 'ts > ?'
+        # the stored text of ts is selected so that it can be compared as is
+        # in the next page
+        query = ('SELECT CAST(ts AS TEXT), ts, value_string FROM {table} '
+                 'WHERE {where} ORDER BY ' + order_by + ' LIMIT ?')
+        first_where = ' AND '.join(where_clauses)
+        next_where = ' AND '.join(where_clauses + [seek])
+
+        for topic_id in topic_ids:
+            name = id_name_map[topic_id]
+            for key in keys:
+                table_name = table(key)
+                rows = self.select(
+                    query.format(table=table_name, where=first_where),
+                    [topic_id] + time_args + [size])
+                while rows:
+                    for _, ts, value in rows:
+                        yield (name, utils.format_timestamp(ts),
+                               jsonapi.loads(value))
+                    if len(rows) < size:
+                        break
+                    rows = self.select(
+                        query.format(table=table_name, where=next_where),
+                        [topic_id] + time_args + [rows[-1][0], size])
+
+    def downsample_query(self, topic_ids, id_name_map, method, points,
+                         start=None, end=None, agg_type=None,
+                         agg_period=None, order="FIRST_TO_LAST"):
+        if method not in ('bucket_avg', 'min_max'):
+            raise NotImplementedError(
+                "{} is not downsampled in the database".format(method))
         table_name = self.data_table
         if agg_type and agg_period:
             table_name = agg_type + "_" + agg_period
+        elif self.partition:
+            raise NotImplementedError(
+                "Partitioned data is not downsampled in the database")
+        buckets = points if method == 'bucket_avg' else points // 2
+
+        values = defaultdict(list)
+        for topic_id in topic_ids:
+            values[id_name_map[topic_id]] = []
+        # JSON numbers are the only values starting with a digit or a minus
+        where_clauses, ts_args = self._ts_filter(start, end)
+        where_clauses.append("(substr(value_string, 1, 1) BETWEEN '0' AND '9'"
+                             " OR substr(value_string, 1, 1) = '-')")
+
+        def topic_chunks(ids):
+            chunks = []
+            for index in range(0, len(ids), MAX_QUERY_TOPICS):
+                chunk = ids[index:index + MAX_QUERY_TOPICS]
+                where_statement = ' AND '.join(
+                    ['topic_id IN ({})'.format(', '.join('?' * len(chunk)))] +
+                    where_clauses)
+                chunks.append((where_statement, list(chunk) + ts_args))
+            return chunks
+
+        chunks = topic_chunks(topic_ids)
+
+        # topics with no more values than points are returned as they are,
+        # as downsample_values does
+        counts = {}
+        for where_statement, args in chunks:
+            counts.update(self.select(
+                'SELECT topic_id, COUNT(*) FROM ' + table_name +
+                ' WHERE ' + where_statement + ' GROUP BY topic_id', args))
+        kept = [topic_id for topic_id in topic_ids
+                if counts.get(topic_id, 0) <= points]
+        downsampled = [topic_id for topic_id in topic_ids
+                       if counts.get(topic_id, 0) > points]
+        for where_statement, args in topic_chunks(kept):
+            rows = self.select(
+                'SELECT topic_id, ts AS "ts [timestamp]", value_string FROM ' +
+                table_name + ' WHERE ' + where_statement +
+                ' ORDER BY topic_id, ts', args)
+            for topic_id, ts, value in rows:
+                values[id_name_map[topic_id]].append(
+                    (utils.format_timestamp(ts), jsonapi.loads(value)))
+
+        if downsampled:
+            # the buckets split the query range, or the range of the data
+            # found when the query is open ended, and are the same for all
+            # the topics
+            range_start, range_end = start, end
+            if start is None or end is None:
+                found = []
+                for where_statement, args in chunks:
+                    found.extend(self.select(
+                        'SELECT MIN(ts) AS "first [timestamp]", '
+                        'MAX(ts) AS "last [timestamp]" FROM ' + table_name +
+                        ' WHERE ' + where_statement, args))
+                found = [
+                    (first if first.tzinfo else first.replace(tzinfo=pytz.UTC),
+                     last if last.tzinfo else last.replace(tzinfo=pytz.UTC))
+                    for first, last in found if first is not None]
+                if range_start is None:
+                    range_start = min(first for first, _ in found)
+                if range_end is None:
+                    range_end = max(last for _, last in found) + \
+                        timedelta(microseconds=1)
+            range_start = range_start.astimezone(pytz.UTC)
+            width = bucket_width(range_start, range_end, buckets)
+            # microseconds since the start of the range, the date and time
+            # functions of SQLite only being precise to the millisecond
+            bucket = ("MIN(?, (CAST(strftime('%s', ts) AS INTEGER) * 1000000"
+                      " + CASE WHEN substr(ts, 20, 1) = '.' "
+                      "THEN CAST(substr(ts, 21, 6) AS INTEGER) ELSE 0 END"
+                      " - ?) / ?)")
+            bucket_args = [buckets - 1,
+                           (range_start - EPOCH) // timedelta(microseconds=1),
+                           width]
+
+            for where_statement, args in topic_chunks(downsampled):
+                if method == 'bucket_avg':
+                    real_query = (
+                        'SELECT topic_id, ' + bucket + ' AS bucket, '
+                        'AVG(CAST(value_string AS REAL)) FROM ' +
+                        table_name + ' WHERE ' + where_statement +
+                        ' GROUP BY topic_id, bucket ORDER BY topic_id, bucket')
+                    rows = self.select(real_query, bucket_args + args)
+                    for topic_id, number, average in rows:
+                        values[id_name_map[topic_id]].append(
+                            (utils.format_timestamp(
+                                range_start + timedelta(
+                                    microseconds=number * width)), average))
+                else:
+                    # SQLite returns the other columns of the row holding the
+                    # minimum or maximum of a group
+                    real_query = (
+                        'WITH numbered AS (SELECT topic_id, ts, value_string, '
+                        'CAST(value_string AS REAL) AS number, ' + bucket +
+                        ' AS bucket FROM ' + table_name +
+                        ' WHERE ' + where_statement + ') '
+                        'SELECT topic_id, ts AS "ts [timestamp]", value_string '
+                        'FROM (SELECT topic_id, ts, value_string, MIN(number) '
+                        'FROM numbered GROUP BY topic_id, bucket) '
+                        'UNION '
+                        'SELECT topic_id, ts, value_string '
+                        'FROM (SELECT topic_id, ts, value_string, MAX(number) '
+                        'FROM numbered GROUP BY topic_id, bucket) '
+                        'ORDER BY 1, 2')
+                    rows = self.select(real_query, bucket_args + args)
+                    for topic_id, ts, value in rows:
+                        values[id_name_map[topic_id]].append(
+                            (utils.format_timestamp(ts),
+                             jsonapi.loads(value)))
 
-        query = '''SELECT topic_id, ts, value_string
-                   FROM ''' + table_name + '''
-                   {where}
-                   {order_by}
-                   {limit}
-                   {offset}'''
+        if order == 'LAST_TO_FIRST':
+            for rows in values.values():
+                rows.reverse()
+        return values
 
-        where_clauses = ["WHERE topic_id = ?"]
-        args = [topic_ids[0]]
+    @staticmethod
+    def _ts_filter(start, end):
+        where_clauses = []
+        args = []
 
         # base historian converts naive timestamps to UTC, but if the
         # start and end had explicit timezone info then they need to get
@@ -251,51 +756,7 @@ class SqlLiteFuncts(DbDriver):
             if end:
                 where_clauses.append("ts < ?")
                 args.append(end)
-
-
-        where_statement = ' AND '.join(where_clauses)
-
-        order_by = 'ORDER BY topic_id ASC, ts ASC'
-        if order == 'LAST_TO_FIRST':
-            order_by = ' ORDER BY topic_id DESC, ts DESC'
-
-        # can't have an offset without a limit
-        # -1 = no limit and allows the user to
-        # provide just an offset
-        if count is None:
-            count = -1
-
-        limit_statement = 'LIMIT ?'
-        args.append(count)
-
-        offset_statement = ''
-        if skip > 0:
-            offset_statement = 'OFFSET ?'
-            args.append(skip)
-
-        real_query = query.format(where=where_statement,
-                                  limit=limit_statement,
-                                  offset=offset_statement,
-                                  order_by=order_by)
-        _log.debug("Real Query: " + real_query)
-        _log.debug("args: " + str(args))
-
-
-        values = defaultdict(list)
-        start_t = datetime.utcnow()
-        for topic_id in topic_ids:
-            args[0] = topic_id
-            values[id_name_map[topic_id]] = []
-            cursor = self.select(real_query, args, fetch_all=False)
-            if cursor:
-                for _id, ts, value in cursor:
-                    values[id_name_map[topic_id]].append(
-                        (utils.format_timestamp(ts), jsonapi.loads(value)))
-                cursor.close()
-
-        _log.debug("Time taken to load results from db:{}".format(
-            datetime.utcnow()-start_t))
-        return values
+        return where_clauses, args
 
     def manage_db_size(self, history_limit_timestamp, storage_limit_gb):
         """
@@ -309,6 +770,12 @@ class SqlLiteFuncts(DbDriver):
 
         commit = False
 
+        if self.partition:
+            self._manage_partitions(history_limit_timestamp, storage_limit_gb)
+            # whole partitions are deleted, only the data left in the data
+            # table of the main database is deleted row by row
+            storage_limit_gb = None
+
         if history_limit_timestamp is not None:
             count = self.execute_stmt(
                 '''DELETE FROM ''' + self.data_table + \
@@ -344,6 +811,79 @@ class SqlLiteFuncts(DbDriver):
             _log.debug("Committing changes for manage_db_size.")
             self.commit()
 
+    def _manage_partitions(self, history_limit_timestamp, storage_limit_gb):
+        keys = self._partition_keys()
+        expired = []
+        if history_limit_timestamp is not None:
+            limit = history_limit_timestamp
+            if limit.tzinfo is None:
+                limit = limit.replace(tzinfo=pytz.UTC)
+            expired = [key for key in keys
+                       if partition_bounds(key, self.partition)[1] <= limit]
+        kept = [key for key in keys if key not in expired]
+
+        if storage_limit_gb is not None:
+            max_storage_bytes = storage_limit_gb * 1024 ** 3
+            size = os.path.getsize(self.__database) + sum(
+                os.path.getsize(self._partition_path(key)) for key in kept)
+            # the newest partition is kept as it is being written to
+            while len(kept) > 1 and size >= max_storage_bytes:
+                key = kept.pop(0)
+                size -= os.path.getsize(self._partition_path(key))
+                expired.append(key)
+            if size >= max_storage_bytes:
+                _log.warning("Historian storage is still over {} GB with "
+                             "only the newest partition left".format(
+                                 storage_limit_gb))
+
+        for key in expired:
+            self._drop_partition(key)
+
+    @contextlib.contextmanager
+    def bulk_insert(self):
+        """
+        With partitioning the records are grouped by partition and written
+        when the block exits. ATTACH and DETACH end the transaction, so the
+        partitions of a batch are attached before any of its records are
+        written instead of as each record comes in. Only a batch spanning
+        more than MAX_ATTACHED_PARTITIONS partitions is committed between
+        groups of partitions.
+
+        :yields: insert method
+        """
+        if not self.partition:
+            yield self.insert_data
+            return
+
+        records = OrderedDict()
+
+        def insert_data(ts, topic_id, data):
+            key = partition_key(ts, self.partition)
+            records.setdefault(key, []).append(
+                (ts, topic_id, jsonapi.dumps(data)))
+            return True
+
+        yield insert_data
+
+        keys = list(records)
+        for i in range(0, len(keys), MAX_ATTACHED_PARTITIONS):
+            group = keys[i:i + MAX_ATTACHED_PARTITIONS]
+            # the partitions of the group are the most recently used, so
+            # attaching one never detaches another of the group
+            tables = [self._table(key) for key in group]
+            for key, table_name in zip(group, tables):
+                self.execute_many('INSERT OR REPLACE INTO ' + table_name +
+                                  ' values(?, ?, ?)', records[key])
+
+    def insert_data(self, ts, topic_id, data):
+        if not self.partition:
+            return super(SqlLiteFuncts, self).insert_data(ts, topic_id, data)
+        table_name = self._table(partition_key(ts, self.partition))
+        self.execute_stmt('INSERT OR REPLACE INTO ' + table_name +
+                          ' values(?, ?, ?)',
+                          (ts, topic_id, jsonapi.dumps(data)), commit=False)
+        return True
+
     def insert_meta_query(self):
         return '''INSERT OR REPLACE INTO ''' + self.meta_table + \
                ''' values(?, ?)'''
@@ -561,6 +1101,10 @@ class SqlLiteFuncts(DbDriver):
 
         where_statement = ' AND '.join(where_clauses)
 
+        if self.partition:
+            return self._collect_partitioned_aggregate(
+                agg_type, where_statement, args, start, end)
+
         real_query = query.format(where=where_statement)
         _log.debug("Real Query: " + real_query)
         _log.debug("args: " + str(args))
@@ -573,6 +1117,109 @@ class SqlLiteFuncts(DbDriver):
         else:
             return 0, 0
 
+    def collect_aggregates(self, topic_ids_list, agg_type, start=None,
+                           end=None):
+        """
+        Computes the aggregates of the points joining the data table to the
+        (point, topic_id) pairs and grouping by point, in one query per
+        MAX_QUERY_TOPICS parameters. The results of a point whose pairs are
+        split across queries are combined like those of partitions.
+        """
+        if self.partition or len(topic_ids_list) < 2:
+            return super(SqlLiteFuncts, self).collect_aggregates(
+                topic_ids_list, agg_type, start, end)
+        if agg_type.upper() not in ['AVG', 'MIN', 'MAX', 'COUNT', 'SUM']:
+            raise ValueError("Invalid aggregation type {}".format(agg_type))
+
+        pairs = [(point, topic_id)
+                 for point, topic_ids in enumerate(topic_ids_list)
+                 for topic_id in topic_ids]
+
+        args = []
+        where_clauses = []
+        if start:
+            start = start.astimezone(pytz.UTC)
+        if end:
+            end = end.astimezone(pytz.UTC)
+        if start and end and start == end:
+            where_clauses.append("ts = ?")
+            args.append(start)
+        else:
+            if start:
+                where_clauses.append("ts >= ?")
+                args.append(start)
+            if end:
+                where_clauses.append("ts < ?")
+                args.append(end)
+        where_statement = ''
+        if where_clauses:
+            where_statement = 'WHERE ' + ' AND '.join(where_clauses)
+
+        # two parameters per pair
+        chunk_size = MAX_QUERY_TOPICS // 2
+        single_query = len(pairs) <= chunk_size
+        chunk_agg_type = agg_type
+        if not single_query and agg_type.upper() == 'AVG':
+            # averages are combined from the sum and count of each query
+            chunk_agg_type = 'SUM'
+        results = defaultdict(list)
+        for index in range(0, len(pairs), chunk_size):
+            chunk = pairs[index:index + chunk_size]
+            query = '''WITH points(point, topic_id) AS (VALUES ''' + \
+                    ', '.join(["(?, ?)"] * len(chunk)) + ''')
+                    SELECT points.point, ''' + chunk_agg_type + '''(value_string),
+                    count(value_string) FROM ''' + self.data_table + '''
+                    JOIN points ON ''' + self.data_table + '''.topic_id =
+                    points.topic_id ''' + where_statement + '''
+                    GROUP BY points.point'''
+            _log.debug("Real Query: " + query)
+            chunk_args = [arg for pair in chunk for arg in pair] + args
+            for point, value, count in self.select(query, chunk_args):
+                if count:
+                    results[point].append((value, count))
+        if single_query:
+            return [results[point][0] if results[point] else (None, 0)
+                    for point in range(len(topic_ids_list))]
+        return [self._combine_aggregates(agg_type, results[point])
+                for point in range(len(topic_ids_list))]
+
+    def _collect_partitioned_aggregate(self, agg_type, where_statement, args,
+                                       start, end):
+        """
+        Aggregates each partition overlapping the time range and combines
+        the results, averages from the sum and count of each partition.
+        """
+        agg_type = agg_type.upper()
+        results = []
+        for key in self._data_keys(start, end):
+            real_query = (
+                'SELECT ' + ('SUM' if agg_type == 'AVG' else agg_type) +
+                '(value_string), count(value_string) FROM ' +
+                self._table(key) + ' ' + where_statement)
+            _log.debug("Real Query: " + real_query)
+            value, count = self.select(real_query, args)[0]
+            if count:
+                results.append((value, count))
+        return self._combine_aggregates(agg_type, results)
+
+    @staticmethod
+    def _combine_aggregates(agg_type, results):
+        """
+        Combine the (value, count) results of aggregating parts of the data,
+        with the sum in place of the average for AVG.
+        """
+        agg_type = agg_type.upper()
+        if not results:
+            return None, 0
+        count = sum(c for _, c in results)
+        if agg_type == 'MIN':
+            return min(v for v, _ in results), count
+        if agg_type == 'MAX':
+            return max(v for v, _ in results), count
+        if agg_type == 'AVG':
+            return sum(v for v, _ in results) / count, count
+        return sum(v for v, _ in results), count
+
 
     @staticmethod
     def get_tagging_query_from_ast(topic_tags_table, tup, tag_refs):
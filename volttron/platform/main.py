@@ -367,7 +367,8 @@ class Router(BaseRouter):
 
         self.pubsub = PubSubService(self.socket,
                                     self._protected_topics,
-                                    self._ext_routing)
+                                    self._ext_routing,
+                                    peer_codecs=self._codecs)
         self.ext_rpc = ExternalRPCService(self.socket,
                                           self._ext_routing)
         self._poller.register(sock, zmq.POLLIN)
@@ -64,6 +64,7 @@ from volttron.platform import is_rabbitmq_available
 from volttron.platform.agent import utils
 from volttron.platform.agent.utils import load_platform_config, get_platform_instance_name
 from volttron.platform.keystore import KeyStore, KnownHostsStore
+from volttron.utils.frame_serialization import get_codec, supported_codecs
 from volttron.utils.rmq_mgmt import RabbitMQMgmt
 from .decorators import annotate, annotations, dualmethod
 from .dispatch import Signal
@@ -605,8 +606,12 @@ class Core(BasicCore):
             state.ident = ident = 'connect.hello.%d' % state.count
             state.count += 1
             self.spawn(connection_failed_check)
+            args = ['hello']
+            if self.messagebus == 'zmq':
+                # Advertise the codecs we can decode, the router picks one
+                args.append(supported_codecs())
             message = Message(peer='', subsystem='hello',
-                              id=ident, args=['hello'])
+                              id=ident, args=args)
             self.connection.send_vip_object(message)
 
         def hello_response(sender, version='',
@@ -837,6 +842,8 @@ class ZMQCore(Core):
                         len(message.args) > 3 and
                         message.args[0] == 'welcome'):
                     version, server, identity = message.args[1:4]
+                    # Older routers do not negotiate a codec
+                    sock.set_codec(get_codec(message.args[4]) if len(message.args) > 4 else None)
                     self.connected = True
                     self.onconnected.send(self, version=version,
                                           router=server, identity=identity)
@@ -51,6 +51,7 @@ from zmq import green as zmq
 from zmq import SNDMORE
 from volttron.platform import jsonapi
 from volttron.utils.frame_serialization import serialize_frames
+from volttron.utils.prefix_trie import PrefixTrie
 from .base import SubsystemBase
 from ..decorators import annotate, annotations, dualmethod, spawn
 from ..errors import Unreachable, VIPError, UnknownSubsystem
@@ -103,6 +104,8 @@ class PubSub(SubsystemBase):
             return defaultdict(set)
 
         self._my_subscriptions = defaultdict(platform_subscriptions)
+        # Prefixes of the subscriptions of each bus, for all the platforms
+        self._subscription_index = defaultdict(PrefixTrie)
         self.protected_topics = ProtectedPubSubTopics()
         core.register('pubsub', self._handle_subsystem, self._handle_error)
         self.rpc().export(self._peer_push, 'pubsub.push')
@@ -155,15 +158,18 @@ class PubSub(SubsystemBase):
         peer = 'pubsub'
 
         handled = 0
+        index = self._subscription_index.get(bus)
+        # Each prefix is matched once, whatever the number of platforms it is subscribed on
+        prefixes = index.match(topic) if index is not None else []
         for platform in self._my_subscriptions:
             # _log.debug("SYNC: process callback subscriptions: {}".format(self._my_subscriptions[platform][bus]))
             buses = self._my_subscriptions[platform]
-            if bus in buses:
+            if prefixes and bus in buses:
                 subscriptions = buses[bus]
-                for prefix, callbacks in subscriptions.items():
-                    if topic.startswith(prefix):
+                for prefix in prefixes:
+                    if prefix in subscriptions:
                         handled += 1
-                        for callback in callbacks:
+                        for callback in subscriptions[prefix]:
                             callback(peer, sender, bus, topic, headers, message)
         if not handled:
             # No callbacks for topic; synchronize with sender
@@ -385,6 +391,7 @@ class PubSub(SubsystemBase):
                 self._my_subscriptions['internal'][bus][prefix].add(callback)
             else:
                 self._my_subscriptions['all'][bus][prefix].add(callback)
+            self._subscription_index[bus].add(prefix)
                 # _log.debug("SYNC: add subscriptions: {}".format(self._my_subscriptions['internal'][bus][prefix]))
         except KeyError:
             _log.error("PUBSUB something went wrong in add subscriptions")
@@ -507,6 +514,7 @@ class PubSub(SubsystemBase):
                             remove.append(topic)
                     for topic in remove:
                         del subscriptions[topic]
+                        self._index_subscription(bus, topic)
                     if not subscriptions:
                         del bus_subscriptions[bus]
                     if not bus_subscriptions:
@@ -525,6 +533,7 @@ class PubSub(SubsystemBase):
                             del subscriptions[prefix]
                         except KeyError:
                             return []
+                        self._index_subscription(bus, prefix)
                     else:
                         try:
                             callbacks = subscriptions[prefix]
@@ -539,6 +548,7 @@ class PubSub(SubsystemBase):
                                 del subscriptions[prefix]
                             except KeyError:
                                 return []
+                            self._index_subscription(bus, prefix)
                     topics = [prefix]
                     if not subscriptions:
                         del bus_subscriptions[bus]
@@ -546,6 +556,23 @@ class PubSub(SubsystemBase):
                         del self._my_subscriptions[platform]
         return topics
 
+    def _index_subscription(self, bus, prefix):
+        """
+        Remove the prefix from the index of the bus once no platform subscribes to it anymore.
+        param bus: bus
+        type bus: str
+        param prefix: prefix removed from the subscriptions
+        type prefix: str
+        """
+        for bus_subscriptions in self._my_subscriptions.values():
+            if prefix in bus_subscriptions.get(bus, {}):
+                return
+        index = self._subscription_index.get(bus)
+        if index is not None:
+            index.remove(prefix)
+            if not index:
+                del self._subscription_index[bus]
+
     def unsubscribe(self, peer, prefix, callback, bus='', all_platforms=False):
         """Unsubscribe and remove callback(s).
 
@@ -641,6 +668,72 @@ class PubSub(SubsystemBase):
             self.vip_socket.send_vip('', 'pubsub', args, result.ident, copy=False)
             return result
 
+    def publish_many(self, peer: str, messages, bus=''):
+        """Publish several messages via a peer in a single VIP message.
+
+        The messages are sent in one frame and distributed by the
+        PubSubService in one pass, which acknowledges the whole batch
+        with a single response. Adds volttron platform version
+        compatibility information to the header of every message.
+        param peer: peer
+        type peer: str
+        param messages: (topic, headers, message) tuples to publish
+        type messages: list
+        param bus: bus
+        type bus: str
+        return: Total number of subscribers the messages were sent to.
+        :rtype: int
+
+        :Return Values:
+        Number of subscribers summed over the messages
+        """
+        batch = []
+        for topic, headers, message in messages:
+            if headers is None:
+                headers = {}
+            headers['min_compatible_version'] = min_compatible_version
+            headers['max_compatible_version'] = max_compatible_version
+            batch.append([topic, headers, message])
+
+        if peer is None:
+            peer = 'pubsub'
+
+        # For backward compatibility with old pubsub and with routers that do not negotiate a
+        # codec in the hello, which predate publish_many
+        if self._send_via_rpc or self.vip_socket.codec is None:
+            result = next(self._results)
+            self.core().spawn(self._publish_each, result, peer, batch, bus)
+            return result
+        else:
+            result = next(self._results)
+            # Parameters are stored initially, in case remote agent/platform is using old pubsub
+            if self._parameters_needed:
+                kwargs = dict(op='publish_many', peer=peer, bus=bus, messages=batch)
+                self._save_parameters(result.ident, **kwargs)
+
+            args = ['publish_many', dict(bus=bus, messages=batch)]
+            self.vip_socket.send_vip('', 'pubsub', args, result.ident, copy=False)
+            return result
+
+    def _publish_each(self, result, peer, messages, bus):
+        """Publish the messages of a batch one by one and set the total number of subscribers on the result.
+        param result: result of the publish_many call
+        type result: AsyncResult
+        param peer: peer
+        type peer: str
+        param messages: [topic, headers, message] lists to publish
+        type messages: list
+        param bus: bus
+        type bus: str
+        """
+        try:
+            count = 0
+            for topic, headers, message in messages:
+                count += self.publish(peer, topic, headers=headers, message=message, bus=bus).get() or 0
+            result.set(count)
+        except Exception as exc:
+            result.set_exception(exc)
+
     def _check_if_protected_topic(self, topic):
         required_caps = self.protected_topics.get(topic)
         if required_caps:
@@ -815,6 +908,8 @@ class PubSubWithRPC(object):
                 self._core().spawn(self._subscribe, id, results, parameters)
             elif parameters['op'] == 'publish':
                 self._core().spawn(self._publish, id, results, parameters)
+            elif parameters['op'] == 'publish_many':
+                self._core().spawn(self._publish_many, id, results, parameters)
             elif parameters['op'] == 'list':
                 self._core().spawn(self._list, id, results, parameters)
             elif parameters['op'] == 'unsubscribe':
@@ -930,6 +1025,37 @@ class PubSubWithRPC(object):
             if result is not None:
                 result.set_exception(exc)
 
+    def _publish_many(self, results_id, results, parameters):
+        """Publish many call using RPC
+            param results_id: Asynchronous result ID required to the set response for the caller
+            type results_id: float (hash value)
+            param results: Async results dictionary
+            type results: Weak dictionary
+            param parameters: Input parameters for the publish many call
+        """
+        try:
+            result = results.pop(results_id)
+        except KeyError:
+            result = None
+        try:
+            bus = parameters['bus']
+            messages = parameters['messages']
+            event = parameters['event']
+            event.cancel()
+        except KeyError:
+            return
+        try:
+            count = 0
+            for topic, headers, message in messages:
+                count += self._rpc().call(
+                    'pubsub', 'pubsub.publish', topic=topic, headers=headers,
+                    message=message, bus=bus).get(timeout=5) or 0
+            if result is not None:
+                result.set(count)
+        except gevent.Timeout as exc:
+            if result is not None:
+                result.set_exception(exc)
+
     def _unsubscribe(self, results_id, results, parameters):
         """Unsubscribe call using RPC
             param results_id: Asynchronous result ID required to the set response for the caller
@@ -376,9 +376,54 @@ class RMQPubSub(SubsystemBase):
         result = next(self._results)
         self._pubcount[self._message_number] = result.ident
         self._message_number += 1
+        self.core().spawn_later(0.01, self.set_result, result.ident, 1)
+        self._basic_publish(result.ident, topic, headers, message, bus)
+        return result
+
+    def publish_many(self, peer, messages, bus=''):
+        """Publish several messages via a peer and acknowledge them once.
+
+        Each message is routed by its own topic, so it is published on the
+        channel separately, but the batch is acknowledged with a single
+        result. Adds volttron platform version compatibility information
+        to the header of every message.
+        param peer: peer
+        type peer: str
+        param messages: (topic, headers, message) tuples to publish
+        type messages: list
+        param bus: bus
+        type bus: str
+        return: Number of messages published.
+        :rtype: int
+
+        :Return Values:
+        Number of messages
+        """
+        result = next(self._results)
+        if messages:
+            # Confirmation of the last message of the batch completes the result
+            self._message_number += len(messages)
+            self._pubcount[self._message_number - 1] = result.ident
+        self.core().spawn_later(0.01, self.set_result, result.ident, len(messages))
+        for topic, headers, message in messages:
+            self._basic_publish(result.ident, topic, headers, message, bus)
+        return result
+
+    def _basic_publish(self, ident, topic, headers, message, bus):
+        """Publish a message on the RabbitMQ exchange with the routing key of the topic.
+        param ident: asyn result id
+        type ident: str
+        param topic: topic for the publish message
+        type topic: str
+        param headers: header info for the message
+        type headers: None or dict
+        param message: actual message
+        type message: None or any
+        param bus: bus
+        type bus: str
+        """
         routing_key = self._form_routing_key(topic)
         connection = self.core().connection
-        self.core().spawn_later(0.01, self.set_result, result.ident, 1)
         if headers is None:
             headers = {}
 
@@ -397,7 +442,7 @@ class RMQPubSub(SubsystemBase):
                             proto='VIP',  # PROTO
                             user=self.core().identity,  # USER_ID
                             ),
-            'message_id': result.ident,  # MSG_ID
+            'message_id': ident,  # MSG_ID
             'type': 'pubsub',  # SUBSYS
             'content_type': 'application/json'
         }
@@ -413,7 +458,6 @@ class RMQPubSub(SubsystemBase):
             self._isconnected = False
             raise Unreachable(errno.EHOSTUNREACH, "Connection to RabbitMQ is lost",
                               'rabbitmq broker', 'pubsub')
-        return result
 
     def set_result(self, ident, value=None):
         try:
@@ -51,6 +51,7 @@ from collections import defaultdict
 # Create a context common to the green and non-green zmq modules.
 from volttron.platform.agent.utils import get_platform_instance_name
 from volttron.utils.frame_serialization import serialize_frames
+from volttron.utils.prefix_trie import PrefixTrie
 
 green.Context._instance = green.Context.shadow(zmq.Context.instance().underlying)
 from volttron.platform import get_home
@@ -68,7 +69,7 @@ _ROUTE_ERRORS = {
 _log = logging.getLogger(__name__)
 
 class PubSubService(object):
-    def __init__(self, socket, protected_topics, routing_service, *args, **kwargs):
+    def __init__(self, socket, protected_topics, routing_service, *args, peer_codecs=None, **kwargs):
         self._logger = logging.getLogger(__name__)
 
         def platform_subscriptions():
@@ -78,16 +79,24 @@ class PubSubService(object):
             return defaultdict(set)
 
         self._peer_subscriptions = defaultdict(platform_subscriptions)
+        # Prefixes of the 'internal' and 'all' subscriptions of each bus
+        self._subscription_index = defaultdict(PrefixTrie)
         self._vip_sock = socket
         self._user_capabilities = {}
         self._protected_topics = ProtectedPubSubTopics()
         self._load_protected_topics(protected_topics)
         self._ext_subscriptions = defaultdict(set)
+        # Compiled from the external subscriptions: prefix index and the
+        # platforms subscribed to each prefix
+        self._ext_index = PrefixTrie()
+        self._ext_platforms = {}
         self._ext_router = routing_service
         if self._ext_router is not None:
             self._ext_router.register('on_connect', self.external_platform_add)
             self._ext_router.register('on_disconnect', self.external_platform_drop)
         self._rabbitmq_agent = None
+        # Codecs negotiated by the peers with the router
+        self._peer_codecs = peer_codecs if peer_codecs is not None else {}
 
     def _add_peer_subscription(self, peer, bus, prefix, platform='internal'):
         """
@@ -100,6 +109,26 @@ class PubSubService(object):
         :type str
         """
         self._peer_subscriptions[platform][bus][prefix].add(peer)
+        if platform in ('internal', 'all'):
+            self._subscription_index[bus].add(prefix)
+
+    def _index_subscription(self, bus, prefix):
+        """
+        Keep the prefix index of the bus in step with the 'internal' and 'all' subscriptions after a prefix is
+        removed from them.
+        :param bus bus.
+        :type str
+        :param prefix subscription prefix
+        :type str
+        """
+        for platform in ('internal', 'all'):
+            if prefix in self._peer_subscriptions.get(platform, {}).get(bus, {}):
+                return
+        index = self._subscription_index.get(bus)
+        if index is not None:
+            index.remove(prefix)
+            if not index:
+                del self._subscription_index[bus]
 
     def peer_drop(self, peer, **kwargs):
         """
@@ -127,6 +156,7 @@ class PubSubService(object):
         if instance_name in self._ext_subscriptions:
             self._logger.debug("PUBSUBSERVICE dropping external subscriptions for {}".format(instance_name))
             del self._ext_subscriptions[instance_name]
+            self._compile_external_subscriptions()
 
     def _sync(self, peer, items):
         """
@@ -158,6 +188,7 @@ class PubSubService(object):
         for platform, bus, prefix in remove:
             subscriptions = self._peer_subscriptions[platform][bus]
             assert not subscriptions.pop(prefix)
+            self._index_subscription(bus, prefix)
 
         for platform, bus, prefix in items:
             self._add_peer_subscription(peer, bus, prefix, platform)
@@ -269,12 +300,14 @@ class PubSubService(object):
                             remove.append(topic)
                     for topic in remove:
                         del subscriptions[topic]
+                        self._index_subscription(bus, topic)
                 else:
                     for prefix in prefix if isinstance(prefix, list) else [prefix]:
                         subscribers = subscriptions[prefix]
                         subscribers.discard(peer)
                         if not subscribers:
                             del subscriptions[prefix]
+                            self._index_subscription(bus, prefix)
 
                 if platform == 'all' and self._ext_router is not None:
                     # Send updated subscription list to all connected platforms
@@ -313,6 +346,75 @@ class PubSubService(object):
                 self._publish_on_rmq_bus(frames)
             return self._distribute(frames, user_id)
 
+    def _peer_publish_many(self, frames, user_id):
+        """Publish a batch of messages to their subscribers in a single pass and acknowledge the batch once.
+        The batch is rejected as a whole if the publisher is not authorized to publish any of its topics.
+        :param frames list of frames
+        :type frames list
+        :param user_id user id of the publishing agent. This is required for protected topics check.
+        :type user_id  UTF-8 encoded User-Id property
+        :returns: Count of subscribers summed over the messages.
+        :rtype: int
+
+        :Return Values:
+        Number of subscribers to whom the messages were sent
+        """
+        if len(frames) > 7:
+            publisher, receiver, proto, usr_id, msg_id, subsystem = frames[:6]
+
+            def send_error(errnum, errmsg):
+                self._send([publisher, '', proto, user_id, msg_id,
+                            'error', str(errnum), str(errmsg), '', subsystem], publisher)
+
+            try:
+                msg = frames[7]
+                bus = msg['bus']
+                messages = msg['messages']
+            except (KeyError, TypeError) as exc:
+                self._logger.error("Missing key in _peer_publish_many message {}".format(exc))
+                send_error(INVALID_REQUEST, "Missing key {} in publish_many message".format(exc))
+                return None
+            errmsg = self._check_publish_batch(messages)
+            if errmsg is not None:
+                self._logger.error("Invalid _peer_publish_many message from {}: {}".format(publisher, errmsg))
+                send_error(INVALID_REQUEST, errmsg)
+                return None
+            for topic, headers, message in messages:
+                errmsg = self._check_if_protected_topic(user_id, topic)
+                if errmsg is not None:
+                    send_error(UNAUTHORIZED, errmsg)
+                    return None
+            count = 0
+            for topic, headers, message in messages:
+                # Subscribers receive each message as a regular publish
+                pub_frames = [publisher, receiver, proto, usr_id, msg_id, subsystem, 'publish', topic,
+                              dict(sender=publisher, bus=bus, headers=headers, message=message)]
+                if self._rabbitmq_agent:
+                    self._publish_on_rmq_bus(pub_frames)
+                count += self._distribute(pub_frames, user_id)
+            return count
+
+    @staticmethod
+    def _check_publish_batch(messages):
+        """
+        Checks the messages of a publish_many batch before any of them is distributed.
+        :param messages: [topic, headers, message] entries of the batch
+        :type messages: list
+        :returns: None if every entry is well formed or error message
+        :rtype: None or str
+        """
+        if not isinstance(messages, (list, tuple)):
+            return "publish_many messages must be a list, not {}".format(type(messages).__name__)
+        for i, entry in enumerate(messages):
+            if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+                return "publish_many message {} is not a [topic, headers, message] entry".format(i)
+            topic, headers, _ = entry
+            if not isinstance(topic, str):
+                return "publish_many message {} topic must be a string".format(i)
+            if headers is not None and not isinstance(headers, dict):
+                return "publish_many message {} headers must be a dictionary".format(i)
+        return None
+
     def _peer_list(self, frames):
         """Returns a list of subscriptions for a specific bus. If bus is None, then it returns list of subscriptions
         for all the buses.
@@ -425,7 +527,6 @@ class PubSubService(object):
 
         all_subscriptions = dict()
         subscriptions = dict()
-        subs = dict()
         # Get subscriptions for all platforms
         try:
             all_subscriptions = self._peer_subscriptions['all'][bus]
@@ -436,21 +537,32 @@ class PubSubService(object):
         except KeyError:
             pass
 
-        subs.update(all_subscriptions)
-        subs.update(subscriptions)
         subscribers = set()
         # Check for local subscribers
-        for prefix, subscription in subs.items():
-            if subscription and topic.startswith(prefix):
+        index = self._subscription_index.get(bus)
+        for prefix in index.match(topic) if index is not None else ():
+            # Subscriptions to all platforms are overridden by internal ones on the same prefix
+            if prefix in subscriptions:
+                subscription = subscriptions[prefix]
+            else:
+                subscription = all_subscriptions.get(prefix)
+            if subscription:
                 subscribers |= subscription
 
         if subscribers:
             # self._logger.debug("PUBSUBSERVICE: found subscribers: {}".format(subscribers))
+            # Serialize the frames after the recipient once per codec. The same
+            # frames are sent to every subscriber, zmq only copies their reference.
+            payloads = {}
             for subscriber in subscribers:
                 frames[0] = subscriber
+                codec = self._peer_codecs.get(subscriber)
+                payload = payloads.get(codec)
+                if payload is None:
+                    payload = payloads[codec] = serialize_frames(frames[1:], codec)
                 try:
                     # Send the message to the subscriber
-                    for sub in self._send(frames, publisher):
+                    for sub in self._send(frames, publisher, payload):
                         # Drop the subscriber if unreachable
                         self.peer_drop(sub)
                 except ZMQError:
@@ -469,10 +581,8 @@ class PubSubService(object):
         success = False
         external_subscribers = set()
         topic = topic
-        for platform_id, subscriptions in self._ext_subscriptions.items():
-            for prefix in subscriptions:
-                if topic.startswith(prefix):
-                    external_subscribers.add(platform_id)
+        for prefix in self._ext_index.match(topic):
+            external_subscribers |= self._ext_platforms[prefix]
         # self._logger.debug("PUBSUBSERVICE External subscriptions {0}, {1}".format(topic, external_subscribers))
         if external_subscribers:
             frames[:] = []
@@ -505,7 +615,7 @@ class PubSubService(object):
                         raise
         return len(external_subscribers)
 
-    def _send(self, frames, publisher):
+    def _send(self, frames, publisher, payload=None):
         """
         Sends the message to the recipient. If the recipient is unreachable, it is dropped from list of peers (and
         associated subscriptions are removed. Any EAGAIN errors are reported back to the publisher.
@@ -513,6 +623,8 @@ class PubSubService(object):
         :type frames list
         :param publisher
         :type bytes
+        :param payload frames after the recipient, already serialized
+        :type list
         :returns: List of dropped recipients, if any
         :rtype: list
 
@@ -529,7 +641,10 @@ class PubSubService(object):
             # Try sending the message to its recipient
             # Because we are sending directly on the socket we need
             # bytes
-            serialized = serialize_frames(frames)
+            if payload is None:
+                serialized = serialize_frames(frames, self._peer_codecs.get(subscriber))
+            else:
+                serialized = serialize_frames([subscriber]) + payload
             self._vip_sock.send_multipart(serialized, flags=NOBLOCK, copy=False)
         except ZMQError as exc:
             try:
@@ -632,6 +747,8 @@ class PubSubService(object):
                 except IndexError:
                     #send response back -- Todo
                     return []
+            elif op == 'publish_many':
+                result = self._peer_publish_many(frames, user_id)
             elif op == 'unsubscribe':
                 result = self._peer_unsubscribe(frames)
             elif op == 'list':
@@ -729,6 +846,17 @@ class PubSubService(object):
             for name in external_platforms:
                 self._ext_router.send_external(name, frames)
 
+    def _compile_external_subscriptions(self):
+        """
+        Rebuild the prefix index of the external subscriptions used to find the platforms to publish to
+        """
+        platforms = defaultdict(set)
+        for platform_id, prefixes in self._ext_subscriptions.items():
+            for prefix in prefixes:
+                platforms[prefix].add(platform_id)
+        self._ext_index = PrefixTrie(platforms)
+        self._ext_platforms = dict(platforms)
+
     def _update_external_subscriptions(self, frames):
         """
         Store external subscriptions
@@ -758,6 +886,7 @@ class PubSubService(object):
                     prefixes = msg[instance_name]
                     # Store external subscription list for later use (during publish)
                     self._ext_subscriptions[instance_name] = prefixes
+                    self._compile_external_subscriptions()
                     self._logger.debug("PUBSUBSERVICE New external list from {0}: List: {1}".
                                        format(instance_name, self._ext_subscriptions))
                     if self._rabbitmq_agent:
@@ -44,7 +44,7 @@ import logging
 import zmq
 from zmq import Frame, NOBLOCK, ZMQError, EINVAL, EHOSTUNREACH
 
-from volttron.utils.frame_serialization import serialize_frames
+from volttron.utils.frame_serialization import negotiate_codec, serialize_frames
 
 __all__ = ['BaseRouter', 'OUTGOING', 'INCOMING', 'UNROUTABLE', 'ERROR']
 
@@ -98,6 +98,8 @@ class BaseRouter(object):
         self._poller = self._poller_class()
         self._ext_sockets = []
         self._socket_id_mapping = {}
+        # Codecs negotiated by the peers in their hello
+        self._codecs = {}
 
     def run(self):
         '''Main router loop.'''
@@ -234,6 +236,7 @@ class BaseRouter(object):
             self._peers.remove(peer)
         except KeyError:
             return
+        self._codecs.pop(peer, None)
         self._distribute(b'peerlist', b'drop', peer)
         self._drop_pubsub_peers(peer)
 
@@ -276,8 +279,18 @@ class BaseRouter(object):
             # Handle requests directed at the router
             name = subsystem
             if name == 'hello':
-                frames = [sender, recipient, proto, user_id, msg_id,
-                          'hello', 'welcome', '1.0', socket.identity, sender]
+                welcome = [sender, recipient, proto, user_id, msg_id,
+                           'hello', 'welcome', '1.0', socket.identity, sender]
+                # Peers may advertise the codecs they support after the
+                # hello. Older peers do not and keep using JSON.
+                if len(frames) > 7 and isinstance(frames[7], list):
+                    codec = negotiate_codec(frames[7])
+                    self._codecs[sender] = codec
+                    welcome.append(codec.name)
+                else:
+                    # A peer reconnecting under the same identity may be an older one
+                    self._codecs.pop(sender, None)
+                frames = welcome
             elif name == 'ping':
                 frames[:7] = [
                     sender, recipient, proto, user_id, msg_id, 'ping', 'pong']
@@ -324,7 +337,7 @@ class BaseRouter(object):
         try:
             # Try sending the message to its recipient
             # This is a zmq socket so we need to serialize it before sending
-            serialized_frames = serialize_frames(frames)
+            serialized_frames = serialize_frames(frames, self._codecs.get(recipient))
             socket.send_multipart(serialized_frames, flags=NOBLOCK, copy=False)
             issue(OUTGOING, serialized_frames)
         except ZMQError as exc:
@@ -342,7 +355,7 @@ class BaseRouter(object):
                 proto, user_id, msg_id, subsystem = frames[2:6]
                 frames = [sender, '', proto, user_id, msg_id,
                           'error', errnum, errmsg, recipient, subsystem]
-                serialized_frames = serialize_frames(frames)
+                serialized_frames = serialize_frames(frames, self._codecs.get(sender))
                 try:
                     socket.send_multipart(serialized_frames, flags=NOBLOCK, copy=False)
                     issue(OUTGOING, serialized_frames)
@@ -339,6 +339,8 @@ class _Socket(object):
         object.__setattr__(self, '_send_state', state)
         object.__setattr__(self, '_recv_state', state)
         object.__setattr__(self, '_Socket__local', self._local_class())
+        # Codec of the list and dict frames, JSON until one is negotiated
+        object.__setattr__(self, '_codec', None)
         self.immediate = True
         # Enable TCP keepalive with idle time of 3 minutes and 6
         # retries spaced 20 seconds apart, for a total of ~5 minutes.
@@ -411,8 +413,23 @@ class _Socket(object):
                 self._send_state = state
                 raise
 
+    @property
+    def codec(self):
+        """The codec negotiated with the router, None if it did not negotiate one."""
+        return self._codec
+
+    def set_codec(self, codec):
+        """Set the codec used to encode the list and dict frames sent.
+
+        :param codec:
+            A :py:class:`volttron.utils.frame_serialization.Codec`, usually
+            the one negotiated with the router in the hello, or None to
+            send JSON frames.
+        """
+        object.__setattr__(self, '_codec', codec)
+
     def send_multipart(self, msg_parts, flags=0, copy=True, track=False):
-        parts = serialize_frames(msg_parts)
+        parts = serialize_frames(msg_parts, self._codec)
         # _log.debug("Sending parts on multiparts: {}".format(parts))
         with self._sending(flags) as flags:
             super(_Socket, self).send_multipart(
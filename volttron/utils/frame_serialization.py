@@ -38,6 +38,7 @@
 
 from json import JSONDecodeError
 import logging
+import math
 from typing import List, Any
 from zmq.sugar.frame import Frame
 import struct
@@ -46,6 +47,162 @@ from volttron.platform import jsonapi
 
 _log = logging.getLogger(__name__)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# First byte of the frames encoded with msgpack. 0xc1 is never used by
+# msgpack and never starts a UTF-8 string, so these frames cannot be taken
+# for the JSON or string frames of other peers.
+MSGPACK_TAG = b'\xc1'
+
+
+class Codec(object):
+    """
+    Encoding of the list and dict frames sent to a peer.
+
+    Codecs are negotiated with the router in the VIP hello. A codec with a
+    tag prefixes its frames with it, so that any frame can be decoded
+    without knowing the codec of the peer that sent it. Frames without a
+    known tag are decoded as JSON, like the frames of older peers.
+    """
+
+    def __init__(self, name, dumpb, loadb, tag=b''):
+        self.name = name
+        self.dumpb = dumpb
+        self.loadb = loadb
+        self.tag = tag
+
+    def __repr__(self):
+        return 'Codec({!r})'.format(self.name)
+
+
+def _json_loads(s):
+    if orjson is not None and s[:1] in ('{', '['):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # NaN, Infinity and integers over 64 bits
+            pass
+    return jsonapi.loads(s)
+
+
+def _orjson_dumpb(data):
+    try:
+        dumped = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME |
+                              orjson.OPT_PASSTHROUGH_DATACLASS)
+    except TypeError:
+        # Integers over 64 bits and types json does not handle
+        return jsonapi.dumpb(data)
+    # orjson writes NaN and Infinity as null, json keeps them. Only look for
+    # them when there is a null at all, None values stay on orjson.
+    if b'null' in dumped and _has_non_finite(data):
+        return jsonapi.dumpb(data)
+    return dumped
+
+
+def _has_non_finite(data):
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(key) or _has_non_finite(value)
+                   for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(value) for value in data)
+    return False
+
+
+def _json_key(key):
+    """
+    Convert a dict key that is not a string like json does.
+    """
+    if isinstance(key, float):
+        if key != key:
+            return 'NaN'
+        if key in (float('inf'), float('-inf')):
+            return 'Infinity' if key > 0 else '-Infinity'
+        return float.__repr__(key)
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def _str_keys(data):
+    """
+    Copy of data with the dict keys converted to strings like json does.
+    """
+    if isinstance(data, dict):
+        return {key if isinstance(key, str) else _json_key(key): _str_keys(value)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_str_keys(value) for value in data]
+    return data
+
+
+def _msgpack_dumpb(data):
+    try:
+        return MSGPACK_TAG + msgpack.packb(_str_keys(data), use_bin_type=True)
+    except (OverflowError, TypeError):
+        # Integers over 64 bits and types msgpack does not handle
+        return jsonapi.dumpb(data)
+
+
+def _msgpack_loadb(data):
+    return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+
+
+JSON_CODEC = Codec('json', jsonapi.dumpb, lambda data: _json_loads(data.decode('utf-8')))
+
+# Available codecs, most preferred first
+CODECS = [JSON_CODEC]
+if msgpack is not None:
+    CODECS.insert(0, Codec('msgpack', _msgpack_dumpb, _msgpack_loadb, MSGPACK_TAG))
+if orjson is not None:
+    # Same wire format as json
+    CODECS.insert(0, Codec('orjson', _orjson_dumpb, JSON_CODEC.loadb))
+
+_TAGGED_CODECS = {codec.tag: codec for codec in CODECS if codec.tag}
+
+
+def get_codec(name):
+    """
+    Return the codec with the given name, the JSON codec if it is not
+    available.
+    """
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+    return JSON_CODEC
+
+
+def negotiate_codec(names):
+    """
+    Pick the preferred codec among the codec names advertised by a peer.
+    """
+    for codec in CODECS:
+        if codec.name in names:
+            return codec
+    return JSON_CODEC
+
+
+def supported_codecs():
+    """
+    Names of the available codecs, most preferred first.
+    """
+    return [codec.name for codec in CODECS]
+
 
 def deserialize_frames(frames: List[Frame]) -> List:
     decoded = []
@@ -65,28 +222,38 @@ def deserialize_frames(frames: List[Frame]) -> List:
             if x == {}:
                 decoded.append(x)
                 continue
+            data = x.bytes
+            codec = _TAGGED_CODECS.get(data[:1])
+            if codec is not None:
+                try:
+                    decoded.append(codec.loadb(data))
+                    continue
+                except Exception:
+                    # Not a tagged frame after all
+                    pass
             try:
-                d = x.bytes.decode('utf-8')
+                d = data.decode('utf-8')
             except UnicodeDecodeError as e:
                 _log.debug(e)
                 decoded.append(x)
                 continue
             try:
-                decoded.append(jsonapi.loads(d))
+                decoded.append(_json_loads(d))
             except JSONDecodeError:
                 decoded.append(d)
     # _log.debug("deserialized: {}".format(decoded))
     return decoded
 
 
-def serialize_frames(data: List[Any]) -> List[Frame]:
+def serialize_frames(data: List[Any], codec: Codec = None) -> List[Frame]:
     frames = []
+    dumpb = codec.dumpb if codec is not None else JSON_CODEC.dumpb
 
     #_log.info("Serializing: {}".format(data))
     for x in data:
         try:
             if isinstance(x, list) or isinstance(x, dict):
-                frames.append(Frame(jsonapi.dumps(x).encode('utf-8')))
+                frames.append(Frame(dumpb(x)))
             elif isinstance(x, Frame):
                 frames.append(x)
             elif isinstance(x, bytes):
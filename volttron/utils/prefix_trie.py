@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+class PrefixTrie(object):
+    """
+    Index of subscription prefixes by topic segment.
+
+    A prefix matches a topic when the topic starts with it, as with
+    ``topic.startswith(prefix)``. All the segments of a prefix but the last
+    must therefore equal the segments of the topic, while the last one only
+    has to start the topic segment at the same depth. Prefixes are stored in
+    a tree of their leading segments with the last segments kept at the node
+    they end on, so a lookup costs the depth of the topic instead of the
+    number of prefixes.
+    """
+
+    __slots__ = ('_children', '_tails', '_size')
+
+    def __init__(self, prefixes=()):
+        # segment -> PrefixTrie of the prefixes continuing with it
+        self._children = {}
+        # last segment -> prefix ending at this node
+        self._tails = {}
+        self._size = 0
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, prefix):
+        node = self
+        segments = prefix.split('/')
+        for segment in segments[:-1]:
+            node = node._children.get(segment)
+            if node is None:
+                return False
+        return segments[-1] in node._tails
+
+    def add(self, prefix):
+        """
+        Add a prefix, no-op if it is already in the trie.
+        """
+        segments = prefix.split('/')
+        path = [self]
+        for segment in segments[:-1]:
+            node = path[-1]._children.get(segment)
+            if node is None:
+                node = path[-1]._children[segment] = PrefixTrie()
+            path.append(node)
+        if segments[-1] not in path[-1]._tails:
+            path[-1]._tails[segments[-1]] = prefix
+            for node in path:
+                node._size += 1
+
+    def remove(self, prefix):
+        """
+        Remove a prefix, no-op if it is not in the trie.
+        """
+        segments = prefix.split('/')
+        path = [self]
+        for segment in segments[:-1]:
+            node = path[-1]._children.get(segment)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1]._tails.pop(segments[-1], None) is None:
+            return
+        for node in path:
+            node._size -= 1
+        # Prune the nodes left without prefixes
+        for parent, segment, node in zip(reversed(path[:-1]),
+                                         reversed(segments[:-1]),
+                                         reversed(path[1:])):
+            if node._size:
+                break
+            del parent._children[segment]
+
+    def match(self, topic):
+        """
+        Return the prefixes the topic starts with.
+        """
+        matched = []
+        node = self
+        for segment in topic.split('/'):
+            tails = node._tails
+            if tails:
+                if len(tails) <= len(segment):
+                    matched.extend(prefix for tail, prefix in tails.items()
+                                   if segment.startswith(tail))
+                else:
+                    for end in range(len(segment) + 1):
+                        prefix = tails.get(segment[:end])
+                        if prefix is not None:
+                            matched.append(prefix)
+            node = node._children.get(segment)
+            if node is None:
+                break
+        return matched
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""
+Benchmark for the historian backup cache.
+
+Feeds the backup cache the records a historian receives from the
+scalability test configuration (1500 devices with 18 points each) and
+reports rows/sec for the per-row and batched sqlite modes and the segment
+log backend. The backlog is then drained the way the process loop does
+after a database outage and the drain rate is reported as well.
+
+Run from the root of the repository with::
+
+    python volttrontesting/benchmarks/bench_backup_database.py --devices 1500 --points 18 --cycles 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from volttron.platform.agent.base_historian import BackupDatabase, SegmentLogBackupDatabase
+
+
+class Owner:
+    pass
+
+
+def make_cycle(timestamp, devices, points):
+    records = []
+    for d in range(devices):
+        headers = {'Date': timestamp.isoformat(),
+                   'TimeStamp': timestamp.isoformat(),
+                   'SynchronizedTimeStamp': timestamp.isoformat(),
+                   'min_compatible_version': '5.0',
+                   'max_compatible_version': ''}
+        for p in range(points):
+            records.append({'source': 'scrape',
+                            'topic': 'campus/building/device{}/point{}'.format(d, p),
+                            'readings': [(timestamp, p * 1.5)],
+                            'meta': {'units': 'F', 'type': 'float', 'tz': 'UTC'},
+                            'headers': headers})
+    return records
+
+
+def open_cache(mode):
+    if mode == "segment_log":
+        return SegmentLogBackupDatabase(Owner(), None, 0.9)
+    return BackupDatabase(Owner(), None, 0.9, batched=(mode == "batched"))
+
+
+def run(mode, devices, points, cycles, submit_size):
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    cycle_data = [make_cycle(start + timedelta(minutes=i), devices, points)
+                  for i in range(cycles)]
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            db = open_cache(mode)
+            # The first cycle registers topics and metadata, do not time it.
+            db.backup_new_data(cycle_data[0])
+
+            rows = 0
+            begin = time.perf_counter()
+            for records in cycle_data[1:]:
+                # The process loop hands the cache whatever has built up in
+                # the queue, mimic that with submit_size sized chunks.
+                for i in range(0, len(records), submit_size):
+                    db.backup_new_data(records[i:i + submit_size])
+                rows += len(records)
+            elapsed = time.perf_counter() - begin
+
+            drained = 0
+            begin = time.perf_counter()
+            while True:
+                batch = db.get_outstanding_to_publish(submit_size)
+                if not batch:
+                    break
+                drained += len(batch)
+                db.remove_successfully_published({None}, submit_size)
+            drain_elapsed = time.perf_counter() - begin
+            db.close()
+        finally:
+            os.chdir(cwd)
+    return rows, elapsed, drained, drain_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1500)
+    parser.add_argument('--points', type=int, default=18)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--submit-size', type=int, default=1000)
+    opts = parser.parse_args()
+
+    for mode in ("per_row", "batched", "segment_log"):
+        rows, elapsed, drained, drain_elapsed = run(mode, opts.devices, opts.points,
+                                                    opts.cycles + 1, opts.submit_size)
+        print("{:>11}: cached {} rows in {:.2f}s, {:.0f} rows/sec; "
+              "drained {} rows in {:.2f}s, {:.0f} rows/sec".format(mode, rows, elapsed, rows / elapsed,
+                                                                   drained, drain_elapsed,
+                                                                   drained / drain_elapsed))
+
+
+if __name__ == '__main__':
+    main()
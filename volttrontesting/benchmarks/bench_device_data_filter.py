@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""
+Micro-benchmark for the historian device_data_filter.
+
+Filters device publishes the way :py:meth:`BaseHistorianAgent._capture_device_data`
+does, once with the filter evaluated from the configuration on every publish
+(the behaviour before the filter was compiled) and once with the compiled,
+per device cache.
+
+Run from the root of the repository with::
+
+    python volttrontesting/benchmarks/bench_device_data_filter.py --devices 1500 --points 18 --filters 200
+"""
+
+import argparse
+import time
+
+from volttron.platform.agent.base_historian import BaseHistorianAgent
+
+
+class FilterAgent:
+    _compile_device_data_filter = BaseHistorianAgent._compile_device_data_filter
+    _filter_device_data = BaseHistorianAgent._filter_device_data
+
+    def __init__(self, device_data_filter):
+        self._device_data_filter = device_data_filter
+        self._device_data_filter_cache = {}
+
+
+def uncompiled_filter(device_data_filter, device, message):
+    msg = [{}, {}]
+    for _filter, point_list in device_data_filter.items():
+        if _filter in device:
+            for point in point_list:
+                if isinstance(message, list):
+                    if point in message[0]:
+                        msg[0][point] = message[0][point]
+                        msg[1][point] = message[1][point]
+                else:
+                    msg = None
+                    if point in device:
+                        msg = message
+                        break
+    if isinstance(msg, list) and not msg[0]:
+        return None
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1500)
+    parser.add_argument('--points', type=int, default=18)
+    parser.add_argument('--filters', type=int, default=200)
+    parser.add_argument('--cycles', type=int, default=5)
+    opts = parser.parse_args()
+
+    devices = ['campus/building{}/device{}'.format(d % 10, d) for d in range(opts.devices)]
+    message = [{'point{}'.format(p): p * 1.5 for p in range(opts.points)},
+               {'point{}'.format(p): {'units': 'F', 'type': 'float'} for p in range(opts.points)}]
+    # Keep half the points of every filtered device.
+    device_data_filter = {'device{}'.format(d): ['point{}'.format(p) for p in range(0, opts.points, 2)]
+                          for d in range(opts.filters)}
+
+    begin = time.perf_counter()
+    for _ in range(opts.cycles):
+        for device in devices:
+            uncompiled_filter(device_data_filter, device, message)
+    uncompiled = time.perf_counter() - begin
+
+    agent = FilterAgent(device_data_filter)
+    begin = time.perf_counter()
+    for _ in range(opts.cycles):
+        for device in devices:
+            agent._filter_device_data(device, message)
+    compiled = time.perf_counter() - begin
+
+    publishes = opts.cycles * len(devices)
+    print("uncompiled: {:.0f} publishes/sec".format(publishes / uncompiled))
+    print("  compiled: {:.0f} publishes/sec ({:.1f}x)".format(publishes / compiled, uncompiled / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+"""
+Micro-benchmark for the codecs of the VIP frames.
+
+Serializes and deserializes the frames of a ``devices/.../all`` publish with
+every available codec (json, and orjson and msgpack when they are
+installed), the way the agents and the router do for each message.
+
+Run from the root of the repository with::
+
+    python volttrontesting/benchmarks/bench_frame_codecs.py --points 50
+"""
+
+import argparse
+import time
+
+from volttron.utils.frame_serialization import CODECS, deserialize_frames, serialize_frames
+
+
+def publish_frames(points):
+    message = [{'point{}'.format(p): p * 1.5 + 0.123456 for p in range(points)},
+               {'point{}'.format(p): {'units': 'F', 'type': 'float', 'tz': 'US/Pacific'}
+                for p in range(points)}]
+    headers = {'Date': '2020-01-01T00:00:00.000000+00:00', 'max_compatible_version': '',
+               'min_compatible_version': '3.0', 'SynchronizedTimeStamp': '2020-01-01T00:00:00.000000+00:00'}
+    return ['publish', 'devices/campus/building/device/all',
+            {'bus': '', 'headers': headers, 'message': message}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=5000)
+    opts = parser.parse_args()
+
+    frames = publish_frames(opts.points)
+    for codec in CODECS:
+        begin = time.perf_counter()
+        for _ in range(opts.messages):
+            serialized = serialize_frames(frames, codec)
+        encode = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        for _ in range(opts.messages):
+            deserialize_frames(serialized)
+        decode = time.perf_counter() - begin
+
+        print("{:>8}: encode {:.0f} msgs/sec, decode {:.0f} msgs/sec, {} bytes".format(
+            codec.name, opts.messages / encode, opts.messages / decode, len(serialized[-1].bytes)))
+
+
+if __name__ == '__main__':
+    main()
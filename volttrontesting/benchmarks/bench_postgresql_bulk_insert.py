@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""
+Benchmark for bulk inserts of the PostgreSQL historian driver.
+
+Inserts batches of 10k to 100k records into a local PostgreSQL database and
+reports records/sec for the COPY based bulk_insert of the driver and for the
+single INSERT ... VALUES statement it used to build, once into empty tables
+and once again over the same rows to measure the ON CONFLICT updates. The
+tables are created with a unique prefix and dropped afterwards.
+
+Requires psycopg2 and a database the user can create tables in. Run from the
+root of the repository with::
+
+    python volttrontesting/benchmarks/bench_postgresql_bulk_insert.py --dbname historian_test --port 5432
+
+Pass --timescale to make the data table a TimescaleDB hypertable.
+"""
+
+import argparse
+import contextlib
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+from psycopg2.sql import Identifier, Literal, SQL
+
+from volttron.platform import jsonapi
+from volttron.platform.dbutils.postgresqlfuncts import PostgreSqlFuncts
+
+
+@contextlib.contextmanager
+def values_insert(driver):
+    """The single INSERT ... VALUES statement bulk_insert used to build."""
+    records = []
+
+    def insert_data(ts, topic_id, data):
+        value = jsonapi.dumps(data)
+        records.append(SQL('({}, {}, {})').format(Literal(ts), Literal(topic_id), Literal(value)))
+        return True
+
+    yield insert_data
+
+    if records:
+        query = SQL('INSERT INTO {} VALUES {} '
+                    'ON CONFLICT (ts, topic_id) DO UPDATE '
+                    'SET value_string = EXCLUDED.value_string').format(
+                        Identifier(driver.data_table), SQL(', ').join(records))
+        driver.execute_stmt(query)
+
+
+def make_batch(start, size, topics):
+    # a device publish with all its points at the same timestamp
+    return [(start + timedelta(minutes=i // topics), i % topics + 1, i * 0.5)
+            for i in range(size)]
+
+
+def run(driver, method, batch):
+    bulk_insert = driver.bulk_insert if method == "copy" else lambda: values_insert(driver)
+    begin = time.perf_counter()
+    with bulk_insert() as insert_data:
+        for ts, topic_id, value in batch:
+            insert_data(ts, topic_id, value)
+    driver.commit()
+    return time.perf_counter() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dbname', default='historian_test')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='historian')
+    parser.add_argument('--password', default='volttron')
+    parser.add_argument('--timescale', action='store_true')
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 25000, 50000, 100000])
+    opts = parser.parse_args()
+
+    params = {'dbname': opts.dbname, 'host': opts.host, 'port': opts.port,
+              'user': opts.user, 'password': opts.password,
+              'timescale_dialect': opts.timescale}
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    for method in ("values", "copy"):
+        for size in opts.sizes:
+            prefix = 'bench_' + uuid.uuid4().hex[:8] + '_'
+            table_names = {'data_table': prefix + 'data',
+                           'topics_table': prefix + 'topics',
+                           'meta_table': prefix + 'meta'}
+            driver = PostgreSqlFuncts(params, table_names)
+            try:
+                driver.setup_historian_tables()
+                batch = make_batch(start, size, opts.topics)
+                inserted = run(driver, method, batch)
+                updated = run(driver, method, batch)
+                print("{:>6} {:>6} records: insert {:.2f}s, {:.0f} records/sec; "
+                      "update {:.2f}s, {:.0f} records/sec".format(method, size, inserted, size / inserted,
+                                                                 updated, size / updated))
+            finally:
+                for table in table_names.values():
+                    driver.execute_stmt(SQL('DROP TABLE IF EXISTS {} CASCADE').format(Identifier(table)))
+                driver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+"""
+Micro-benchmark for the router side fan-out of publishes.
+
+Distributes a device publish to a growing number of subscribers the way
+:py:meth:`PubSubService._distribute_internal` does, once serializing all the
+frames for every subscriber (the behaviour before the payload was shared)
+and once with the payload frames serialized a single time per publish.
+The socket only collects the frames, so the numbers are the router's own cost.
+
+Run from the root of the repository with::
+
+    python volttrontesting/benchmarks/bench_router_pubsub.py --points 50 --subscribers 1 4 12 32
+"""
+
+import argparse
+import time
+
+from volttron.platform.vip.pubsubservice import PubSubService
+
+
+class CollectingSocket:
+    def __init__(self):
+        self.sent = 0
+
+    def send_multipart(self, frames, flags=0, copy=True):
+        self.sent += len(frames)
+
+
+def publish_frames(points):
+    message = [{'point{}'.format(p): p * 1.5 for p in range(points)},
+               {'point{}'.format(p): {'units': 'F', 'type': 'float', 'tz': 'US/Pacific'}
+                for p in range(points)}]
+    headers = {'Date': '2020-01-01T00:00:00.000000+00:00', 'max_compatible_version': '',
+               'min_compatible_version': '3.0', 'SynchronizedTimeStamp': '2020-01-01T00:00:00.000000+00:00'}
+    return ['platform.driver', '', 'VIP1', 'platform.driver', '1', 'pubsub', 'publish',
+            'devices/campus/building/device/all',
+            {'bus': '', 'headers': headers, 'message': message, 'sender': 'platform.driver'}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=50)
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 4, 12, 32])
+    parser.add_argument('--publishes', type=int, default=2000)
+    opts = parser.parse_args()
+
+    for count in opts.subscribers:
+        socket = CollectingSocket()
+        service = PubSubService(socket, {}, None)
+        subscribers = ['subscriber{}'.format(s) for s in range(count)]
+        for subscriber in subscribers:
+            service._add_peer_subscription(subscriber, '', 'devices')
+
+        begin = time.perf_counter()
+        for _ in range(opts.publishes):
+            frames = publish_frames(opts.points)
+            for subscriber in subscribers:
+                frames[0] = subscriber
+                service._send(frames, 'platform.driver')
+        per_subscriber = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        for _ in range(opts.publishes):
+            service._distribute_internal(publish_frames(opts.points))
+        shared = time.perf_counter() - begin
+
+        print("{:3d} subscribers: per subscriber {:.0f} publishes/sec, "
+              "shared payload {:.0f} publishes/sec ({:.1f}x)".format(count, opts.publishes / per_subscriber,
+                                                                     opts.publishes / shared,
+                                                                     per_subscriber / shared))
+
+
+if __name__ == '__main__':
+    main()
@@ -161,6 +161,72 @@ def test_insert_data_query_should_succeed(get_container_func, ports_config):
             assert get_data_in_table(port_on_host, 'data') == expected_data
 
 
+@pytest.mark.mysqlfuncts
+def test_bulk_insert_should_succeed(get_container_func, ports_config):
+    get_container, image = get_container_func
+    with get_container(image, ports=ports_config["ports"], env=ENV_MYSQL) as container:
+        wait_for_connection(container)
+        create_historian_tables(container)
+
+        port_on_host = ports_config["port_on_host"]
+        with get_mysqlfuncts(port_on_host) as mysqlfuncts:
+            start = datetime.datetime(2001, 9, 11, 8, 46)
+            expected_data = []
+            with mysqlfuncts.bulk_insert() as insert_data:
+                for second in range(2500):
+                    ts = start + datetime.timedelta(seconds=second)
+                    assert insert_data(ts, 11, second) is True
+                    expected_data.append((ts, 11, str(second)))
+                # updates the first row
+                insert_data(start, 11, "last")
+                expected_data[0] = (start, 11, '"last"')
+
+            assert sorted(get_data_in_table(port_on_host, 'data')) == expected_data
+
+
+@pytest.mark.mysqlfuncts
+def test_bulk_insert_should_skip_bad_rows(get_container_func, ports_config):
+    get_container, image = get_container_func
+    with get_container(image, ports=ports_config["ports"], env=ENV_MYSQL) as container:
+        wait_for_connection(container)
+        create_historian_tables(container)
+
+        port_on_host = ports_config["port_on_host"]
+        with get_mysqlfuncts(port_on_host) as mysqlfuncts:
+            ts = datetime.datetime(2001, 9, 11, 8, 46)
+            with mysqlfuncts.bulk_insert() as insert_data:
+                insert_data(ts, 11, "1wtc")
+                insert_data("not a timestamp", 11, "bad")
+                insert_data(ts, 12, "2wtc")
+
+            assert sorted(get_data_in_table(port_on_host, 'data')) == [(ts, 11, '"1wtc"'), (ts, 12, '"2wtc"')]
+
+
+@pytest.mark.mysqlfuncts
+def test_bulk_insert_should_raise_when_no_row_is_inserted(get_container_func, ports_config):
+    get_container, image = get_container_func
+    with get_container(image, ports=ports_config["ports"], env=ENV_MYSQL) as container:
+        wait_for_connection(container)
+        create_historian_tables(container)
+
+        port_on_host = ports_config["port_on_host"]
+        with get_mysqlfuncts(port_on_host) as mysqlfuncts:
+            # every row is bad, the batch must stay in the backup cache
+            with pytest.raises(mysql.connector.errors.DataError):
+                with mysqlfuncts.bulk_insert() as insert_data:
+                    insert_data("not a timestamp", 11, "bad")
+                    insert_data("not a timestamp either", 12, "bad")
+
+            # errors that are not about the values of a row are not retried
+            # one row at a time
+            mysqlfuncts.data_table = 'missing'
+            with pytest.raises(mysql.connector.errors.ProgrammingError):
+                with mysqlfuncts.bulk_insert() as insert_data:
+                    insert_data(datetime.datetime(2001, 9, 11, 8, 46), 11, "1wtc")
+
+            assert get_data_in_table(port_on_host, 'data') == []
+
+
 @pytest.mark.mysqlfuncts
 def test_insert_topic_query_should_succeed(get_container_func, ports_config):
     get_container, image = get_container_func
@@ -416,6 +482,31 @@ def test_collect_aggregate_should_return_aggregate_result(get_container_func, po
             assert actual_aggregate == expected_aggregate
 
 
+@pytest.mark.mysqlfuncts
+def test_collect_aggregates_should_return_aggregate_per_point(get_container_func, ports_config):
+    get_container, image = get_container_func
+    with get_container(image, ports=ports_config["ports"], env=ENV_MYSQL) as container:
+        wait_for_connection(container)
+        create_all_tables(container)
+
+        port_on_host = ports_config["port_on_host"]
+        with get_mysqlfuncts(port_on_host) as mysqlfuncts:
+            query = f"""
+                        REPLACE INTO {DATA_TABLE}
+                        VALUES ('2020-06-01 12:30:59', 42, '2');
+                        REPLACE INTO {DATA_TABLE}
+                        VALUES ('2020-06-01 12:31:59', 43, '8')
+                    """
+            seed_database(container, query)
+
+            topic_ids_list = [[42, 43], [43], [44]]
+            expected_aggregates = [(5.0, 2), (8.0, 1), (None, 0)]
+
+            actual_aggregates = mysqlfuncts.collect_aggregates(topic_ids_list, "avg")
+
+            assert actual_aggregates == expected_aggregates
+
+
 @pytest.mark.mysqlfuncts
 def test_collect_aggregate_should_raise_value_error(get_container_func, ports_config):
     get_container, image = get_container_func
@@ -680,6 +680,39 @@ def test_collect_aggregate_stmt_should_return_rows(get_container_func, ports_con
             assert actual_aggregate == expected_aggregate
 
 
+@pytest.mark.postgresqlfuncts
+@pytest.mark.dbutils
+def test_collect_aggregates_should_return_aggregate_per_point(
+    get_container_func, ports_config
+):
+    get_container, image = get_container_func
+
+    with get_container(
+        image, ports=ports_config["ports"], env=ENV_POSTGRESQL
+    ) as container:
+        port_on_host = ports_config["port_on_host"]
+        wait_for_connection(container, port_on_host)
+        create_all_tables(container)
+
+        with get_postgresqlfuncts(port_on_host) as postgresqlfuncts:
+            query = f"""
+                        INSERT INTO {DATA_TABLE}
+                        VALUES ('2020-06-01 12:30:59', 42, '2');
+                        INSERT INTO {DATA_TABLE}
+                        VALUES ('2020-06-01 12:31:59', 43, '8')
+                    """
+            seed_database(container, query)
+
+            topic_ids_list = [[42, 43], [43], [44]]
+            expected_aggregates = [(5.0, 2), (8.0, 1), (None, 0)]
+
+            actual_aggregates = postgresqlfuncts.collect_aggregates(
+                topic_ids_list, "avg"
+            )
+
+            assert actual_aggregates == expected_aggregates
+
+
 @pytest.mark.postgresqlfuncts
 @pytest.mark.dbutils
 def test_collect_aggregate_stmt_should_raise_value_error(
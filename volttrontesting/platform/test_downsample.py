@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from volttron.platform.agent import downsample
+from volttron.platform.agent.downsample import (downsample_values,
+                                                validate_downsample)
+from volttron.platform.agent.utils import format_timestamp
+
+START = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+
+
+def series(values):
+    return [(format_timestamp(START + timedelta(seconds=second)), value)
+            for second, value in enumerate(values)]
+
+
+@pytest.mark.historian
+def test_validate_downsample():
+    assert validate_downsample({'method': 'lttb', 'points': 10}) == \
+        ('lttb', 10)
+    for invalid in [None, {'method': 'median', 'points': 10},
+                    {'method': 'bucket_avg', 'points': 0},
+                    {'method': 'bucket_avg', 'points': '10'},
+                    {'method': 'min_max', 'points': 1}]:
+        with pytest.raises(ValueError):
+            validate_downsample(invalid)
+
+
+@pytest.mark.historian
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_downsample_methods(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(downsample, 'HAS_NUMPY', use_numpy)
+    values = series([0, 2, 'on', 4, 6, 1, 9, 3, 5])
+    end = START + timedelta(seconds=9)
+
+    assert downsample_values(values, 'bucket_avg', 3, START, end) == [
+        (values[0][0], 1.0), (values[3][0], 11 / 3), (values[6][0], 17 / 3)]
+    assert downsample_values(values, 'min_max', 4, START, end) == [
+        values[0], values[4], values[5], values[6]]
+    assert downsample_values(values, 'lttb', 4) == [
+        values[0], values[4], values[5], values[8]]
+    # values are downsampled in time order and returned in the query order
+    assert downsample_values(values[::-1], 'min_max', 4, START, end,
+                             order='LAST_TO_FIRST') == \
+        [values[6], values[5], values[4], values[0]]
+    # short results are returned as they are, less the non numeric values
+    assert downsample_values(values[:3], 'lttb', 4) == values[:2]
+
+
+@pytest.mark.historian
+def test_downsample_numpy_matches_python(monkeypatch):
+    pytest.importorskip('numpy')
+    random.seed(4)
+    values = {'a': series([random.random() for _ in range(2000)]),
+              'b': series([random.randint(0, 5) for _ in range(500)])}
+    for method in downsample.DOWNSAMPLE_METHODS:
+        results = []
+        for use_numpy in [True, False]:
+            monkeypatch.setattr(downsample, 'HAS_NUMPY', use_numpy)
+            results.append(downsample_values(values, method, 100))
+        assert results[0]['a'] == pytest.approx(results[1]['a'])
+        assert results[0]['b'] == pytest.approx(results[1]['b'])
+        assert len(results[0]['a']) <= 100
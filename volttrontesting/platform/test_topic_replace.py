@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import random
+import re
+
+import pytest
+
+from volttron.platform.agent.topic_replace import TopicReplacer
+
+
+def legacy_replace(replace_list, input_topic):
+    """Topic replacement as BaseHistorianAgent.get_renamed_topic did it."""
+    input_topic_lower = input_topic.lower()
+    new_topic = input_topic
+    for x in replace_list:
+        if x['from'].lower() in input_topic_lower:
+            new_topic = re.compile(re.escape(x['from']), re.IGNORECASE).sub(x['to'], new_topic)
+    return new_topic
+
+
+@pytest.mark.historian
+def test_independent_rules_use_one_pass():
+    replace_list = [{'from': 'PNNL/BUILDING_1', 'to': 'PNNL/BUILDING1'},
+                    {'from': 'Sensor', 'to': 'Meter'}]
+    replacer = TopicReplacer.from_replace_list(replace_list)
+    assert replacer._pattern is not None
+    topic = 'pnnl/building_1/sensor/SENSOR'
+    assert replacer.replace(topic) == 'PNNL/BUILDING1/Meter/Meter'
+    assert replacer.replace(topic) == legacy_replace(replace_list, topic)
+
+
+@pytest.mark.historian
+def test_chained_rules_are_applied_in_order():
+    # The second rule matches the output of the first one.
+    replace_list = [{'from': 'a', 'to': 'bb'}, {'from': 'b', 'to': 'c'}]
+    replacer = TopicReplacer.from_replace_list(replace_list)
+    assert replacer._pattern is None
+    assert replacer.replace('ab') == legacy_replace(replace_list, 'ab') == 'ccc'
+    # The second rule only applies when found in the original topic.
+    assert replacer.replace('a') == legacy_replace(replace_list, 'a') == 'bb'
+
+
+@pytest.mark.historian
+def test_matches_legacy_replacement():
+    random.seed(3)
+    alphabet = 'aAbB/_c'
+    for _ in range(300):
+        replace_list = [{'from': ''.join(random.choice(alphabet) for _ in range(random.randint(1, 3))),
+                         'to': ''.join(random.choice(alphabet) for _ in range(random.randint(0, 3)))}
+                        for _ in range(random.randint(1, 4))]
+        replacer = TopicReplacer.from_replace_list(replace_list)
+        for _ in range(10):
+            topic = ''.join(random.choice(alphabet) for _ in range(random.randint(0, 12)))
+            replacer.clear_cache()
+            assert replacer.replace(topic) == legacy_replace(replace_list, topic), replace_list
+
+
+@pytest.mark.historian
+def test_cache_is_bounded():
+    replacer = TopicReplacer([('a', 'b')], cache_size=2)
+    assert replacer.replace('A1') == 'b1'
+    # Cached by lower cased topic.
+    assert replacer.replace('a1') == 'b1'
+    replacer.replace('a2')
+    replacer.replace('a3')
+    assert replacer.cache_info() == {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+    assert not TopicReplacer() and TopicReplacer().replace('Topic') == 'Topic'
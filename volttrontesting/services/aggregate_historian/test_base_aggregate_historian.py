@@ -1,5 +1,9 @@
+import json
+
+import mock
 import pytz
-from volttron.platform.agent.base_aggregate_historian import AggregateHistorian
+from volttron.platform.agent.base_aggregate_historian import (
+    AggregateHistorian, AggregateState, STREAMING_AGGREGATIONS)
 import pytest
 from datetime import datetime, timedelta
 
@@ -191,3 +195,279 @@ def test_compute_next_collection_time():
     assert next2 == datetime.strptime(
         '2016-04-30T01:15:23.123456',
         '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=pytz.utc)
+
+
+@pytest.mark.aggregator
+def test_aggregate_state():
+    '''
+    Test if the running state of a streamed aggregation period computes the
+    same aggregates as the data store and can be merged and checkpointed
+    '''
+    start = datetime(2016, 3, 1, 1, tzinfo=pytz.utc)
+    state = AggregateState()
+    assert state.value('count') == 0
+    assert state.value('avg') is None
+    for i, value in enumerate([3, 1.5, 4, 2]):
+        state.update(start + timedelta(minutes=i), value)
+    assert state.value('sum') == 10.5
+    assert state.value('total') == 10.5
+    assert state.value('avg') == 2.625
+    assert state.value('min') == 1.5
+    assert state.value('max') == 4
+    assert state.value('first') == 3
+    assert state.value('last') == 2
+
+    other = AggregateState()
+    other.update(start - timedelta(minutes=1), 7)
+    state.merge(other)
+    assert state.value('count') == 5
+    assert state.value('max') == 7
+    assert state.value('first') == 7
+    assert state.value('last') == 2
+
+    restored = AggregateState.from_dict(
+        json.loads(json.dumps(state.to_dict())))
+    for agg_type in STREAMING_AGGREGATIONS + ('first', 'last'):
+        assert restored.value(agg_type) == state.value(agg_type)
+    with pytest.raises(ValueError):
+        state.value('stddev')
+
+
+class StreamingAggregateHistorian(AggregateHistorian):
+    '''
+    Aggregate historian over an in memory list of (timestamp, topic_id,
+    value) records
+    '''
+    def __init__(self, records, checkpoint_path):
+        # Skip Agent initialization, only the streaming state is tested
+        self.core = mock.MagicMock()
+        self.records = records
+        self.aggregates = []
+        self.queries = []
+        self.topic_id_map = {'device1/in_temp': 1, 'device1/out_temp': 2}
+        self.agg_topic_id_map = {('device1/in_temp', 'avg', '1h'): 10,
+                                 ('device1/in_temp', 'stddev', '1h'): 11}
+        self._streaming = False
+        self._stream_started = None
+        self._stream_subscribed = True
+        self._streams = {}
+        self._stream_names = {}
+        self._buckets = {}
+        self._device_topics = set()
+        self._checkpoint_event = None
+        self._pattern_topics = {}
+        self._topic_count = len(self.topic_id_map)
+        self._collection_pool = None
+        self._collection_stats = {}
+        self.config = {'streaming': True,
+                       'streaming_checkpoint_interval': 0,
+                       'streaming_checkpoint_file': checkpoint_path}
+
+    def start(self, collection_time, points):
+        self._configure_streaming(self.config)
+        for data in points:
+            data['topic_ids'] = [self.topic_id_map[name.lower()]
+                                 for name in data['topic_names']]
+            data['aggregation_topic_name'] = data['topic_names'][0]
+        self._init_agg_group_streams(points, '1h', True, collection_time)
+        self.collect_aggregate_data(collection_time, '1h', True, points)
+        self._close_restored_buckets()
+
+    def get_topic_map(self):
+        return self.topic_id_map, {}
+
+    def get_agg_topic_map(self):
+        return self.agg_topic_id_map
+
+    def get_aggregation_list(self):
+        return ['AVG', 'MIN', 'MAX', 'COUNT', 'SUM', 'STDDEV']
+
+    def initialize_aggregate_store(self, aggregation_topic_name, agg_type,
+                                   agg_time_period, topics_meta):
+        pass
+
+    def update_aggregate_metadata(self, agg_id, aggregation_topic_name,
+                                  topic_meta):
+        pass
+
+    def collect_aggregate(self, topic_ids, agg_type, start_time, end_time):
+        self.queries.append((agg_type, start_time, end_time))
+        values = [value for ts, topic_id, value in self.records
+                  if topic_id in topic_ids and start_time <= ts < end_time]
+        state = AggregateState()
+        for value in values:
+            state.update(start_time, value)
+        if agg_type == 'stddev':
+            return 0.0, state.count
+        return state.value(agg_type), state.count
+
+    def insert_aggregate(self, agg_topic_id, agg_type, agg_time_period,
+                         end_time, value, topic_ids):
+        self.aggregates.append((agg_topic_id, end_time, value))
+
+
+@pytest.mark.aggregator
+def test_streaming_aggregation(tmpdir):
+    '''
+    Test if streamed points are aggregated from the published values,
+    the data store is only queried for the part of the period before the
+    agent started and the running state survives a restart
+    '''
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    hour = datetime(2016, 3, 1, 10, tzinfo=pytz.utc)
+    # Data stored before the agent started streaming
+    records = [(hour + timedelta(minutes=5), 1, 10.0),
+               (hour + timedelta(minutes=10), 1, 20.0)]
+    points = [{'topic_names': ['device1/in_temp'],
+               'aggregation_type': 'avg', 'min_count': 2},
+              {'topic_names': ['device1/in_temp'],
+               'aggregation_type': 'stddev', 'min_count': 2}]
+
+    def publish(agg, minutes, value):
+        ts = hour + timedelta(minutes=minutes)
+        records.append((ts, 1, value))
+        agg._capture_stream_data(
+            'pubsub', 'driver', None, 'devices/device1/all',
+            {'Date': ts.isoformat()},
+            [{'in_temp': value, 'out_temp': 100.0, 'status': 'ok'}, {}])
+
+    with mock.patch('volttron.platform.agent.base_aggregate_historian.'
+                    'utils.get_aware_utc_now',
+                    return_value=hour + timedelta(minutes=15)):
+        agg = StreamingAggregateHistorian(records, checkpoint)
+        agg.start(hour + timedelta(minutes=15), points)
+    # The previous hour is aggregated from the data store
+    assert agg.aggregates == []
+    assert 10 in agg._streams and 11 not in agg._streams
+
+    publish(agg, 20, 30.0)
+    publish(agg, 30, 40.0)
+    # Published before the agent started, the data store has it
+    publish(agg, 14, 1000.0)
+    records.pop()
+    # Next period
+    publish(agg, 70, 5.0)
+    with mock.patch('volttron.platform.agent.base_aggregate_historian.'
+                    'utils.get_aware_utc_now',
+                    return_value=hour + timedelta(minutes=35)):
+        agg._save_checkpoint()
+
+    # Restart, with a value stored while the agent was not running
+    records.append((hour + timedelta(minutes=40), 1, 50.0))
+    with mock.patch('volttron.platform.agent.base_aggregate_historian.'
+                    'utils.get_aware_utc_now',
+                    return_value=hour + timedelta(minutes=45)):
+        agg = StreamingAggregateHistorian(records, checkpoint)
+        agg.start(hour + timedelta(minutes=45), points)
+    assert len(agg._buckets) == 2
+    publish(agg, 50, 60.0)
+
+    del agg.queries[:]
+    agg.collect_aggregate_data(hour + timedelta(hours=1), '1h', True, points)
+    assert agg.aggregates == [(10, hour + timedelta(hours=1), 35.0),
+                              (11, hour + timedelta(hours=1), 0.0)]
+    # Only the gaps before each start are queried for the streamed point
+    assert ('sum', hour, hour + timedelta(minutes=15)) in agg.queries
+    assert len([q for q in agg.queries if q[0] == 'sum']) == 2
+    assert list(agg._buckets) == [(10, hour + timedelta(hours=1),
+                                   hour + timedelta(hours=2))]
+
+
+@pytest.mark.aggregator
+def test_streaming_only_device_topics(tmpdir):
+    '''
+    Test if the streamed device topics are renamed like the historian does
+    and if points with topics not published on the devices topics are
+    computed from the data store
+    '''
+    hour = datetime(2016, 3, 1, 10, tzinfo=pytz.utc)
+    records = [(hour + timedelta(minutes=20), 2, 7.0)]
+    agg = StreamingAggregateHistorian(
+        records, str(tmpdir.join('checkpoint.json')))
+    agg.topic_id_map = {'building1/in_temp': 1,
+                        'analysis/building1/score': 2}
+    agg.agg_topic_id_map = {('building1/in_temp', 'avg', '1h'): 10,
+                            ('analysis/building1/score', 'avg', '1h'): 11}
+    agg.config['topic_replace_list'] = [{'from': 'device1',
+                                         'to': 'building1'}]
+    points = [{'topic_names': ['building1/in_temp'],
+               'aggregation_type': 'avg'},
+              {'topic_names': ['analysis/building1/score'],
+               'aggregation_type': 'avg'}]
+    with mock.patch('volttron.platform.agent.base_aggregate_historian.'
+                    'utils.get_aware_utc_now', return_value=hour):
+        agg.start(hour, points)
+    assert 10 in agg._streams and 11 in agg._streams
+
+    for minutes, value in ((10, 1.0), (30, 3.0)):
+        ts = hour + timedelta(minutes=minutes)
+        agg._capture_stream_data(
+            'pubsub', 'driver', None, 'devices/device1/all',
+            {'Date': ts.isoformat()}, [{'in_temp': value}, {}])
+
+    del agg.queries[:]
+    agg.collect_aggregate_data(hour + timedelta(hours=1), '1h', True, points)
+    assert agg.aggregates == [(10, hour + timedelta(hours=1), 2.0),
+                              (11, hour + timedelta(hours=1), 7.0)]
+    assert agg.queries == [('avg', hour, hour + timedelta(hours=1))]
+    assert not agg._buckets
+
+
+@pytest.mark.aggregator
+def test_collection_cycle():
+    '''
+    Test if topic name patterns are resolved once until new topics are
+    added, if the aggregates of each type are collected together and if the
+    duration of the cycle is reported
+    '''
+    hour = datetime(2016, 3, 1, 10, tzinfo=pytz.utc)
+    records = [(hour + timedelta(minutes=5), 1, 10.0),
+               (hour + timedelta(minutes=5), 2, 20.0),
+               (hour + timedelta(minutes=10), 3, 30.0)]
+    agg = StreamingAggregateHistorian(records, None)
+    agg.topic_id_map['device2/in_temp'] = 3
+    agg.agg_topic_id_map = {('device1/in_temp', 'sum', '1h'): 10,
+                            ('device1/out_temp', 'sum', '1h'): 11,
+                            ('in_temps', 'max', '1h'): 12}
+    agg.vip = mock.MagicMock()
+    agg.vip.rpc.call.return_value.get.side_effect = lambda: {
+        name: topic_id for name, topic_id in agg.topic_id_map.items()
+        if name.endswith('in_temp')}
+    agg.collect_aggregates = mock.MagicMock(
+        side_effect=lambda topic_ids_list, agg_type, start, end: [
+            agg.collect_aggregate(topic_ids, agg_type, start, end)
+            for topic_ids in topic_ids_list])
+    points = [{'topic_names': ['device1/in_temp'], 'topic_ids': [1],
+               'aggregation_topic_name': 'device1/in_temp',
+               'aggregation_type': 'sum'},
+              {'topic_names': ['device1/out_temp'], 'topic_ids': [2],
+               'aggregation_topic_name': 'device1/out_temp',
+               'aggregation_type': 'sum'},
+              {'topic_name_pattern': 'in_temp$',
+               'aggregation_topic_name': 'in_temps',
+               'aggregation_type': 'max'}]
+
+    agg.collect_aggregate_data(hour + timedelta(hours=1), '1h', False, points)
+    assert agg.aggregates == [(10, hour + timedelta(hours=1), 10.0),
+                              (11, hour + timedelta(hours=1), 20.0),
+                              (12, hour + timedelta(hours=1), 30.0)]
+    assert [c[0][1] for c in agg.collect_aggregates.call_args_list] == \
+        ['sum', 'max']
+    assert agg.vip.rpc.call.call_count == 1
+    stats = agg.get_collection_stats()['1h']
+    assert stats['points'] == 3
+    assert stats['end_time'] == '2016-03-01T11:00:00.000000+00:00'
+    assert stats['duration'] >= 0
+
+    agg.collect_aggregate_data(hour + timedelta(hours=2), '1h', False, points)
+    assert agg.vip.rpc.call.call_count == 1
+    # A new topic invalidates the cached patterns, the topic map is only
+    # loaded again then
+    topics = dict(agg.topic_id_map, **{'device3/in_temp': 4})
+    agg.get_topic_count = lambda: len(topics)
+    agg.get_topic_map = mock.MagicMock(return_value=(topics, {}))
+    agg.collect_aggregate_data(hour + timedelta(hours=3), '1h', False, points)
+    assert agg.vip.rpc.call.call_count == 2
+    agg.collect_aggregate_data(hour + timedelta(hours=4), '1h', False, points)
+    assert agg.vip.rpc.call.call_count == 2
+    assert agg.get_topic_map.call_count == 1
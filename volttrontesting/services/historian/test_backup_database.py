@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from volttron.platform.agent.base_historian import (BackupDatabase,
+                                                    BaseHistorianAgent,
+                                                    SegmentLogBackupDatabase,
+                                                    expand_device_frames)
+
+
+class Owner:
+    pass
+
+
+def device_publish(timestamp, device, points, source='scrape'):
+    headers = {'Date': timestamp.isoformat()}
+    return [{'source': source,
+             'topic': device + '/' + point,
+             'readings': [(timestamp, value)],
+             'meta': {'units': 'F', 'type': 'float'},
+             'headers': headers}
+            for point, value in points.items()]
+
+
+@pytest.fixture(params=[False, True], ids=["per_row", "batched"])
+def backupdb(request, tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    owner = Owner()
+    db = BackupDatabase(owner, None, 0.9, batched=request.param)
+    yield db
+    db.close()
+
+
+@pytest.mark.historian
+def test_backup_and_publish_round_trip(backupdb):
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    records = []
+    for minute in range(3):
+        records.extend(device_publish(start + timedelta(minutes=minute),
+                                      'campus/building/device',
+                                      {'p1': minute, 'p2': minute * 1.5}))
+
+    assert not backupdb.backup_new_data(records)
+    assert backupdb.get_backlog_count() == 6
+
+    to_publish = backupdb.get_outstanding_to_publish(4)
+    assert len(to_publish) == 4
+    assert to_publish[0]['topic'] == 'campus/building/device/p1'
+    assert to_publish[0]['timestamp'] == start
+    assert to_publish[0]['headers'] == {'Date': start.isoformat()}
+    assert to_publish[0]['meta'] == {'units': 'F', 'type': 'float'}
+    assert [r['value'] for r in to_publish] == [0, 0, 1, 1.5]
+    assert [r['value'] for r in backupdb.get_outstanding_to_publish(4, 4)] == [2, 3.0]
+
+    backupdb.remove_successfully_published({None}, 4)
+    remaining = backupdb.get_outstanding_to_publish(10)
+    assert [r['value'] for r in remaining] == [2, 3.0]
+
+    backupdb.remove_successfully_published({r['_id'] for r in remaining}, 10)
+    assert backupdb.get_outstanding_to_publish(10) == []
+    assert backupdb.get_backlog_count() == 0
+
+
+@pytest.mark.historian
+def test_batched_cache_uses_wal(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    db = BackupDatabase(Owner(), None, 0.9, batched=True)
+    try:
+        c = db._connection.cursor()
+        c.execute("PRAGMA journal_mode")
+        assert c.fetchone()[0] == "wal"
+        c.execute("PRAGMA synchronous")
+        # NORMAL
+        assert c.fetchone()[0] == 1
+    finally:
+        db.close()
+
+
+@pytest.mark.historian
+def test_batched_cache_with_legacy_unique_constraint(tmpdir, monkeypatch, caplog):
+    monkeypatch.chdir(tmpdir)
+    db = BackupDatabase(Owner(), None, 0.9, batched=True)
+    try:
+        # Caches of older versions rejected duplicate readings.
+        db._connection.execute('CREATE UNIQUE INDEX legacy_unique '
+                               'ON outstanding (ts, topic_id, source)')
+        start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+        records = device_publish(start, 'device', {'p1': 1, 'p2': 2})
+        records += device_publish(start, 'device', {'p1': 3})
+        db.backup_new_data(records)
+
+        # Only the duplicate is reported and the rows inserted before it
+        # are counted once.
+        warnings = [r for r in caplog.records if 'Integrity error' in r.getMessage()]
+        assert len(warnings) == 1
+        assert [r['value'] for r in db.get_outstanding_to_publish(10)] == [1, 2]
+        assert db.get_backlog_count() == 2
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def segment_log(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    dbs = []
+
+    def open_log(**kwargs):
+        db = SegmentLogBackupDatabase(Owner(), kwargs.pop('limit', None), 0.9, **kwargs)
+        dbs.append(db)
+        return db
+
+    yield open_log
+    for db in dbs:
+        db.close()
+
+
+@pytest.mark.historian
+def test_segment_log_round_trip(segment_log):
+    db = segment_log()
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    db.backup_new_data(device_publish(start, 'campus/building/device',
+                                      {'p1': 1, 'p2': 2.5, 'p3': 'on'}))
+    assert db.get_backlog_count() == 3
+
+    to_publish = db.get_outstanding_to_publish(2)
+    assert [r['value'] for r in to_publish] == [1, 2.5]
+    assert to_publish[0]['timestamp'] == start
+    assert to_publish[0]['meta'] == {'units': 'F', 'type': 'float'}
+    assert to_publish[0]['headers'] == {'Date': start.isoformat()}
+
+    db.remove_successfully_published({None}, 2)
+    assert db.get_backlog_count() == 1
+    assert [r['value'] for r in db.get_outstanding_to_publish(10)] == ['on']
+
+
+@pytest.mark.historian
+def test_segment_log_partial_publish(segment_log):
+    db = segment_log()
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    db.backup_new_data(device_publish(start, 'device', {'p{}'.format(i): i for i in range(5)}))
+
+    to_publish = db.get_outstanding_to_publish(5)
+    # Only the second and fourth records made it to the store.
+    db.remove_successfully_published({to_publish[1]['_id'], to_publish[3]['_id']}, 5)
+    assert db.get_backlog_count() == 3
+    assert [r['value'] for r in db.get_outstanding_to_publish(5)] == [0, 2, 4]
+    assert [r['value'] for r in db.get_outstanding_to_publish(5, 1)] == [2, 4]
+
+    db.remove_successfully_published({to_publish[0]['_id']}, 5)
+    assert [r['value'] for r in db.get_outstanding_to_publish(5)] == [2, 4]
+
+
+@pytest.mark.historian
+def test_segment_log_rolls_and_truncates_segments(segment_log):
+    # Smallest segments allowed so a few hundred records span several files.
+    db = segment_log(segment_size_mb=0)
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    for minute in range(50):
+        db.backup_new_data(device_publish(start + timedelta(minutes=minute), 'device',
+                                          {'p{}'.format(i): 'x' * 100 for i in range(18)}))
+    segments = len(os.listdir('backup_segments'))
+    assert segments > 2
+    assert db.get_backlog_count() == 900
+
+    published = 0
+    while True:
+        batch = db.get_outstanding_to_publish(100)
+        if not batch:
+            break
+        published += len(batch)
+        db.remove_successfully_published({None}, 100)
+    assert published == 900
+    assert db.get_backlog_count() == 0
+    # Only the segment being written to is left.
+    assert len([n for n in os.listdir('backup_segments') if n.endswith('.log')]) == 1
+
+
+@pytest.mark.historian
+def test_segment_log_recovers_after_crash(segment_log):
+    db = segment_log()
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    db.backup_new_data(device_publish(start, 'device', {'p{}'.format(i): i for i in range(4)}))
+    db.get_outstanding_to_publish(1)
+    db.remove_successfully_published({None}, 1)
+
+    # Simulate a write torn by a crash right after the last record.
+    mm = db._segments[db._write_seq][1]
+    offset = db._write_offset
+    SegmentLogBackupDatabase.RECORD_HEADER.pack_into(mm, offset, 200, 12345)
+    mm[offset + 8:offset + 20] = b'[1577836800,'
+    db.close()
+
+    db = segment_log()
+    assert db.get_backlog_count() == 3
+    assert [r['value'] for r in db.get_outstanding_to_publish(10)] == [1, 2, 3]
+
+    db.backup_new_data(device_publish(start, 'device', {'p4': 4}))
+    assert [r['value'] for r in db.get_outstanding_to_publish(10)] == [1, 2, 3, 4]
+    assert db.get_outstanding_to_publish(1)[0]['meta'] == {'units': 'F', 'type': 'float'}
+
+
+@pytest.mark.historian
+def test_segment_log_recovers_empty_segments(segment_log):
+    db = segment_log()
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    db.backup_new_data(device_publish(start, 'device', {'p{}'.format(i): i for i in range(3)}))
+    seq = db._write_seq
+    db.close()
+
+    # Crashes between creating and sizing a segment leave empty files.
+    empty = db._segment_path(seq + 1)
+    open(empty, 'wb').close()
+    open(db._segment_path(seq + 2), 'wb').close()
+
+    db = segment_log()
+    assert not os.path.exists(empty)
+    assert db._write_seq == seq + 2
+    assert os.path.getsize(db._segment_path(seq + 2)) == db._segment_size
+    assert [r['value'] for r in db.get_outstanding_to_publish(10)] == [0, 1, 2]
+
+    db.backup_new_data(device_publish(start, 'device', {'p3': 3}))
+    assert [r['value'] for r in db.get_outstanding_to_publish(10)] == [0, 1, 2, 3]
+
+
+@pytest.mark.historian
+def test_segment_log_storage_limit(segment_log):
+    # Limit of 1MB with the minimum segment size of 64KB.
+    db = segment_log(limit=1.0 / 1024)
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    cache_full = False
+    for minute in range(200):
+        cache_full = db.backup_new_data(device_publish(start + timedelta(minutes=minute), 'device',
+                                                       {'p{}'.format(i): 'x' * 400 for i in range(18)}))
+    assert cache_full
+    total = sum(os.path.getsize(os.path.join('backup_segments', n))
+                for n in os.listdir('backup_segments') if n.endswith('.log'))
+    assert total <= 1024 ** 2 + 64 * 1024
+    remaining = db.get_outstanding_to_publish(100000)
+    assert len(remaining) == db.get_backlog_count()
+    # The oldest data was dropped.
+    assert remaining[0]['timestamp'] > start
+
+
+def device_frame(timestamp, device, points, source='scrape'):
+    return {'source': source,
+            'topic': device,
+            'readings': [(timestamp, dict(points))],
+            'meta': {point: {'units': 'F', 'type': 'float'} for point in points},
+            'headers': {'Date': timestamp.isoformat()},
+            'frame': True}
+
+
+@pytest.mark.historian
+@pytest.mark.parametrize("mode", ["per_row", "batched", "segment_log"])
+def test_device_frames_round_trip(mode, tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+
+    def open_cache():
+        if mode == "segment_log":
+            return SegmentLogBackupDatabase(Owner(), None, 0.9)
+        return BackupDatabase(Owner(), None, 0.9, batched=(mode == "batched"))
+
+    db = open_cache()
+    db.backup_new_data([device_frame(start, 'campus/building/device', {'p1': 1, 'p2': 2.5})] +
+                       device_publish(start, 'campus/building/device', {'p3': 3}))
+    assert db.get_backlog_count() == 2
+    db.close()
+
+    # Frame meta must survive a restart.
+    db = open_cache()
+    frame, point = db.get_outstanding_to_publish(10)
+    db.close()
+
+    assert frame['frame']
+    assert frame['source'] == 'scrape'
+    assert frame['topic'] == 'campus/building/device'
+    assert frame['value'] == {'p1': 1, 'p2': 2.5}
+    assert frame['meta'] == {'p1': {'units': 'F', 'type': 'float'},
+                             'p2': {'units': 'F', 'type': 'float'}}
+    assert 'frame' not in point
+    assert point['source'] == 'scrape'
+    assert point['topic'] == 'campus/building/device/p3'
+
+    expanded = expand_device_frames([frame, point])
+    assert [(r['topic'], r['value'], r['meta']) for r in expanded] == [
+        ('campus/building/device/p1', 1, {'units': 'F', 'type': 'float'}),
+        ('campus/building/device/p2', 2.5, {'units': 'F', 'type': 'float'}),
+        ('campus/building/device/p3', 3, {'units': 'F', 'type': 'float'})]
+    assert expanded[0]['timestamp'] == start
+    assert expanded[0]['headers'] is frame['headers']
+
+
+@pytest.mark.historian
+@pytest.mark.parametrize("mode", ["per_row", "batched", "segment_log"])
+def test_forwarded_string_timestamps(mode, tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    if mode == "segment_log":
+        db = SegmentLogBackupDatabase(Owner(), None, 0.9)
+    else:
+        db = BackupDatabase(Owner(), None, 0.9, batched=(mode == "batched"))
+    # The forward historian and data mover queue the Date header as it is,
+    # a spilled event queue caches them the same way.
+    payload = {'headers': {'Date': '2020-01-01T00:00:00.000000+00:00'},
+               'message': [{'p1': 1}, {'p1': {'units': 'F'}}]}
+    db.backup_new_data([{'source': 'forwarded',
+                         'topic': 'devices/campus/building/device/all',
+                         'readings': [('2020-01-01T00:00:00.000000+00:00', payload)]}])
+    record, = db.get_outstanding_to_publish(10)
+    db.close()
+
+    assert record['value'] == payload
+    assert record['topic'] == 'devices/campus/building/device/all'
+    assert record['timestamp'] == datetime(2020, 1, 1, tzinfo=pytz.UTC)
+
+
+@pytest.mark.historian
+def test_frame_handled_once_all_points_reported():
+    frame = {'_id': 7, 'frame': True, 'topic': 'device', 'source': 'scrape',
+             'timestamp': None, 'headers': {}, 'value': {'p1': 1, 'p2': 2}, 'meta': {}}
+    point = {'_id': 8, 'topic': 'other/p1', 'value': 1}
+    expanded = expand_device_frames([frame, point])
+
+    class Agent:
+        _successful_published = {expanded[0]['_id'], 8}
+
+    agent = Agent()
+    assert BaseHistorianAgent._get_handled_ids(agent, [frame, point]) == {8}
+
+    agent._successful_published = {r['_id'] for r in expanded}
+    assert BaseHistorianAgent._get_handled_ids(agent, [frame, point]) == {7, 8}
+
+    agent._successful_published = {None}
+    assert BaseHistorianAgent._get_handled_ids(agent, [frame, point]) == {None}
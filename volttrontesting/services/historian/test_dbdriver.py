@@ -49,7 +49,8 @@ import pytest
 import pytz
 import shutil
 
-from volttron.platform.dbutils import basedb
+from volttron.platform.agent.downsample import downsample_values
+from volttron.platform.dbutils import basedb, sqlitefuncts
 from volttron.platform.dbutils.sqlitefuncts import SqlLiteFuncts
 
 try:
@@ -173,6 +174,7 @@ class Suite(object):
                     values[topic] = [(ts.isoformat(), value)]
                 ts += timedelta(seconds=1)
         assert suite_driver.get_topic_map() == (id_map, name_map)
+        assert suite_driver.get_topic_count() == len(id_map)
         assert suite_driver.query(list(id_name_map.keys()), id_name_map) == values
         start = datetime(year=2015, month=3, day=14, hour=9, minute=26,
                          second=0, microsecond=0, tzinfo=pytz.UTC)
@@ -180,6 +182,117 @@ class Suite(object):
                          second=0, microsecond=0, tzinfo=pytz.UTC)
         assert suite_driver.query(list(id_name_map.keys()), id_name_map, start, end) == values
 
+    def test_bulk_insert(self, suite_driver):
+        topic_id = suite_driver.insert_topic('Building/LAB/Device/BulkInsert')
+        id_name_map = {topic_id: 'Building/LAB/Device/BulkInsert'}
+        start = datetime(year=2015, month=3, day=19, tzinfo=pytz.UTC)
+        with suite_driver.bulk_insert() as insert_data:
+            for second in range(5):
+                assert insert_data(start + timedelta(seconds=second),
+                                   topic_id, float(second))
+        suite_driver.commit()
+        # existing rows are updated and the last of two values in a batch
+        # is kept
+        with suite_driver.bulk_insert() as insert_data:
+            insert_data(start, topic_id, {'a': 'b,"c"'})
+            insert_data(start + timedelta(seconds=1), topic_id, 'first')
+            insert_data(start + timedelta(seconds=1), topic_id, 'last')
+        suite_driver.commit()
+        values = suite_driver.query([topic_id], id_name_map)
+        assert [value for _, value in values[id_name_map[topic_id]]] == [
+            {'a': 'b,"c"'}, 'last', 2.0, 3.0, 4.0]
+
+    def test_query_multiple_topics(self, suite_driver):
+        id_name_map = {}
+        for index, topic in enumerate(['Building/LAB/Device/MultiA',
+                                       'Building/LAB/Device/MultiB',
+                                       'Building/LAB/Device/MultiC']):
+            topic_id = suite_driver.insert_topic(topic)
+            id_name_map[topic_id] = topic
+            ts = datetime(year=2015, month=3, day=16, hour=9, minute=26,
+                          second=53, microsecond=59, tzinfo=pytz.UTC)
+            for value in range(index * 3):
+                suite_driver.insert_data(ts, topic_id, float(value))
+                ts += timedelta(seconds=1)
+        suite_driver.commit()
+        topic_ids = list(id_name_map.keys())
+        start = datetime(year=2015, month=3, day=16, hour=9, minute=26,
+                         second=54, microsecond=59, tzinfo=pytz.UTC)
+        for skip, count, order, start in [(0, None, 'FIRST_TO_LAST', None),
+                                          (1, 2, 'FIRST_TO_LAST', None),
+                                          (0, 2, 'LAST_TO_FIRST', None),
+                                          (2, None, 'LAST_TO_FIRST', start),
+                                          (1, 3, 'FIRST_TO_LAST', start)]:
+            values = suite_driver.query(topic_ids, id_name_map, start=start,
+                                        skip=skip, count=count, order=order)
+            # the same as querying for each topic on its own
+            assert list(values.keys()) == list(id_name_map.values())
+            for topic_id, name in id_name_map.items():
+                assert values[name] == suite_driver.query(
+                    [topic_id], id_name_map, start=start, skip=skip,
+                    count=count, order=order)[name]
+
+    def test_stream_query(self, suite_driver):
+        id_name_map = {}
+        for topic in ['Building/LAB/Device/StreamTemperature',
+                      'Building/LAB/Device/StreamSignal']:
+            topic_id = suite_driver.insert_topic(topic)
+            id_name_map[topic_id] = topic
+            ts = datetime(year=2015, month=3, day=15, hour=9, minute=26,
+                          second=53, microsecond=59, tzinfo=pytz.UTC)
+            for value in range(5):
+                suite_driver.insert_data(ts, topic_id, float(value))
+                ts += timedelta(seconds=1)
+        suite_driver.commit()
+        topic_ids = list(id_name_map.keys())
+        for order in ['FIRST_TO_LAST', 'LAST_TO_FIRST']:
+            values = suite_driver.query(topic_ids, id_name_map, order=order)
+            expected = [(name, ts, value) for name in id_name_map.values()
+                        for ts, value in values[name]]
+            assert list(suite_driver.stream_query(
+                topic_ids, id_name_map, order=order, size=2)) == expected
+        start = datetime(year=2015, month=3, day=15, hour=9, minute=26,
+                         second=54, microsecond=59, tzinfo=pytz.UTC)
+        rows = list(suite_driver.stream_query(
+            topic_ids[:1], id_name_map, start=start, end=start + timedelta(seconds=2), size=1))
+        assert [value for _, _, value in rows] == [1.0, 2.0]
+
+    def test_downsample_query(self, suite_driver):
+        id_name_map = {}
+        start = datetime(year=2015, month=3, day=17, tzinfo=pytz.UTC)
+        # the values of the last topic are not downsampled, there are fewer
+        # of them than points
+        for index, (topic, count) in enumerate([
+                ('Building/LAB/Device/DownsampleA', 200),
+                ('Building/LAB/Device/DownsampleB', 200),
+                ('Building/LAB/Device/DownsampleC', 15)]):
+            topic_id = suite_driver.insert_topic(topic)
+            id_name_map[topic_id] = topic
+            for second in range(count):
+                value = round(random.uniform(-10, 10), 6) if second % 9 \
+                    else 'off'
+                suite_driver.insert_data(
+                    start + timedelta(seconds=second * 1.5 + index), topic_id,
+                    value)
+        suite_driver.commit()
+        topic_ids = list(id_name_map.keys())
+        for method in ['bucket_avg', 'min_max']:
+            for end in [None, start + timedelta(minutes=4)]:
+                try:
+                    values = suite_driver.downsample_query(
+                        topic_ids, id_name_map, method, 20, start=start,
+                        end=end)
+                except NotImplementedError:
+                    pytest.skip('downsampling is done by the historian')
+                expected = downsample_values(
+                    suite_driver.query(topic_ids, id_name_map, start=start,
+                                       end=end), method, 20, start, end)
+                for name in id_name_map.values():
+                    assert [ts for ts, _ in values[name]] == \
+                        [ts for ts, _ in expected[name]]
+                    assert [value for _, value in values[name]] == \
+                        pytest.approx([value for _, value in expected[name]])
+
     def test_topic_name_case_change(self, suite_driver):
         topic_id = suite_driver.insert_topic('This/is/some/Topic')
         assert topic_id
@@ -241,6 +354,9 @@ class AggregationSuite(Suite):
         assert driver.collect_aggregate(list(range(1, 4)), 'avg', start, ts) == (49.5, 300)
         assert driver.collect_aggregate([1, 6], 'sum', start, ts) == (4950, 100)
         assert driver.collect_aggregate([1, 6], 'avg', start, ts) == (49.5, 100)
+        assert driver.collect_aggregates(
+            [list(range(1, 4)), [1, 6], [6], [2]], 'sum', start, ts) == [
+            (14850.0, 300), (4950, 100), (None, 0), (4950, 100)]
         start += delta
         ts = start + delta
         assert driver.collect_aggregate(list(range(1, 4)), 'sum', start, ts) == (3.0, 3)
@@ -312,6 +428,10 @@ class TestRedshift(TestPostgreSql):
         with self._transact(redshift_params, truncate_tables, drop_tables):
             yield RedshiftFuncts, redshift_params
 
+    @pytest.mark.skip(reason='redshift does not enforce unique constraints')
+    def test_bulk_insert(self, suite_driver):
+        pass
+
 
 class TestSqlite(AggregationSuite):
     @contextlib.contextmanager
@@ -343,6 +463,111 @@ class TestSqlite(AggregationSuite):
     def test_query_topic_pattern(self, driver):
         pass
 
+    def test_read_only_connection(self, suite_driver, state):
+        params = {'database': suite_driver.cursor().connection.execute(
+            'PRAGMA database_list').fetchone()[2]}
+        writer = SqlLiteFuncts(dict(params, journal_mode='wal'),
+                               state.table_names)
+        reader = SqlLiteFuncts(dict(params, read_only=True),
+                               state.table_names)
+        try:
+            assert writer.select('PRAGMA journal_mode') == [('wal',)]
+            topic_id = writer.insert_topic('Building/LAB/Device/ReadOnly')
+            id_name_map = {topic_id: 'Building/LAB/Device/ReadOnly'}
+            ts = datetime(year=2015, month=3, day=18, tzinfo=pytz.UTC)
+            writer.insert_data(ts, topic_id, 1.0)
+            writer.commit()
+            # the reader is not blocked by the writer's open transaction
+            writer.insert_data(ts + timedelta(seconds=1), topic_id, 2.0)
+            assert reader.query([topic_id], id_name_map) == {
+                id_name_map[topic_id]: [('2015-03-18T00:00:00.000000+00:00', 1.0)]}
+            writer.commit()
+            with pytest.raises(sqlite3.OperationalError):
+                reader.insert_data(ts, topic_id, 3.0)
+        finally:
+            reader.close()
+            writer.execute_stmt('PRAGMA journal_mode=DELETE')
+            writer.close()
+
+    @pytest.mark.aggregator
+    def test_collect_aggregates_in_chunks(self, suite_driver, monkeypatch):
+        start = datetime(year=2015, month=4, day=14, tzinfo=pytz.UTC)
+        for i in range(10):
+            for topic_id in range(1, 6):
+                suite_driver.insert_data(start + timedelta(seconds=i),
+                                         topic_id, float(i * topic_id))
+        suite_driver.commit()
+        end = start + timedelta(seconds=10)
+        topic_ids_list = [[1, 2, 3], [4], [2, 5], [1, 5]]
+        # two (point, topic_id) pairs per query, the pairs of the first
+        # point are split across queries
+        monkeypatch.setattr(sqlitefuncts, 'MAX_QUERY_TOPICS', 4)
+        for agg_type in ('avg', 'min', 'max', 'sum', 'count'):
+            assert suite_driver.collect_aggregates(
+                topic_ids_list, agg_type, start, end) == [
+                suite_driver.collect_aggregate(topic_ids, agg_type, start, end)
+                for topic_ids in topic_ids_list]
+
+
+class TestPartitionedSqlite(TestSqlite):
+    @contextlib.contextmanager
+    def transact(self, truncate_tables, drop_tables):
+        with super(TestPartitionedSqlite, self).transact(
+                truncate_tables, drop_tables) as (cls, params):
+            yield cls, dict(params, partition='day')
+
+    def test_partitions(self, suite_driver):
+        topic_id = suite_driver.insert_topic('Building/LAB/Device/Partitioned')
+        id_name_map = {topic_id: 'Building/LAB/Device/Partitioned'}
+        start = datetime(year=2015, month=5, day=1, tzinfo=pytz.UTC)
+        for hour in range(24 * 12):
+            suite_driver.insert_data(start + timedelta(hours=hour), topic_id,
+                                     float(hour))
+        suite_driver.commit()
+        # more partitions than can be attached at the same time
+        values = suite_driver.query([topic_id], id_name_map, skip=30,
+                                    count=200)[id_name_map[topic_id]]
+        assert [value for _, value in values] == list(range(30, 230))
+        values = suite_driver.query(
+            [topic_id], id_name_map, start=start + timedelta(days=3),
+            end=start + timedelta(days=5), skip=20,
+            order='LAST_TO_FIRST')[id_name_map[topic_id]]
+        assert [value for _, value in values] == list(range(99, 71, -1))
+        assert suite_driver.collect_aggregate(
+            [topic_id], 'avg', start, start + timedelta(days=12)) == (143.5, 288)
+
+        suite_driver.manage_db_size(start + timedelta(days=10, hours=1), None)
+        assert suite_driver._data_keys() == [None, '2015-05-11', '2015-05-12']
+        values = suite_driver.query([topic_id], id_name_map, count=1)
+        assert values[id_name_map[topic_id]] == [
+            ('2015-05-11T00:00:00.000000+00:00', 240.0)]
+
+    def test_bulk_insert_partitions(self, suite_driver):
+        topic_id = suite_driver.insert_topic('Building/LAB/Device/Backfill')
+        suite_driver.commit()
+        id_name_map = {topic_id: 'Building/LAB/Device/Backfill'}
+        start = datetime(year=2015, month=6, day=1, tzinfo=pytz.UTC)
+
+        def backfill():
+            # rows of three days interleaved as a backfill of several
+            # devices sends them
+            with suite_driver.bulk_insert() as insert_data:
+                for hour in range(24):
+                    for day in range(3):
+                        assert insert_data(start + timedelta(days=day, hours=hour),
+                                           topic_id, float(day * 24 + hour))
+
+        backfill()
+        # nothing was committed before the end of the batch
+        suite_driver.rollback()
+        assert not suite_driver.query([topic_id], id_name_map)[id_name_map[topic_id]]
+
+        backfill()
+        suite_driver.commit()
+        values = suite_driver.query([topic_id], id_name_map,
+                                    count=100)[id_name_map[topic_id]]
+        assert [value for _, value in values] == list(range(72))
+
 
 class FauxConnection:
     def __init__(self, exc_class):
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import pytest
+
+from volttron.platform.agent.base_historian import BaseHistorianAgent
+
+
+class FilterAgent:
+    """Just the state BaseHistorianAgent needs to filter device data."""
+    _compile_device_data_filter = BaseHistorianAgent._compile_device_data_filter
+    _filter_device_data = BaseHistorianAgent._filter_device_data
+
+    def __init__(self, device_data_filter):
+        self._device_data_filter = device_data_filter
+        self._device_data_filter_cache = {}
+
+
+ALL_PUBLISH = [{'SampleWritableFloat1': 10.0, 'SampleBool1': True, 'OutsideAirTemperature1': 50.0},
+               {'SampleWritableFloat1': {'units': 'PPM'},
+                'SampleBool1': {'units': 'On/Off'},
+                'OutsideAirTemperature1': {'units': 'F'}}]
+
+
+@pytest.mark.historian
+def test_points_are_filtered():
+    agent = FilterAgent({'device': ['SampleWritableFloat1', 'Missing'],
+                         'building': ['SampleBool1']})
+    msg = agent._filter_device_data('campus/building/device', ALL_PUBLISH)
+    assert msg == [{'SampleWritableFloat1': 10.0, 'SampleBool1': True},
+                   {'SampleWritableFloat1': {'units': 'PPM'}, 'SampleBool1': {'units': 'On/Off'}}]
+
+
+@pytest.mark.historian
+def test_unmatched_devices_are_dropped():
+    agent = FilterAgent({'device1': ['SampleWritableFloat1']})
+    assert agent._filter_device_data('campus/building/device2', ALL_PUBLISH) is None
+    # No configured point in the publish.
+    agent = FilterAgent({'device': ['Missing']})
+    assert agent._filter_device_data('campus/building/device', ALL_PUBLISH) is None
+
+
+@pytest.mark.historian
+def test_filter_is_compiled_once_per_device():
+    agent = FilterAgent({'device': ['SampleBool1']})
+    agent._filter_device_data('campus/building/device', ALL_PUBLISH)
+    # Changing the filter without resetting the cache has no effect.
+    agent._device_data_filter = {'device': ['OutsideAirTemperature1']}
+    assert agent._filter_device_data('campus/building/device', ALL_PUBLISH)[0] == {'SampleBool1': True}
+    agent._device_data_filter_cache = {}
+    assert agent._filter_device_data('campus/building/device', ALL_PUBLISH)[0] == {'OutsideAirTemperature1': 50.0}
+
+
+@pytest.mark.historian
+def test_non_list_publish_kept_when_point_in_device():
+    agent = FilterAgent({'device': ['point']})
+    message = {'point': 1.0}
+    assert agent._filter_device_data('campus/building/device/point', message) is message
+    assert agent._filter_device_data('campus/building/device/other', message) is None
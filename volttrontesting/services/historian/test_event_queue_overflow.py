@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import threading
+from datetime import datetime
+from queue import Queue
+
+import pytest
+import pytz
+
+from volttron.platform.agent.base_historian import (STATUS_KEY_CACHE_COUNT,
+                                                    STATUS_KEY_QUEUE_OVERFLOW,
+                                                    BackupDatabase,
+                                                    BaseHistorianAgent,
+                                                    _LockedBackupDatabase)
+
+
+class Owner:
+    pass
+
+
+class QueueAgent:
+    """Just the state BaseHistorianAgent needs to queue records."""
+    _queue_records = BaseHistorianAgent._queue_records
+    _spill_records = BaseHistorianAgent._spill_records
+
+    def __init__(self, event_queue_size, backupdb):
+        self._event_queue = Queue()
+        self._event_queue_size = event_queue_size
+        self._spill_backupdb = backupdb
+        self._queue_overflow_count = 0
+        self.status = {}
+        self.alerts = []
+
+    def _update_status(self, updates):
+        self.status.update(updates)
+
+    def _send_alert(self, updates, key):
+        self.status.update(updates)
+        self.alerts.append(key)
+
+
+def device_records(count):
+    timestamp = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    headers = {}
+    return [{'source': 'scrape',
+             'topic': 'campus/building/device/point{}'.format(index),
+             'readings': [(timestamp, index)],
+             'meta': {},
+             'headers': headers} for index in range(count)]
+
+
+@pytest.fixture
+def backupdb(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    owner = Owner()
+    db = _LockedBackupDatabase(BackupDatabase(owner, None, 0.9, check_same_thread=False),
+                               threading.Lock())
+    yield db
+    db.close()
+
+
+@pytest.mark.historian
+def test_full_queue_spills_to_cache(backupdb):
+    agent = QueueAgent(5, backupdb)
+    agent._queue_records(device_records(4))
+    agent._queue_records(device_records(4))
+    assert agent._event_queue.qsize() == 8
+    assert backupdb.get_backlog_count() == 0
+
+    # Spilled from another thread than the one that created the cache.
+    spill = threading.Thread(target=agent._queue_records, args=(device_records(3),))
+    spill.start()
+    spill.join()
+    assert agent._event_queue.qsize() == 8
+    assert backupdb.get_backlog_count() == 3
+    assert agent.status == {STATUS_KEY_QUEUE_OVERFLOW: 3, STATUS_KEY_CACHE_COUNT: 3}
+    assert not agent.alerts
+
+
+@pytest.mark.historian
+def test_unbounded_queue_does_not_spill(backupdb):
+    agent = QueueAgent(0, backupdb)
+    agent._queue_records(device_records(10))
+    assert agent._event_queue.qsize() == 10
+
+    # Without a cache records are queued even when the queue is full.
+    agent = QueueAgent(5, None)
+    agent._queue_records(device_records(10))
+    assert agent._event_queue.qsize() == 10
+    assert not agent.status
+
+
+@pytest.mark.historian
+def test_spill_does_not_wait_for_busy_cache(backupdb):
+    agent = QueueAgent(5, backupdb)
+    agent._queue_records(device_records(5))
+
+    # The process loop holds the cache, records keep being queued.
+    with backupdb._lock:
+        agent._queue_records(device_records(3))
+    assert agent._event_queue.qsize() == 8
+    assert backupdb.get_backlog_count() == 0
+    assert not agent.status
+
+    agent._queue_records(device_records(3))
+    assert agent._event_queue.qsize() == 8
+    assert backupdb.get_backlog_count() == 3
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import time
+from datetime import timedelta
+
+import pytest
+
+from volttron.platform.agent.base_historian import HistorianPerformanceStats
+from volttron.platform.agent.utils import get_aware_utc_now
+
+
+@pytest.mark.historian
+def test_stage_percentiles():
+    stats = HistorianPerformanceStats(window_size=100)
+    for value in range(1, 201):
+        stats.record("publish", value / 1000.0)
+
+    summary = stats.stage_summary("publish")
+    # Only the last 100 samples are kept.
+    assert summary == {'count': 200, 'p50': 0.151, 'p95': 0.196, 'p99': 0.2, 'max': 0.2}
+    assert stats.stage_summary("cache_read") == {'count': 0}
+
+    with stats.timer("cache_insert"):
+        time.sleep(0.01)
+    assert stats.stage_summary("cache_insert")['max'] >= 0.01
+
+
+@pytest.mark.historian
+def test_record_age_and_queue_wait():
+    stats = HistorianPerformanceStats()
+    now = get_aware_utc_now()
+    stats.record_age([{'timestamp': now - timedelta(seconds=30)},
+                      {'timestamp': now - timedelta(seconds=90)}])
+    # Forwarded records are skipped.
+    stats.record_age([{'timestamp': '2020-01-01T00:00:00'}])
+    # Every record of a batch is timed, not only the first.
+    stats.record_queue_wait([{'queued': time.monotonic() - 1.0},
+                             {'queued': time.monotonic() - 2.0},
+                             {}])
+
+    stages = stats.as_dict()['stages']
+    assert stages['record_age']['count'] == 1
+    assert 90 <= stages['record_age']['max'] < 100
+    assert stages['queue_wait']['count'] == 2
+    assert stages['queue_wait']['max'] >= 2.0
+    assert stages['queue_wait']['p50'] >= 1.0
+
+
+@pytest.mark.historian
+def test_backlog_growth_rate():
+    stats = HistorianPerformanceStats(backlog_window=60.0)
+    stats.update_backlog(100, now=0.0)
+    stats.update_backlog(150, now=10.0)
+    assert stats.backlog_growth_rate() == 5.0
+    # Only the last sample before the window is kept.
+    stats.update_backlog(150, now=100.0)
+    stats.update_backlog(50, now=110.0)
+    assert stats.backlog_growth_rate() == -1.0
+    stats.update_backlog(50, now=200.0)
+    assert stats.backlog_growth_rate() == 0.0
+
+    stats.update_queue_depth(7)
+    stats.update_queue_depth(2)
+    values, meta = stats.as_record()
+    assert values['queue_depth'] == 2
+    assert values['queue_depth_max'] == 7
+    assert values['backlog_count'] == 50
+    assert values['publish_count'] == 0
+    assert meta['backlog_growth_rate']['units'] == 'records/second'
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from volttron.platform.agent.base_historian import (STATUS_KEY_BATCHES_IN_FLIGHT,
+                                                    STATUS_KEY_BATCH_LATENCY,
+                                                    STATUS_KEY_BACKLOGGED,
+                                                    BackupDatabase,
+                                                    BaseHistorianAgent,
+                                                    HistorianPerformanceStats,
+                                                    _PublishWorker)
+
+
+class PipelineAgent:
+    """Just the state BaseHistorianAgent needs to publish with workers."""
+    supports_device_frames = False
+    _publish_pipelined = BaseHistorianAgent._publish_pipelined
+    _get_handled_ids = BaseHistorianAgent._get_handled_ids
+    _history_limit_timestamp = BaseHistorianAgent._history_limit_timestamp
+    _get_successful_published = BaseHistorianAgent._get_successful_published
+    report_handled = BaseHistorianAgent.report_handled
+    report_all_handled = BaseHistorianAgent.report_all_handled
+
+    def __init__(self, submit_size_limit, fail_topic=None):
+        self._submit_size_limit = submit_size_limit
+        self._successful_published = set()
+        self._publish_state = threading.local()
+        self._performance_stats = HistorianPerformanceStats()
+        self._history_limit_days = None
+        self._storage_limit_gb = None
+        self._max_time_publishing = timedelta(seconds=30)
+        self._stop_process_loop = False
+        self._current_status_context = {STATUS_KEY_BACKLOGGED: True}
+        self.fail_topic = fail_topic
+        self.published = []
+        self.alerts = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def historian_worker_setup(self):
+        self._publish_state.connection = object()
+
+    def historian_worker_teardown(self):
+        pass
+
+    def manage_db_size(self, history_limit_timestamp, storage_limit_gb):
+        pass
+
+    def publish_to_historian(self, to_publish_list):
+        assert self._publish_state.connection is not None
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # Later batches finish first.
+        time.sleep(0.05 if to_publish_list[0]['value'] == 0 else 0.01)
+        with self.lock:
+            self.active -= 1
+        if any(x['topic'] == self.fail_topic for x in to_publish_list):
+            return
+        with self.lock:
+            self.published.extend(x['value'] for x in to_publish_list)
+        if to_publish_list[0]['value'] % 2:
+            self.report_handled(to_publish_list)
+        else:
+            self.report_all_handled()
+
+    def _update_status(self, updates):
+        self._current_status_context.update(updates)
+
+    def _send_alert(self, updates, key):
+        self._current_status_context.update(updates)
+        self.alerts.append(key)
+
+
+def fill_cache(db, count, fail_at=None):
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    db.backup_new_data([{'source': 'scrape',
+                         'topic': 'device/fail' if index == fail_at else 'device/point',
+                         'readings': [(start + timedelta(seconds=index), index)],
+                         'meta': {},
+                         'headers': {}} for index in range(count)])
+
+
+@pytest.fixture
+def backupdb(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    db = BackupDatabase(PipelineAgent(1), None, 0.9)
+    yield db
+    db.close()
+
+
+@pytest.mark.historian
+def test_pipeline_publishes_backlog(backupdb):
+    fill_cache(backupdb, 10)
+    agent = PipelineAgent(submit_size_limit=1)
+    workers = [_PublishWorker(agent, "worker-{}".format(i)) for i in range(3)]
+    try:
+        published, wait_for_input = agent._publish_pipelined(backupdb, workers, datetime.utcnow())
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    assert published == 10
+    assert wait_for_input
+    assert sorted(agent.published) == list(range(10))
+    assert agent.max_active > 1
+    assert backupdb.get_outstanding_to_publish(10) == []
+    status = agent._current_status_context
+    assert status[STATUS_KEY_BATCHES_IN_FLIGHT] == 0
+    assert status[STATUS_KEY_BATCH_LATENCY] > 0
+    assert not status[STATUS_KEY_BACKLOGGED]
+    assert not agent.alerts
+    stages = agent._performance_stats.as_dict()['stages']
+    assert stages['publish']['count'] == 10
+    assert stages['cache_delete']['count'] == 10
+
+
+@pytest.mark.historian
+def test_pipeline_stops_on_failed_batch(backupdb):
+    fill_cache(backupdb, 10, fail_at=4)
+    agent = PipelineAgent(submit_size_limit=2, fail_topic='device/fail')
+    workers = [_PublishWorker(agent, "worker-{}".format(i)) for i in range(2)]
+    try:
+        published, wait_for_input = agent._publish_pipelined(backupdb, workers, datetime.utcnow())
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    assert agent.alerts == ["historian_not_publishing"]
+    # The failed batch stays in the cache, batches in flight are still acknowledged.
+    remaining = [x['value'] for x in backupdb.get_outstanding_to_publish(10)]
+    assert remaining[:2] == [4, 5]
+    assert published == 10 - len(remaining)
+
+
+@pytest.mark.historian
+def test_pipeline_reads_each_record_once(backupdb, monkeypatch):
+    fill_cache(backupdb, 10)
+    read = []
+    get_outstanding_to_publish = backupdb.get_outstanding_to_publish
+
+    def counting_read(size_limit, skip=0):
+        results = get_outstanding_to_publish(size_limit, skip)
+        read.extend(x['value'] for x in results)
+        return results
+
+    monkeypatch.setattr(backupdb, 'get_outstanding_to_publish', counting_read)
+    agent = PipelineAgent(submit_size_limit=2)
+    workers = [_PublishWorker(agent, "worker-{}".format(i)) for i in range(3)]
+    try:
+        published, _ = agent._publish_pipelined(backupdb, workers, datetime.utcnow())
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    assert published == 10
+    # Records in flight are skipped instead of read again for every free worker.
+    assert sorted(read) == list(range(10))
+
+
+@pytest.mark.historian
+def test_history_limit_from_newest_record():
+    agent = PipelineAgent(submit_size_limit=1)
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    # The segment log cache returns records in the order they were cached.
+    batch = [{'timestamp': start + timedelta(days=2)},
+             {'timestamp': start},
+             {'timestamp': '2020-01-01T00:00:00'}]
+    assert agent._history_limit_timestamp(batch) is None
+    agent._history_limit_days = timedelta(days=1)
+    assert agent._history_limit_timestamp(batch) == start + timedelta(days=1)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2019, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from volttron.platform.agent.base_historian import BaseQueryHistorianAgent
+from volttron.platform.agent.utils import format_timestamp
+
+
+class StreamAgent:
+    """Just the state BaseQueryHistorianAgent needs to stream queries, with
+    an in memory data store."""
+    query_stream = BaseQueryHistorianAgent.query_stream
+    query_next = BaseQueryHistorianAgent.query_next
+    query_stream_close = BaseQueryHistorianAgent.query_stream_close
+    query_historian_stream = BaseQueryHistorianAgent.query_historian_stream
+    _next_query_page = BaseQueryHistorianAgent._next_query_page
+    _expire_query_streams = BaseQueryHistorianAgent._expire_query_streams
+    _parse_query_args = staticmethod(
+        BaseQueryHistorianAgent._parse_query_args)
+    query_stream_timeout = BaseQueryHistorianAgent.query_stream_timeout
+    max_query_streams = 2
+
+    def __init__(self, data):
+        self._query_streams = OrderedDict()
+        self.data = data
+
+    def query_historian(self, topic, start=None, end=None, agg_type=None,
+                        agg_period=None, skip=0, count=None, order=None):
+        values = self.data[topic][skip:skip + count]
+        return {'values': values, 'metadata': {'units': topic}}
+
+
+def make_data(*counts):
+    start = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    return {'topic{}'.format(index): [
+        (format_timestamp(start + timedelta(seconds=second)), float(second))
+        for second in range(count)] for index, count in enumerate(counts)}
+
+
+def read_all(agent, page):
+    pages = [page]
+    while page['next'] is not None:
+        page = agent.query_next(page['next'])
+        pages.append(page)
+    return pages
+
+
+def test_query_stream_single_topic_pages():
+    data = make_data(25)
+    agent = StreamAgent(data)
+
+    pages = read_all(agent, agent.query_stream('topic0', page_size=10))
+
+    assert [len(page['values']) for page in pages] == [10, 10, 5]
+    assert pages[0]['metadata'] == {'units': 'topic0'}
+    assert sum((page['values'] for page in pages), []) == data['topic0']
+    assert not agent._query_streams
+
+
+def test_query_stream_multiple_topics_and_exact_page_end():
+    data = make_data(4, 6)
+    agent = StreamAgent(data)
+
+    pages = read_all(agent, agent.query_stream(['topic0', 'topic1'],
+                                               page_size=5))
+
+    assert [page['values'] for page in pages] == [
+        {'topic0': data['topic0'], 'topic1': data['topic1'][:1]},
+        {'topic1': data['topic1'][1:]}]
+    assert pages[0]['metadata'] == {}
+    assert pages[-1]['next'] is None
+
+
+def test_query_stream_tokens_expire():
+    agent = StreamAgent(make_data(100))
+
+    first = agent.query_stream('topic0', page_size=10)
+    second = agent.query_next(first['next'])
+    # tokens are good for one page only
+    with pytest.raises(ValueError):
+        agent.query_next(first['next'])
+
+    # the least recently read streams are closed to make room for new ones
+    others = [agent.query_stream('topic0', page_size=10) for _ in range(2)]
+    with pytest.raises(ValueError):
+        agent.query_next(second['next'])
+
+    agent.query_stream_timeout = 0
+    with pytest.raises(ValueError):
+        agent.query_next(others[-1]['next'])
+    assert not agent._query_streams
+
+    with pytest.raises(ValueError):
+        agent.query_stream('topic0', page_size=0)
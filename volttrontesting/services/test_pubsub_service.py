@@ -1,4 +1,5 @@
 from volttron.platform.vip.pubsubservice import PubSubService, ProtectedPubSubTopics
+from volttron.utils.frame_serialization import CODECS, JSON_CODEC, deserialize_frames
 from mock import Mock, MagicMock
 import pytest
 
@@ -53,3 +54,143 @@ def test_returns_empty_list_when_subsystem_not_specified(pubsub_service):
     frames[6] = "not_pubsub"
     result = service.handle_subsystem(frames)
     assert [] == result
+
+
+def test_distribute_internal_serializes_payload_once(pubsub_service):
+
+    parameters, service = pubsub_service
+    for subscriber in ('subscriber1', 'subscriber2'):
+        service._add_peer_subscription(subscriber, '', 'devices')
+    frames = ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish', 'devices/campus/device/all',
+              {'bus': '', 'headers': {}, 'message': [{'point': 1.5}, {'point': {'units': 'F'}}]}]
+
+    assert 2 == service._distribute_internal(frames)
+
+    sent = [call[0][0] for call in parameters['socket'].send_multipart.call_args_list]
+    assert ['subscriber1', 'subscriber2'] == sorted(frames[0].bytes.decode('utf-8') for frames in sent)
+    # Every subscriber gets the same payload frames
+    assert sent[0][1:] == sent[1][1:]
+    assert all(a is b for a, b in zip(sent[0][1:], sent[1][1:]))
+
+
+def test_subscription_index_matches_prefixes(pubsub_service):
+
+    parameters, service = pubsub_service
+    if parameters['has_external_routing']:
+        parameters['routing_service'].my_instance_name.return_value = 'local'
+        parameters['routing_service'].get_connected_platforms.return_value = []
+
+    def subscribe(peer, prefix, all_platforms=False):
+        frames = [peer, '', 'VIP1', '', '1', 'pubsub', 'subscribe',
+                  dict(prefix=prefix, bus='', all_platforms=all_platforms)]
+        assert service._peer_subscribe(frames)
+
+    def subscribers(topic):
+        parameters['socket'].reset_mock()
+        frames = ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish', topic,
+                  {'bus': '', 'headers': {}, 'message': 1}]
+        count = service._distribute_internal(frames)
+        sent = {call[0][0][0].bytes.decode('utf-8') for call in parameters['socket'].send_multipart.call_args_list}
+        assert count == len(sent)
+        return sent
+
+    subscribe('agent1', 'devices/camp')
+    subscribe('agent2', ['devices/campus/building', 'analysis'])
+    subscribe('agent3', 'devices', all_platforms=True)
+    subscribe('agent4', '')
+
+    assert {'agent1', 'agent2', 'agent3', 'agent4'} == subscribers('devices/campus/building1/all')
+    assert {'agent3', 'agent4'} == subscribers('devices/other')
+    assert {'agent4'} == subscribers('device')
+
+    # Internal subscriptions to a prefix take over the subscriptions to all platforms
+    subscribe('agent1', 'devices')
+    assert {'agent1', 'agent4'} == subscribers('devices/other')
+
+    frames = ['agent1', '', 'VIP1', '', '1', 'pubsub', 'unsubscribe', dict(prefix='devices', bus='')]
+    assert service._peer_unsubscribe(frames)
+    assert {'agent3', 'agent4'} == subscribers('devices/other')
+
+    service.peer_drop('agent4')
+    assert {'agent3'} == subscribers('devices/other')
+    assert set() == subscribers('device')
+    assert 'device' not in service._subscription_index[''].match('device')
+
+
+def test_external_subscriptions_matches_prefixes(pubsub_service):
+
+    parameters, service = pubsub_service
+    service._ext_subscriptions['platform1'] = ['devices/campus', 'analysis']
+    service._ext_subscriptions['platform2'] = ['devices']
+    service._compile_external_subscriptions()
+
+    def publish(topic):
+        return ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish', topic, {'bus': ''}]
+
+    assert 2 == service._distribute_external(publish('devices/campus/building/all'))
+    assert 1 == service._distribute_external(publish('devices/other'))
+    assert 0 == service._distribute_external(publish('record'))
+
+    service.external_platform_drop('platform2')
+    assert 1 == service._distribute_external(publish('devices/campus/building/all'))
+    assert 0 == service._distribute_external(publish('devices/other'))
+
+
+def test_distribute_internal_serializes_payload_per_codec(pubsub_service):
+
+    parameters, service = pubsub_service
+    codec = CODECS[0]
+    service._peer_codecs['subscriber1'] = codec
+    for subscriber in ('subscriber1', 'subscriber2'):
+        service._add_peer_subscription(subscriber, '', 'devices')
+    message = {'bus': '', 'headers': {}, 'message': [{'point': 1.5}, {'point': {'units': 'F'}}]}
+    frames = ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish', 'devices/campus/device/all', message]
+
+    assert 2 == service._distribute_internal(frames)
+
+    sent = {call[0][0][0].bytes.decode('utf-8'): call[0][0]
+            for call in parameters['socket'].send_multipart.call_args_list}
+    assert sent['subscriber1'][-1].bytes == codec.dumpb(message)
+    assert sent['subscriber2'][-1].bytes == JSON_CODEC.dumpb(message)
+    assert deserialize_frames(sent['subscriber1'][1:]) == deserialize_frames(sent['subscriber2'][1:])
+
+
+def test_publish_many_distributes_batch_and_acknowledges_once(pubsub_service):
+
+    parameters, service = pubsub_service
+    service._add_peer_subscription('subscriber1', '', 'devices')
+    service._add_peer_subscription('subscriber2', '', 'devices/campus')
+    messages = [['devices/campus/device/all', {}, 1], ['devices/other', {}, 2], ['record', {}, 3]]
+    frames = ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish_many', dict(bus='', messages=messages)]
+
+    response = service.handle_subsystem(frames, 'publisher')
+
+    assert ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'request_response', 3] == response
+    sent = [deserialize_frames(call[0][0]) for call in parameters['socket'].send_multipart.call_args_list]
+    # Subscribers receive each message as a regular publish
+    assert all(frames[6] == 'publish' for frames in sent)
+    assert [('subscriber1', 'devices/campus/device/all', 1), ('subscriber1', 'devices/other', 2),
+            ('subscriber2', 'devices/campus/device/all', 1)] == \
+        sorted((frames[0], frames[7], frames[8]['message']) for frames in sent)
+    assert all(frames[8]['sender'] == 'publisher' for frames in sent)
+
+
+@pytest.mark.parametrize('messages', [
+    [['devices/a', {}]],
+    'devices/a',
+    [['devices/a', {}, 1], [None, {}, 2]],
+    [['devices/a', 'headers', 1]],
+])
+def test_publish_many_rejects_malformed_batch(pubsub_service, messages):
+
+    parameters, service = pubsub_service
+    service._add_peer_subscription('subscriber1', '', 'devices')
+    frames = ['publisher', '', 'VIP1', 'publisher', '1', 'pubsub', 'publish_many', dict(bus='', messages=messages)]
+
+    assert [] == service.handle_subsystem(frames, 'publisher')
+
+    sent = [deserialize_frames(call[0][0]) for call in parameters['socket'].send_multipart.call_args_list]
+    # Nothing is distributed, the publisher gets a single error
+    assert 1 == len(sent)
+    assert 'publisher' == sent[0][0]
+    assert 'error' == sent[0][5]
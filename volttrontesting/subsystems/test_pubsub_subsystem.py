@@ -120,3 +120,55 @@ def test_multi_unsubscribe(volttron_instance):
     gevent.sleep(1)
 
     assert subscriber_agent.subscription_callback.call_count == 0
+
+
+def test_process_callback_matches_prefixes():
+    pubsub = PubSub(core=MagicMock(), rpc_subsys=MagicMock(), peerlist_subsys=MagicMock(), owner=MagicMock())
+    pubsub.synchronize = MagicMock()
+    callback = MagicMock()
+    other_callback = MagicMock()
+    pubsub._add_subscription('devices/camp', callback)
+    pubsub._add_subscription('devices/campus/building', callback)
+    pubsub._add_subscription('devices', other_callback)
+    pubsub._add_subscription('devices', other_callback, all_platforms=True)
+    pubsub._add_subscription('analysis', other_callback)
+
+    # One call per subscribed prefix and platform, as before the index
+    pubsub._process_callback('sender', '', 'devices/campus/building1/all', {}, 1)
+    assert callback.call_count == 2
+    assert other_callback.call_count == 2
+
+    callback.reset_mock()
+    pubsub._drop_subscription('devices/camp', callback)
+    pubsub._process_callback('sender', '', 'devices/campus/building1/all', {}, 1)
+    assert callback.call_count == 1
+    assert not pubsub.synchronize.called
+
+    pubsub._drop_subscription(None, callback)
+    pubsub._drop_subscription(None, other_callback)
+    pubsub._drop_subscription(None, other_callback, platform='all')
+    assert not pubsub._subscription_index
+    pubsub._process_callback('sender', '', 'devices/campus/building1/all', {}, 1)
+    assert pubsub.synchronize.called
+
+
+def test_publish_many_falls_back_to_publish_on_old_router():
+    core = MagicMock()
+    core.spawn.side_effect = lambda func, *args: func(*args)
+    pubsub = PubSub(core=core, rpc_subsys=MagicMock(), peerlist_subsys=MagicMock(), owner=MagicMock())
+    pubsub._parameters_needed = False
+    pubsub.publish = MagicMock()
+    pubsub.publish.return_value.get.return_value = 2
+    messages = [('devices/a', None, 1), ('devices/b', {}, 2)]
+
+    # The router negotiated a codec in the hello, it handles publish_many
+    pubsub.vip_socket = MagicMock()
+    pubsub.publish_many('pubsub', messages)
+    assert 'publish_many' == pubsub.vip_socket.send_vip.call_args[0][2][0]
+    assert not pubsub.publish.called
+
+    # Older routers do not negotiate a codec, the messages are published one by one
+    pubsub.vip_socket = MagicMock(codec=None)
+    assert 4 == pubsub.publish_many('pubsub', messages).get(timeout=1)
+    assert not pubsub.vip_socket.send_vip.called
+    assert ['devices/a', 'devices/b'] == [call[0][1] for call in pubsub.publish.call_args_list]
@@ -1,5 +1,10 @@
+import pytest
+from volttron.platform import jsonapi
+from mock import MagicMock
 from zmq.sugar.frame import Frame
-from volttron.utils.frame_serialization import deserialize_frames, serialize_frames
+from volttron.platform.vip.router import BaseRouter
+from volttron.utils.frame_serialization import (CODECS, JSON_CODEC, deserialize_frames, get_codec,
+                                                negotiate_codec, serialize_frames, supported_codecs)
 
 
 def test_can_deserialize_homogeneous_string():
@@ -32,3 +37,88 @@ def test_mixed_array():
 
     for r in range(len(original)):
         assert original[r] == after_deserialize[r], f"Element {r} is not the same."
+
+
+@pytest.mark.parametrize('codec', CODECS, ids=lambda codec: codec.name)
+def test_codec_round_trip(codec):
+    original = ["publish", "devices/campus/building/device/all",
+                dict(bus='', headers={'Date': '2020-01-01T00:00:00+00:00'},
+                     message=[{'point1': 1.5, 'point2': 3, 'point3': None, 'point4': True},
+                              {'point1': {'units': 'F', 'type': 'float'}}])]
+    frames = serialize_frames(original, codec)
+    if codec.tag:
+        assert frames[2].bytes.startswith(codec.tag)
+
+    # Frames are decoded whatever the codec, without negotiation
+    assert original == deserialize_frames(frames)
+
+
+@pytest.mark.parametrize('codec', CODECS, ids=lambda codec: codec.name)
+@pytest.mark.parametrize('original', [
+    [{'temp': float('nan'), 'high': float('inf'), 'low': float('-inf'), 'none': None}],
+    [{1: 'a', 2.5: 'b', True: 'c', None: 'd', 'e': {3: [4, (5, 6)]}}],
+    [{'big': 2 ** 64, 'small': -2 ** 70, 'max': 2 ** 63 - 1}],
+], ids=['non_finite', 'non_str_keys', 'big_ints'])
+def test_codec_decodes_same_values_as_json(codec, original):
+    expected = deserialize_frames(serialize_frames(original, JSON_CODEC))
+    decoded = deserialize_frames(serialize_frames(original, codec))
+    # NaN is not equal to itself, compare the json representations
+    assert jsonapi.dumps(expected) == jsonapi.dumps(decoded)
+
+
+def test_orjson_keeps_null_values():
+    codec = get_codec('orjson')
+    if codec.name != 'orjson':
+        pytest.skip('orjson is not installed')
+    # None readings and strings containing null are encoded by orjson, only
+    # non finite floats go through json
+    assert codec.dumpb({'point': None, 'topic': 'devices/nullable'}) == \
+        b'{"point":null,"topic":"devices/nullable"}'
+    assert codec.dumpb([None, {'temp': float('nan')}]) == \
+        jsonapi.dumpb([None, {'temp': float('nan')}])
+
+
+def test_json_frames_are_decoded_by_every_peer():
+    frames = serialize_frames([dict(alpha=[1, 2.5, "x"])])
+    assert frames[0].bytes == b'{"alpha": [1, 2.5, "x"]}'
+    assert [dict(alpha=[1, 2.5, "x"])] == deserialize_frames(frames)
+    # Values orjson does not parse fall back to the stdlib decoder
+    assert [[float('inf'), 2 ** 70]] == deserialize_frames([Frame(b'[Infinity, 1180591620717411303424]')])
+
+
+def test_negotiate_codec():
+    assert JSON_CODEC is negotiate_codec([])
+    assert JSON_CODEC is negotiate_codec(['unknown'])
+    assert JSON_CODEC is get_codec('unknown')
+    assert CODECS[0] is negotiate_codec(list(reversed(supported_codecs())))
+    assert supported_codecs()[-1] == 'json'
+
+
+class _Router(BaseRouter):
+    def __init__(self):
+        super(_Router, self).__init__(context=MagicMock())
+        self.socket = MagicMock()
+        self.socket.identity = 'router'
+
+
+def test_router_negotiates_codec_in_hello():
+    router = _Router()
+    router.route(['agent1', '', 'VIP1', '', '1', 'hello', 'hello', supported_codecs()])
+    welcome = router.socket.send_multipart.call_args[0][0]
+    assert [f.bytes.decode('utf-8') for f in welcome[5:]] == ['hello', 'welcome', '1.0', 'router', 'agent1',
+                                                              CODECS[0].name]
+    assert CODECS[0] is router._codecs['agent1']
+
+    # Older agents do not advertise codecs and get the same welcome as before
+    router.route(['agent2', '', 'VIP1', '', '1', 'hello', 'hello'])
+    welcome = router.socket.send_multipart.call_args[0][0]
+    assert len(welcome) == 10
+    assert 'agent2' not in router._codecs
+
+    # An older agent reconnecting under the identity of a newer one gets JSON frames
+    router.route(['agent1', '', 'VIP1', '', '1', 'hello', 'hello'])
+    assert 'agent1' not in router._codecs
+
+    router.route(['agent1', '', 'VIP1', '', '1', 'hello', 'hello', supported_codecs()])
+    router._drop_peer('agent1')
+    assert 'agent1' not in router._codecs
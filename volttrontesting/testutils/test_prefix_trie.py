@@ -0,0 +1,44 @@
+import random
+
+from volttron.utils.prefix_trie import PrefixTrie
+
+
+def test_matches_startswith():
+    prefixes = ['', 'devices', 'devices/', 'devices/campus', 'devices/campus/building1/dev',
+                'devices/camp', 'analysis/', 'devices/campus/building1/device1/all', 'record']
+    trie = PrefixTrie(prefixes)
+    topics = ['devices/campus/building1/device1/all', 'devices', 'device', 'devices/campus2/x',
+              'analysis', 'analysis/', 'record/a', '', 'devices/campus/building1/dev']
+    for topic in topics:
+        assert sorted(trie.match(topic)) == sorted(p for p in prefixes if topic.startswith(p)), topic
+
+
+def test_random_matches_startswith():
+    rand = random.Random(0)
+    alphabet = ['a', 'ab', 'abc', 'b', '', 'a/b', '/']
+    prefixes = {''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 4))) for _ in range(200)}
+    trie = PrefixTrie()
+    for prefix in prefixes:
+        trie.add(prefix)
+    removed = set(rand.sample(sorted(prefixes), 50))
+    for prefix in removed:
+        trie.remove(prefix)
+    prefixes -= removed
+    assert len(trie) == len(prefixes)
+    for prefix in prefixes:
+        assert prefix in trie
+    for _ in range(500):
+        topic = ''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 6)))
+        assert sorted(trie.match(topic)) == sorted(p for p in prefixes if topic.startswith(p)), topic
+
+
+def test_add_remove():
+    trie = PrefixTrie()
+    trie.add('devices/campus')
+    trie.add('devices/campus')
+    assert len(trie) == 1
+    trie.remove('devices/other')
+    trie.remove('devices/campus')
+    assert len(trie) == 0
+    assert 'devices/campus' not in trie
+    assert trie.match('devices/campus') == []